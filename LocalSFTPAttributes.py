@@ -1,10 +1,21 @@
+from collections import deque as _deque
+from concurrent.futures import Future as _Future, ThreadPoolExecutor as _ThreadPoolExecutor
+from itertools import chain as _chain
 import os as _os
+from stat import S_IFDIR as _S_IFDIR, S_IFREG as _S_IFREG, S_ISDIR as _S_ISDIR, S_ISREG as _S_ISREG
 
 class LocalSFTPAttributes:
-	"""Mimics paramiko.sftp_attr.SFTPAttributes for local files"""
+	"""
+	Mimics paramiko.sftp_attr.SFTPAttributes for local files.
+	Uses __slots__ (no per-instance __dict__) as listings of huge folders hold one instance per entry
+	"""
+	__slots__ = ("filename", "st_mode", "st_size", "st_uid", "st_gid", "st_atime", "st_mtime")
+
 	def __init__(self, entry: _os.DirEntry):
-		info = entry.stat(follow_symlinks=False)
 		self.filename = entry.name
+		self._setStat(entry.stat(follow_symlinks=False))
+
+	def _setStat(self, info: _os.stat_result):
 		self.st_mode  = info.st_mode
 		self.st_size  = info.st_size
 		self.st_uid   = info.st_uid
@@ -37,21 +48,153 @@ class LocalSFTPAttributes:
 		obj.st_mtime = st_mtime
 		return obj
 
+	@classmethod
+	def from_stat(cls, filename: str, info: _os.stat_result):
+		"""Constructs a LocalSFTPAttributes from an os.stat_result"""
+		return cls.from_values(filename, info.st_mode, info.st_size, info.st_uid, info.st_gid, int(info.st_atime), int(info.st_mtime))
+
+	@classmethod
+	def from_sftp_attributes(cls, attr):
+		"""Converts a paramiko.SFTPAttributes (i.e. from sftp.listdir_iter) dropping everything that is not used"""
+		return cls.from_values(attr.filename, attr.st_mode, attr.st_size, attr.st_uid, attr.st_gid, attr.st_atime, attr.st_mtime)
+
+class LazyLocalSFTPAttributes(LocalSFTPAttributes):
+	"""
+	LocalSFTPAttributes that only stats the entry when one of the st_* attributes is read for the first
+	time. The name and the type (isFile/isDir) come from the os.DirEntry which on most filesystems
+	doesn't cost a syscall, so entries rejected by name never get stat'ed (which matters a lot on
+	network mounted folders). The DirEntry itself is not kept (it's much bigger than the stats) - only
+	the type bits and the path of the folder, which is the same object for the whole listing
+	"""
+	__slots__ = ("folder", "kind")
+
+	def __init__(self, entry: _os.DirEntry, folder: str):
+		self.filename = entry.name
+		self.folder = folder
+		self.kind = _S_IFDIR if entry.is_dir(follow_symlinks=False) else (_S_IFREG if entry.is_file(follow_symlinks=False) else 0)
+
+	def __getattr__(self, name: str): # only called for slots that were not set yet
+		folder = self.folder
+		if folder is None or name not in LocalSFTPAttributes.__slots__:
+			raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+		self._setStat(_os.lstat(_os.path.join(folder, self.filename)))
+		self.folder = None
+		return getattr(self, name)
+
+	def __repr__(self):
+		return f"<LazyLocalSFTPAttributes filename={self.filename!r}{" (not stat'ed)" if self.folder is not None else f" size={self.st_size}"}>"
+
+	def isFile(self) -> bool:
+		return self.kind == _S_IFREG if self.folder is not None else _S_ISREG(self.st_mode)
+
+	def isDir(self) -> bool:
+		return self.kind == _S_IFDIR if self.folder is not None else _S_ISDIR(self.st_mode)
+
+# On Windows the stats come with the listing (os.DirEntry.stat costs no syscall) so nothing is gained
+# by stat'ing lazily there
+_EAGER_STATS = _os.name == "nt"
+
 def local_listdir_attr(path: str):
 	"""
 	Local equivalent of sftp.listdir_attr(path)
-	Returns a list of LocalSFTPAttributes by default
+	Returns a list of LazyLocalSFTPAttributes (entries are stat'ed on the first access to their stats)
 	"""
-	entries = []
-	with _os.scandir(path) as it:
-		for entry in it:
-			entries.append(LocalSFTPAttributes(entry))
-	return entries
+	return list(_scandirAttrGen(_os.scandir(path), path))
+
+def local_lstat_attr(path: str) -> LocalSFTPAttributes | None:
+	"""
+	Entry of a single path without listing its folder (see filterEngine.CompiledFilters.childTargets).
+	None if it doesn't exist
+	"""
+	try:
+		info = _os.lstat(path)
+	except (FileNotFoundError, NotADirectoryError):
+		return None
+	return LocalSFTPAttributes.from_stat(_os.path.basename(path), info)
 
 def local_listdir_attr_gen(path: str):
 	"""
-	Generator equivalent of local_listdir_attr
+	Generator equivalent of local_listdir_attr.
+	The folder is opened right away so errors (i.e. PermissionError) are raised by the call itself and
+	not by the first next()
 	"""
-	with _os.scandir(path) as it:
+	return _scandirAttrGen(_os.scandir(path), path)
+
+def _scandirAttrGen(it, path: str):
+	with it:
 		for entry in it:
-			yield LocalSFTPAttributes(entry)
+			yield LocalSFTPAttributes(entry) if _EAGER_STATS else LazyLocalSFTPAttributes(entry, path)
+
+def _statEntries(entries: list[_os.DirEntry]):
+	return [LocalSFTPAttributes(entry) for entry in entries]
+
+class ParallelLocalLister:
+	"""
+	Local listings for folders on network mounts (NFS, SMB/CIFS) where every stat is a round trip:
+	- the stats of folders with at least `minParallel` entries are spread over `threads` threads
+	- `prefetch` queues folders the walker is going to list soon and up to `threads` of them are listed
+	  in the background at any time. The most recently queued folders go first which matches the
+	  depth-first order of the walker
+
+	- `forget` drops the prefetched listings of the subfolders of a folder the walker is done with (the
+	  ones it skipped), so they don't pile up until the end of the run
+
+	Listings are lists of (eagerly stat'ed) LocalSFTPAttributes. Errors are raised by listdir_attr just
+	like with local_listdir_attr. Only one thread (the walker) may call the methods
+	"""
+	def __init__(self, threads: int, minParallel = 64):
+		self.threads = threads
+		self.minParallel = minParallel
+		self.statExecutor = _ThreadPoolExecutor(threads) # separate pools so listings waiting for stats can't starve them
+		self.listExecutor = _ThreadPoolExecutor(threads)
+		self.queue: _deque[str] = _deque()
+		self.queued: set[str] = set()
+		self.listings: dict[str, _Future] = {}
+		self.prefetched: dict[str, list[str]] = {} # prefetched paths by their parent folder
+
+	def listdir_attr(self, path: str) -> list[LocalSFTPAttributes]:
+		self.queued.discard(path)
+		future = self.listings.pop(path, None)
+		try:
+			return future.result() if future is not None else self._listdir_attr(path)
+		finally:
+			self._fill()
+
+	def prefetch(self, paths: list[str]):
+		paths = [path for path in paths if path not in self.queued and path not in self.listings]
+		self.queue.extendleft(reversed(paths))
+		self.queued.update(paths)
+		for path in paths:
+			self.prefetched.setdefault(_os.path.dirname(path), []).append(path)
+		self._fill()
+
+	def forget(self, folder: str):
+		for path in self.prefetched.pop(folder.rstrip("/") or "/", ()):
+			self.queued.discard(path) # _fill skips it
+			future = self.listings.pop(path, None)
+			if future is not None:
+				future.cancel() # too late when it's running - then only the result is dropped
+
+	def _fill(self):
+		running = sum(not future.done() for future in self.listings.values())
+		while running < self.threads and self.queue:
+			path = self.queue.popleft()
+			if path not in self.queued: # already listed by the walker itself
+				continue
+			self.queued.discard(path)
+			self.listings[path] = self.listExecutor.submit(self._listdir_attr, path)
+			running += 1
+
+	def _listdir_attr(self, path: str) -> list[LocalSFTPAttributes]:
+		with _os.scandir(path) as it:
+			entries = list(it)
+		if len(entries) < self.minParallel:
+			return _statEntries(entries)
+
+		chunkSize = -(-len(entries) // (self.threads * 4)) # a few chunks per thread so a slow one doesn't hold back the rest
+		chunks = [entries[i:i + chunkSize] for i in range(0, len(entries), chunkSize)]
+		return list(_chain.from_iterable(self.statExecutor.map(_statEntries, chunks)))
+
+	def close(self):
+		for executor in (self.listExecutor, self.statExecutor):
+			executor.shutdown(wait=False, cancel_futures=True)
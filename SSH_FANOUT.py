@@ -0,0 +1,263 @@
+import sys; from pathlib import Path; p = Path(__file__).resolve().parent; __package__ = p.name; sys.path.append(p.parent.as_posix()) # To be able to use relative imports
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import posixpath
+import queue
+import threading
+from time import perf_counter
+
+import paramiko
+from termcolor import colored as clr, cprint
+
+start = perf_counter()
+
+from .argparseUtils import ArgumentParser_ColoredError, COMMON_FORMATTER_CLASS
+from .commonConstants import COLOR_ERROR, COLOR_OK, COLOR_WARN
+from .fileUtils import assertFolderExists, isDir, isFile
+from .LocalSFTPAttributes import local_listdir_attr, LocalSFTPAttributes
+from .SimpleError import SimpleError
+from .sshUtils import assertRemoteFolderExists, getSSH, remoteHasPython, RemoteListDir, remoteMkdir
+from .transferUtils import parseByteRate, TokenBucket
+
+CHUNK_SIZE = 1024 * 1024
+PARTIAL_SUFFIX = ".fanout-part" # files are written under a temporary name and renamed over the old copy once complete
+QUEUE_CHUNKS = 32 # chunks a host may lag behind the reading before the reading waits for it
+
+parser = ArgumentParser_ColoredError(
+	description="Copies a local folder tree to the same remote folder on many hosts at once. The source is listed and read only once - every chunk read from the disk is sent to all the hosts that need the file",
+	formatter_class=COMMON_FORMATTER_CLASS,
+)
+
+required = parser.add_argument_group("Required arguments")
+parser._action_groups = [required, parser._optionals]
+
+required.add_argument("-u", "--username"     , required=True, help="Remote username")
+required.add_argument("-H", "--hostname"     , required=True, action="append", nargs="+", help="Destination host's address. You can specify multiple if host can appear under multiple adresses. Specify -H once for every destination host", dest="hosts", metavar="HOSTNAME")
+required.add_argument("-l", "--local-folder" , required=True, help="Local source folder", dest="localFolder")
+required.add_argument("-r", "--remote-folder", required=True, help="Remote destination folder's absolute path (the same on every host)", dest="remoteFolder")
+
+parser._optionals.title = "Optional arguments"
+
+parser.add_argument("-p", "--password", default=None         , help="Remote password")
+parser.add_argument("-P", "--port"    , default=22, type=int , help="Remote port (default: 22)")
+parser.add_argument("-T", "--timeout" , default=5.0, type=float, help="TCP 3-way handshake timeout in seconds (default: 5.0)", metavar="SECONDS")
+parser.add_argument("-d", "--dry-run" , action="store_true"  , help="Only print what would be copied to every host", dest="dryRun")
+parser.add_argument("-b", "--bwlimit" , default=""           , help="Limit the bandwidth of all hosts combined to RATE bytes per second. Accepts K, M, G suffixes (i.e. 500K, 10M)", metavar="RATE")
+
+args = parser.parse_args()
+
+username     : str             = args.username
+hosts        : list[list[str]] = args.hosts
+localFolder  : str             = args.localFolder
+remoteFolder : str             = args.remoteFolder
+password     : str             = args.password
+port         : int             = args.port
+timeout      : float           = args.timeout
+dryRun       : bool            = args.dryRun
+bwlimit      : str             = args.bwlimit
+
+bandwidth = TokenBucket(parseByteRate(bwlimit)) if bwlimit else None
+
+assertFolderExists(localFolder)
+localFolder  = os.path.abspath(localFolder).replace("\\", "/").rstrip("/") + "/"
+remoteFolder = remoteFolder.replace("\\", "/").rstrip("/") + "/"
+
+def listTree(listFolder, folder: str) -> dict[str, list[LocalSFTPAttributes]]:
+	""" Listings of `folder` and of all the folders below it by their path relative to it ("" is `folder` itself, the others end with "/") """
+	tree = {}
+	stack = [""]
+	while stack:
+		rel = stack.pop()
+		entries = tree[rel] = list(listFolder(folder + rel))
+		stack.extend(rel + entry.filename + "/" for entry in entries if isDir(entry))
+	return tree
+
+class Host:
+	""" One destination host. Everything that goes wrong with it ends up in `error` and stops only this host """
+	def __init__(self, hostnames: list[str]):
+		self.hostnames = hostnames
+		self.name = hostnames[0]
+		self.ssh: paramiko.SSHClient | None = None
+		self.sftp: paramiko.SFTPClient | None = None
+		self.folders: list[str] = []   # to create, parents first
+		self.files: set[str] = set()   # relative paths of the files to copy
+		self.bytes = 0
+		self.copied = 0
+		self.failedFiles: list[str] = [] # relative paths of the files that could not be read locally
+		self.error: str | None = None
+		self.queue: queue.Queue = queue.Queue(QUEUE_CHUNKS)
+		self.thread: threading.Thread | None = None
+
+	def fail(self, error: Exception | str):
+		if self.error is None:
+			self.error = str(error) or type(error).__name__
+			cprint(f"{self.name}: {self.error}", COLOR_ERROR)
+
+	def connect(self):
+		""" Connects and plans what to copy. Runs for all the hosts at the same time """
+		try:
+			self.ssh, _ = getSSH(username=username, hostnames=self.hostnames, password=password, timeout=timeout, port=port)
+			self.sftp = self.ssh.open_sftp()
+			assertRemoteFolderExists(self.sftp, remoteFolder)
+
+			pythonStr = remoteHasPython(self.ssh, throwOnNotFound=False)
+			if pythonStr: # one request for the whole tree
+				rld = RemoteListDir(self.ssh, pythonStr)
+				destTree = rld.listTree(remoteFolder)
+				rld.stdin.close()
+			else:
+				destTree = listTree(lambda path: map(LocalSFTPAttributes.from_sftp_attributes, self.sftp.listdir_attr(path)), remoteFolder)
+			self.plan(destTree)
+		except SimpleError as e:
+			self.fail(e.args[0] if e.args and e.args[0] else "Could not connect")
+		except Exception as e:
+			self.fail(e)
+
+	def plan(self, destTree: dict[str, list[LocalSFTPAttributes]]):
+		for rel in sorted(sourceTree):
+			destEntries = {entry.filename: entry for entry in destTree.get(rel, ())}
+			if rel and rel not in destTree:
+				self.folders.append(rel)
+			for entry in sourceTree[rel]:
+				if not isFile(entry):
+					continue
+				destEntry = destEntries.get(entry.filename)
+				if destEntry and isFile(destEntry) and destEntry.st_size == entry.st_size and destEntry.st_mtime == entry.st_mtime:
+					continue # the same file is already there
+				self.files.add(rel + entry.filename)
+				self.bytes += entry.st_size
+
+	def replace(self, partialPath: str, path: str):
+		""" Renames the complete file over the old copy """
+		try:
+			self.sftp.posix_rename(partialPath, path) # atomic, like rename on POSIX systems
+		except IOError as e:
+			if "unsupported" not in str(e).lower():
+				raise
+			try: self.sftp.remove(path) # plain SFTP rename doesn't replace files
+			except FileNotFoundError: pass
+			self.sftp.rename(partialPath, path)
+
+	def removePartial(self, remoteFile, partialPath: str):
+		try:
+			remoteFile.close()
+			self.sftp.remove(partialPath)
+		except Exception:
+			pass
+
+	def run(self):
+		""" Creates the missing folders and then writes the files streamed to its queue (see sendFile) """
+		try:
+			for rel in self.folders:
+				remoteMkdir(self.sftp, remoteFolder + rel) # created in the meantime is fine too
+		except Exception as e:
+			self.fail(e)
+
+		remoteFile = None
+		partialPath = ""
+		while True:
+			message = self.queue.get()
+			if message is None:
+				break
+			if self.error is not None: # keep taking the messages so the reading never waits for a failed host
+				continue
+
+			kind, value = message
+			try:
+				if kind == "open":
+					folder, name = posixpath.split(remoteFolder + value)
+					partialPath = f"{folder}/.{name}{PARTIAL_SUFFIX}"
+					remoteFile = self.sftp.open(partialPath, "wb")
+					remoteFile.set_pipelined(True) # don't wait for every chunk to be acknowledged
+				elif kind == "chunk":
+					if bandwidth: bandwidth.consume(len(value))
+					remoteFile.write(value)
+				elif kind == "close":
+					path, times = value
+					remoteFile.close()
+					remoteFile = None
+					self.sftp.utime(partialPath, times)
+					self.replace(partialPath, remoteFolder + path)
+					self.copied += 1
+				else: # "abort" - the local file could not be read so the old copy stays as it was
+					self.removePartial(remoteFile, partialPath)
+					remoteFile = None
+					self.failedFiles.append(value)
+			except Exception as e:
+				self.fail(e)
+
+		if remoteFile is not None: # the host failed in the middle of a file
+			self.removePartial(remoteFile, partialPath)
+
+	def close(self):
+		for thing in (self.sftp, self.ssh):
+			if thing is not None:
+				try: thing.close()
+				except Exception: pass
+
+def sendFile(rel: str, entry: LocalSFTPAttributes, targets: list[Host]):
+	""" Reads the file once and hands every chunk to all the `targets` """
+	for host in targets:
+		host.queue.put(("open", rel))
+	try:
+		with open(localFolder + rel, "rb") as file:
+			while chunk := file.read(CHUNK_SIZE):
+				for host in targets:
+					if host.error is None:
+						host.queue.put(("chunk", chunk))
+	except OSError as e:
+		cprint(f"{clr("Warning!", COLOR_WARN)} Could not read {rel}: {e.strerror}", COLOR_WARN)
+		for host in targets:
+			host.queue.put(("abort", rel))
+		return
+	for host in targets:
+		host.queue.put(("close", (rel, (entry.st_atime, entry.st_mtime))))
+
+sourceTree = listTree(local_listdir_attr, localFolder)
+sourceFiles = {rel + entry.filename: entry for rel, entries in sourceTree.items() for entry in entries if isFile(entry)}
+print(f"Source: {localFolder} ({len(sourceFiles)} files in {len(sourceTree)} folders)\n")
+
+destinations = [Host(hostnames) for hostnames in hosts]
+with ThreadPoolExecutor(max_workers=len(destinations)) as executor:
+	for destination in destinations:
+		executor.submit(destination.connect)
+
+print()
+connected = [destination for destination in destinations if destination.error is None]
+for destination in connected:
+	print(f"{destination.name}: {len(destination.files)} file(s), {destination.bytes} bytes, {len(destination.folders)} new folder(s)")
+
+if not dryRun:
+	for destination in connected:
+		destination.thread = threading.Thread(target=destination.run, daemon=True)
+		destination.thread.start()
+
+	print()
+	for rel in sorted(sourceFiles):
+		targets = [destination for destination in connected if rel in destination.files and destination.error is None]
+		if targets:
+			print(f"{rel} -> {len(targets)} host(s)")
+			sendFile(rel, sourceFiles[rel], targets)
+
+	for destination in connected:
+		destination.queue.put(None)
+	for destination in connected:
+		destination.thread.join()
+
+for destination in destinations:
+	destination.close()
+
+print()
+for destination in destinations:
+	if destination.error is not None:
+		print(f"{clr(destination.name, COLOR_ERROR)}: failed - {destination.error}")
+	elif destination.failedFiles:
+		print(f"{clr(destination.name, COLOR_ERROR)}: copied {destination.copied} file(s), {len(destination.failedFiles)} failed (the old copies were kept): {", ".join(destination.failedFiles)}")
+	else:
+		print(f"{clr(destination.name, COLOR_OK)}: {"would copy" if dryRun else "copied"} {len(destination.files) if dryRun else destination.copied} file(s)")
+
+print(f"\nExecution time: {perf_counter() - start:.3f} s")
+
+if any(destination.error is not None or destination.failedFiles for destination in destinations):
+	exit(1)
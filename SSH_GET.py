@@ -4,6 +4,7 @@ import argparse
 import json
 import os
 import posixpath
+from stat import S_IFDIR, S_IFREG, S_ISDIR
 
 from termcolor import colored as clr
 
@@ -11,7 +12,8 @@ from .argparseUtils import ArgumentParser_ColoredError, COMMON_FORMATTER_CLASS
 from .commonConstants import COLOR_OK
 from .mySystem import WINDOWS
 from .SimpleError import SimpleError
-from .sshUtils import getSSH
+from .sshUtils import getSSH, SFTPPool
+from .transferUtils import parseByteRate, parseJobs, sftpGet, TokenBucket, TransferPool
 
 TITLE = "SSH GET"
 
@@ -37,6 +39,8 @@ parser.add_argument("-P", "--port"          , default=22, type=int , help="Remot
 parser.add_argument("-T", "--timeout"       , default=5, type=float, help="TCP 3-way handshake timeout in seconds (default: 5.0)")
 parser.add_argument("-t", "--preserve-times", action="store_true"  , help="If set, modification times will be preserved", dest="preserveTimes")
 parser.add_argument("-d", "--dont-close"    , action="store_true"  , help="Don't auto-close console window at the end if no error occurred. You will have to close it manually or by pressing ENTER", dest="dontClose")
+parser.add_argument("-b", "--bwlimit"       , default=""           , help="Limit the bandwidth of all transfers combined to RATE bytes per second. Accepts K, M, G suffixes (i.e. 500K, 10M)", metavar="RATE")
+parser.add_argument("-j", "--jobs"          , default="4"          , help='Number of files downloaded at the same time, each over its own SFTP channel (default: 4). "auto" or "auto:MAX" grows and shrinks the number of in-flight transfers (up to MAX, default 16) based on measured throughput and round-trip time', metavar="N")
 
 args = parser.parse_args()
 
@@ -49,52 +53,91 @@ port                 : int   = args.port
 timeout              : float = args.timeout
 preserveTimes        : bool  = args.preserveTimes
 dontClose            : bool  = args.dontClose
+bwlimit              : str   = args.bwlimit
+jobs                 : str   = args.jobs
+
+bandwidth = TokenBucket(parseByteRate(bwlimit)) if bwlimit else None
+maxJobs, adaptiveJobs = parseJobs(jobs)
 
 if not os.path.isdir(localFolder):
 	raise SimpleError(f'Folder "{localFolder}" does not exist')
 else:
 	localFolder = localFolder.replace("\\", "/")
 
-ssh, thereWasSSHError = getSSH(username, hostname, password, timeout, port)
+ssh, thereWasSSHError = getSSH(username=username, hostnames=hostname, password=password, timeout=timeout, port=port)
 
-stdIn, stdOut, stdErr = ssh.exec_command(f'python "{remoteGetFilesScript}"')
+sftp = ssh.open_sftp()
+sftpPool = SFTPPool(ssh, sftp)
+transferPool = TransferPool(maxJobs, adaptiveJobs)
 
-exitStatus = stdOut.channel.recv_exit_status() # Wait for command to finish
+stdIn, stdOut, stdErr = ssh.exec_command(f'python "{remoteGetFilesScript}"')
 
-if exitStatus != 0: # Command failed
+def remoteFailed(exitStatus: int):
 	if exitStatus == 69: # (¬‿¬)
 		print(stdOut.read().decode("utf-8").strip())
 		raise SimpleError("No files/folders selected")
 	errorOutput = stdErr.read().decode("utf-8").strip()
 	raise RuntimeError(f"Remote command failed with exit code {exitStatus}:\n{errorOutput}")
 
-rawOutput = stdOut.read().decode("utf-8")
-try:
-	obj = json.loads(rawOutput)
-except json.JSONDecodeError as e:
-	ssh.close()
-	raise RuntimeError(f"Failed to parse JSON from remote script: {e}\nOutput:\n{rawOutput}")
-
-sftp = ssh.open_sftp()
-
-baseFolder: str       = obj["baseFolder"]
-subFolders: list[str] = obj["subFolders"]
-files:      list[str] = obj["files"]
-
-for subFolder in subFolders:
-	fullPath = posixpath.join(localFolder, subFolder)
-	os.mkdir(fullPath)
+def parseLine(line: str):
+	try:
+		return json.loads(line)
+	except json.JSONDecodeError as e:
+		ssh.close()
+		raise RuntimeError(f"Failed to parse JSON from remote script: {e}\nOutput:\n{line}")
+
+# The remote script prints the entries while it walks the selection (see getSelectedFilesFromExplorerRecurseStdOut.py) so
+# the downloads start right away. The first line is {"baseFolder": PATH} and every entry is [relPath, size, mode, atime, mtime, sparse]
+# (older versions of the script didn't send `sparse`)
+firstLine = stdOut.readline()
+if not firstLine.strip(): # nothing selected or the script failed before printing anything
+	remoteFailed(stdOut.channel.recv_exit_status())
+
+header = parseLine(firstLine)
+baseFolder: str = header["baseFolder"]
+if "files" in header: # older versions of the script printed everything at once (and only the paths)
+	entries = (
+		[entry if isinstance(entry, list) else [entry, 0, S_IFDIR, None, None] for entry in header["subFolders"]] +
+		[entry if isinstance(entry, list) else [entry, 0, S_IFREG, None, None] for entry in header["files"]]
+	)
+else:
+	entries = map(parseLine, stdOut)
 
-print("Getting files:\n")
-for file in files:
+def downloadFile(file: str, atime: int | None, mtime: int | None, sparse: bool):
+	sftp = sftpPool.get() # may run in a worker thread (-j/--jobs)
 	remotePath = posixpath.join(baseFolder , file)
 	localPath  = posixpath.join(localFolder, file)
-	sftp.get(remotePath, localPath)
+	sftpGet(sftp, remotePath, localPath, bandwidth, lambda path: sparse) # the remote script told if the file has holes
 	if preserveTimes:
-		info = sftp.stat(remotePath)
-		os.utime(localPath, (info.st_atime, info.st_mtime))
+		if mtime is None: # no times in the listing
+			info = sftp.stat(remotePath)
+			atime, mtime = info.st_atime, info.st_mtime
+		os.utime(localPath, (atime, mtime))
 	print(file)
-print(f"\nSuccessfully got {clr(len(files), COLOR_OK)} file(s)\n")
+
+print("Getting files:\n")
+subFolders = []
+fileCount = 0
+for relPath, size, mode, atime, mtime, *sparse in entries:
+	if S_ISDIR(mode): # comes before everything inside it
+		os.makedirs(posixpath.join(localFolder, relPath), exist_ok=True)
+		subFolders.append((relPath, atime, mtime))
+	else:
+		transferPool.submit(downloadFile, size, relPath, atime, mtime, bool(sparse and sparse[0]))
+		fileCount += 1
+transferPool.join()
+transferPool.shutdown()
+sftpPool.close()
+
+exitStatus = stdOut.channel.recv_exit_status()
+if exitStatus != 0: # the walk failed half way
+	remoteFailed(exitStatus)
+
+if preserveTimes: # after the files as creating them changed the times of their folders - deepest first
+	for subFolder, atime, mtime in reversed(subFolders):
+		if mtime is not None:
+			os.utime(posixpath.join(localFolder, subFolder), (atime, mtime))
+print(f"\nSuccessfully got {clr(fileCount, COLOR_OK)} file(s)\n")
 
 sftp.close()
 ssh.close()
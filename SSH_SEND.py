@@ -5,7 +5,6 @@ import os
 import posixpath
 import time
 
-import paramiko
 from termcolor import colored as clr
 
 start = time.time()
@@ -15,7 +14,8 @@ from .commonConstants import COLOR_ERROR, COLOR_ERROR_BACK, COLOR_OK, COLOR_WARN
 from .fileUtils import isDir, isFile, LocalDirEntry
 from .mySystem import WINDOWS
 from .SimpleError import SimpleError
-from .sshUtils import assertRemoteFolderExists, getSSH, remoteMkdir
+from .sshUtils import assertRemoteFolderExists, getSSH, remoteHasPython, RemoteListDir, remoteMkdir, SFTPPool
+from .transferUtils import parseByteRate, parseJobs, sftpPut, TokenBucket, TransferPool
 
 TITLE = "SSH SEND"
 
@@ -41,6 +41,8 @@ parser.add_argument("-0", "--zero-file"     , action="store_true" , help="Create
 parser.add_argument("-c", "--end-command"   , help="Command to run on the remote machine after file transfer", dest="endCommand")
 parser.add_argument("-d", "--dont-close"    , action="store_true" , help="Don't auto-close console window at the end if no error occurred. You will have to close it manually or by pressing ENTER", dest="dontClose")
 parser.add_argument("-i", "--hide-title"    , action="store_true" , help=f"Hide window title and replace it with {TITLE}", dest="hideTitle")
+parser.add_argument("-b", "--bwlimit"       , default=""          , help="Limit the bandwidth of all transfers combined to RATE bytes per second. Accepts K, M, G suffixes (i.e. 500K, 10M)", metavar="RATE")
+parser.add_argument("-j", "--jobs"          , default="4"         , help='Number of files sent at the same time, each over its own SFTP channel (default: 4). "auto" or "auto:MAX" grows and shrinks the number of in-flight transfers (up to MAX, default 16) based on measured throughput and round-trip time', metavar="N")
 # parser.add_argument("-n", "--handle-non-abs-paths", action="store_true" , help=f"If a file path does not start with --prefix try to recursively search for it in --search-root folder", dest="handleNonAbsPaths")
 
 args = parser.parse_args()
@@ -56,8 +58,13 @@ zeroFile      : bool  = args.zeroFile
 endCommand    : str   = args.endCommand
 dontClose     : bool  = args.dontClose
 hideTitle     : bool  = args.hideTitle
+bwlimit       : str   = args.bwlimit
+jobs          : str   = args.jobs
 # handleNonAbsPaths : bool  = args.handleNonAbsPaths
 
+bandwidth = TokenBucket(parseByteRate(bwlimit)) if bwlimit else None
+maxJobs, adaptiveJobs = parseJobs(jobs)
+
 if WINDOWS:
 	import ctypes
 
@@ -81,27 +88,27 @@ ssh, thereWasSSHError = getSSH(
 	port      = port    ,
 )
 sftp = ssh.open_sftp()
+sftpPool = SFTPPool(ssh, sftp)
+transferPool = TransferPool(maxJobs, adaptiveJobs)
 
 remoteFolder = remoteFolder.replace("\\", "/")
 assertRemoteFolderExists(sftp, remoteFolder)
 
-totalFiles = 0
 baseFolder = posixpath.dirname(selectedFiles[0])
-def sftpUpload(sftp: paramiko.SFTPClient, localEntry: os.DirEntry, remotePath: str):
-	"""Upload file or folder recursively, printing relative paths."""
-	global totalFiles
+uploads: list[tuple[str, str, os.stat_result]] = [] # (localPath, remotePath, info)
+remoteFolders: list[str] = [] # parents first
+
+def collectUploads(localEntry: os.DirEntry, remotePath: str):
+	"""Walk file or folder recursively, printing relative paths."""
 	info = localEntry.stat(follow_symlinks=False)
 	if isFile(info):
 		print(posixpath.relpath(localEntry.path, baseFolder))
-		sftp.put(localEntry.path, remotePath)
-		if preserveTimes:
-			sftp.utime(remotePath, (info.st_atime, info.st_mtime))
-		totalFiles += 1
+		uploads.append((localEntry.path, remotePath, info))
 	elif isDir(info):
-		remoteMkdir(sftp, remotePath)
+		remoteFolders.append(remotePath)
 		with os.scandir(localEntry.path) as dir:
 			for entry in dir:
-				sftpUpload(sftp, entry, posixpath.join(remotePath, entry.name))
+				collectUploads(entry, posixpath.join(remotePath, entry.name))
 
 print("Sending files:\n")
 for path in selectedFiles:
@@ -110,11 +117,47 @@ for path in selectedFiles:
 		continue
 	entry = LocalDirEntry(path)
 	remoteTarget = posixpath.join(remoteFolder, entry.name)
-	sftpUpload(sftp, entry, remoteTarget)
+	collectUploads(entry, remoteTarget)
+
+# The remote Python script creates all the folders and sets all the times in one round trip each - only worth
+# the few round trips of finding Python when there are more than that to save
+roundTrips = len(remoteFolders) + (len(uploads) if preserveTimes else 0)
+pythonStr = remoteHasPython(ssh, throwOnNotFound=False) if roundTrips > 3 else ""
+rld = RemoteListDir(ssh, pythonStr) if pythonStr else None
+
+def runBatch(records: list):
+	for record, error in zip(records, rld.batch(records)):
+		if error is not None:
+			print(f"{clr("Warning!", COLOR_WARN)} {record[0]} {record[2]}: {error.strerror}")
+
+if rld and remoteFolders:
+	runBatch([("mkdir", None, folder, None, None) for folder in remoteFolders])
+else:
+	for folder in remoteFolders:
+		remoteMkdir(sftp, folder)
+
+def uploadFile(localPath: str, remotePath: str, info: os.stat_result):
+	sftp = sftpPool.get() # may run in a worker thread (-j/--jobs)
+	sftpPut(sftp, localPath, remotePath, bandwidth)
+	if preserveTimes and not rld:
+		sftp.utime(remotePath, (info.st_atime, info.st_mtime))
+
+for localPath, remotePath, info in uploads:
+	transferPool.submit(uploadFile, info.st_size, localPath, remotePath, info)
+totalFiles = len(uploads)
+
+transferPool.join() # everything must be there before the 0 file and the end command
+transferPool.shutdown()
+sftpPool.close()
+
+if rld:
+	if preserveTimes and uploads:
+		runBatch([("utime", None, remotePath, int(info.st_atime), int(info.st_mtime)) for _, remotePath, info in uploads])
+	rld.stdin.close()
 
 if zeroFile:
 	print("Sending 0 file")
-	with sftp.open(posixpath.join(remoteFolder, "0")):
+	with sftp.open(posixpath.join(remoteFolder, "0"), "w"): # "w" creates it - the default "r" fails when it doesn't exist yet
 		pass
 
 sftp.close()
@@ -5,14 +5,14 @@ import argparse
 from collections import defaultdict
 from datetime import datetime
 from enum import auto, IntEnum
-from fnmatch import fnmatch, fnmatchcase
-from itertools import chain
+from itertools import chain, islice
 import os
 import posixpath
-import shutil
+import queue
 import sys
+import threading
 from time import perf_counter
-from typing import Callable, List, Tuple
+from typing import Callable, Iterator, Tuple
 
 import paramiko
 from termcolor import colored as clr, cprint
@@ -21,12 +21,17 @@ start = perf_counter()
 
 from .argparseUtils import ArgumentParser_ColoredError, COMMON_FORMATTER_CLASS, IncludeExcludeAction, NameFilter, NoRepeatAction
 from .commonConstants import COLOR_EMPHASIS, COLOR_ERROR, COLOR_OK, COLOR_WARN
-from .fileUtils import assertFolderExists, ensureFolderExists, isDir, isFile, mkdir as localMkdir, modifiedDate
+from .fileUtils import assertFolderExists, ensureFolderExists, isDir, isFile, mkdir as localMkdir, modifiedDate, readTextFileIfExists
+from .filterEngine import CompiledFilters
+from .ignoreFiles import DEFAULT_IGNORE_FILE, IgnoreFiles
+from .inotifyWatcher import InotifyWatcher
 from .isFolderCaseSensitive import isFolderCaseSensitive as isLocalFolderCaseSensitive
-from .LocalSFTPAttributes import local_listdir_attr
+from .LocalSFTPAttributes import local_listdir_attr_gen, local_lstat_attr, LocalSFTPAttributes, ParallelLocalLister
 from .mySystem import WINDOWS
 from .printRelTime import getRelTime
 from .SimpleError import SimpleError
+from .sortedRuns import mergeJoin, SortedRuns
+from .treeSummary import fileDigest, filterAcceptor, summarizeTree
 from .sshUtils import (
 	assertRemoteFolderExists,
 	ensureRemoteFolderExists,
@@ -35,8 +40,16 @@ from .sshUtils import (
 	remoteHasPython,
 	remoteIsWindows,
 	RemoteListDir,
-	remoteMkdir as remoteMkdirBase
+	RemoteListingFilter,
+	RemoteWatcher,
+	remote_lstat_attr,
+	remoteMkdir as remoteMkdirBase,
+	remoteFileDigest,
+	remoteReadTextFileIfExists,
+	SFTPListDir,
+	SFTPPool
 )
+from .transferUtils import localCopy, parseByteRate, parseJobs, sftpGet, sftpPut, TokenBucket, TransferPool
 
 # endregion
 
@@ -52,7 +65,7 @@ else:
 	print(f"\33]0;{TITLE}\a", end="", flush=True) # Hide title
 
 # region #* PARAMETER PARSING
-parser = ArgumentParser_ColoredError( # Remaining letter argument names: O W h m q
+parser = ArgumentParser_ColoredError( # Remaining letter argument names: O h m
 	description="Copy or sync files between folders on remote or local machines",
 	formatter_class=COMMON_FORMATTER_CLASS,
 )
@@ -121,6 +134,14 @@ parser.add_argument("-K", "--end-on-inaccessible-entry" , action="store_true"
 parser.add_argument("-L", "--end-on-file-onto-folder"   , action="store_true"           , help="Terminate the script if a file is to be copied onto a folder and vice versa. If not set ignore such cases but print a warning", dest="endOnFileOntoFolder")
 parser.add_argument("-G", "--sort-entries"              , action="store_true"           , help="Sort files/folders by name alphabetically before copying. Except for making the logs look more familiar it does not have much other use cases", dest="sortEntries")
 parser.add_argument("-z", "--send2trash"                , action="store_true"           , help="When removing a file send it to trash instead. Aplies only to local due to SSH limitations")
+parser.add_argument("-W", "--bwlimit"                   , default=""                    , help="Limit the bandwidth of all transfers combined to RATE bytes per second. Accepts K, M, G suffixes (i.e. 500K, 10M)", metavar="RATE")
+parser.add_argument(      "--stat-threads"              , default=0, type=int           , help="List local folders using N threads: stats of big folders are spread over the threads and up to N subfolders are listed ahead of time. Helps a lot when the local folder is a network mount (NFS, SMB/CIFS). Every entry gets stat'ed, even the ones rejected by name (default: 0 - off)", dest="statThreads", metavar="N")
+parser.add_argument(      "--ignore-files"              , nargs="?", const=DEFAULT_IGNORE_FILE, help=f'Skip entries listed in .gitignore-style files named NAME (default: {DEFAULT_IGNORE_FILE}) found in the source folders. Their rules apply to the folder they are in and everything below it. Ignored folders are not entered on either side', dest="ignoreFileName", metavar="NAME")
+parser.add_argument(      "--tree-summaries"            , action="store_true"           , help="Before copying/syncing summarize both folder trees with one hash per folder (names, sizes, modification dates and modes of everything inside) and skip the subfolders whose summaries are equal on both sides. Remote summaries are computed by the remote Python script of -b/--fast-remote-listdir-attr in one request", dest="treeSummaries")
+parser.add_argument(      "--spill-listings"            , default=0, type=int           , help="Keep at most N entries of a folder listing in memory. Longer listings (i.e. spool folders with millions of files) are written to sorted temporary files and compared by merging them, so memory use stays bounded. Makes the same decisions, only in the order of the names (default: 0 - off)", dest="spillListings", metavar="N")
+parser.add_argument(      "--dedup"                     , action="store_true"           , help="Transfer files with the same contents only once and make the other copies on the destination itself (a reflink when the filesystem supports it). Files are hashed on the source side and all transfers wait until the walk is over. Needs the remote Python script of -b/--fast-remote-listdir-attr when the remote folder is involved")
+parser.add_argument(      "--watch"                     , const=1.0, nargs="?", type=float, help="After copying/syncing keep running and watch the source folder (in SYNC mode both folders) for changes. Local folders are watched with inotify (Linux only) and remote ones by a remote Python script (inotify or polling). Changes are collected until nothing happens for SECONDS (default: 1) and then only the folders where something changed are copied/synced again. Stop with Ctrl+C", dest="watchDebounce", metavar="SECONDS")
+parser.add_argument("-q", "--jobs"                      , default="1"                   , help='Number of files transferred at the same time, each over its own SFTP channel (default: 1). "auto" or "auto:MAX" grows and shrinks the number of in-flight transfers (up to MAX, default 16) based on measured throughput and round-trip time', metavar="N")
 # parser.add_argument("-u", "--dry-run"                   , action="store_true"           , help="Only create directories and disable all file copying operations and only print the output that would normally get printed", dest="dryRun")
 
 parser.add_argument("-m", "--mode", default="copy", choices=MODE_DICT.keys(), type=str.lower, help=f'One of values: {",".join(MODE_DICT.keys())} (default: copy)')
@@ -131,6 +152,7 @@ copyMode.add_argument("-N", "--newer-than-newest-file"  , action="store_true" ,
 copyMode.add_argument("-M", "--newer-than-newest-folder", action="store_true" , help="Copy only files newer then the newest folder in the destination folder", dest="newerThanNewestFolder")
 copyMode.add_argument("-D", "--dont-filter-dest"        , action="store_false", help="Don't filter the destination files/folders WHEN SEARCHING FOR THE NEWEST FILE", dest="filterDest")
 copyMode.add_argument("-J", "--remove-not-in-src"       , action="store_true" , help="Remove destination files that are not present in filtered source file set", dest="removeNotInSrc")
+copyMode.add_argument(      "--detect-moves"            , const="size", nargs="?", choices=("size", "hash"), help='With -J/--remove-not-in-src: match the destination files that would be removed with the new source files by size and modification date (with "hash" also by content) and move them on the destination instead of transferring them again. Turns renaming a big folder in the source into a few renames (default: size)', dest="detectMoves", metavar="size|hash")
 
 syncMode = parser.add_argument_group("SYNC mode arguments")
 syncMode.add_argument("-g", "--print-common-date"       , const="%Y-%m-%d %H:%M - {rel}", nargs="?", help='Before printing file transfers print the detected newest common date. Optionaly take date format string as parameter (default: "%(const)s")', dest="printCommonDate", metavar="FORMAT")
@@ -169,7 +191,16 @@ endOnInaccessibleEntry : bool               = args.endOnInaccessibleEntry
 endOnFileOntoFolder    : bool               = args.endOnFileOntoFolder
 sortEntries            : bool               = args.sortEntries
 shouldSend2trash       : bool               = args.send2trash
+bwlimit                : str                = args.bwlimit
+jobs                   : str                = args.jobs
+statThreads            : int                = args.statThreads
+ignoreFileName         : str | None         = args.ignoreFileName
+treeSummaries          : bool               = args.treeSummaries
+dedup                  : bool               = args.dedup
+spillListings          : int                = args.spillListings
+watchDebounce          : float | None       = args.watchDebounce
 removeNotInSrc         : bool               = args.removeNotInSrc
+detectMoves            : str | None         = args.detectMoves
 printCommonDate        : str                = args.printCommonDate
 commonDateFromFolders  : bool               = args.commonDateFromFolders
 # dryRun                 : bool               = args.dryRun
@@ -185,6 +216,27 @@ if maxRecursionDepth is None: # -R/--recursive was not specified at all
 elif maxRecursionDepth < 0:
 	raise SimpleError("-R/--recursive option's parameter cannot be negative")
 
+if detectMoves and not (mode == MODE.COPY and removeNotInSrc):
+	raise SimpleError("--detect-moves can only be used in COPY mode together with -J/--remove-not-in-src")
+
+if statThreads < 0:
+	raise SimpleError("--stat-threads option's parameter cannot be negative")
+
+if spillListings < 0:
+	raise SimpleError("--spill-listings option's parameter cannot be negative")
+
+if treeSummaries and force:
+	raise SimpleError("--tree-summaries cannot be used with -F/--force as it copies files that did not change")
+
+if treeSummaries and printCommonDate:
+	raise SimpleError("--tree-summaries cannot be used with -g/--print-common-date as it prints the date of every folder")
+
+if watchDebounce is not None and watchDebounce < 0:
+	raise SimpleError("--watch option's parameter cannot be negative")
+
+if ignoreFileName is not None and (not ignoreFileName.strip() or "/" in ignoreFileName or "\\" in ignoreFileName):
+	raise SimpleError("--ignore-files option's parameter has to be a file name (without a path)")
+
 if (username or hostname) and not (username and hostname):
 	raise SimpleError("If any of the parameters -u/--username, -H/--hostname is specified then all of them must be specified")
 REMOTE_IS_REMOTE = bool(username)
@@ -192,6 +244,9 @@ REMOTE_IS_REMOTE = bool(username)
 if silent and verbose:
 	raise SimpleError("-s/--silent and -v/--verbose options cannot both be specified at the same time")
 
+bandwidth = TokenBucket(parseByteRate(bwlimit)) if bwlimit else None
+maxJobs, adaptiveJobs = parseJobs(jobs)
+
 # Ensure paths end with "/" so os.path.abspath won't return unexpected results
 localFolder = os.path.abspath(localFolder).replace("\\", "/").rstrip("/") + "/"
 remoteFolder = remoteFolder.replace("\\", "/").rstrip("/") + "/"
@@ -209,7 +264,7 @@ def preProcessFilesOrFolders(
 		newerThanParamName: str,
 		newerThan: str,
 		inExclude: list[NameFilter],
-	) -> Tuple[int, Callable[[str], bool]]:
+	) -> Tuple[int, CompiledFilters]:
 	newerThanDate = 0
 	if newerThan:
 		for format in dateFormats:
@@ -230,16 +285,8 @@ def preProcessFilesOrFolders(
 	if verbose:
 		print(f'By default all {strName}s will be {"included" if defaultMatch else "exluded"}')
 
-	if inExclude:
-		def match(name: str, filePath: str) -> bool:
-			for filterObj in inExclude:
-				if filterObj.matchingFunc(name, filePath, filterObj.pattern):
-					return filterObj.matchVal
-
-			return defaultMatch
-	else:
-		def match(name: str, filePath: str) -> bool:
-			return defaultMatch
+	# match(name, folderPrefix) - folderPrefix is the path of the entry's folder ending with "/"
+	match = CompiledFilters([(f.pattern, f.matchVal, f.isPath, f.isCase) for f in inExclude], defaultMatch)
 
 	return int(newerThanDate), match
 
@@ -260,6 +307,12 @@ except ValueError:
 LOCAL_IS_SOURCE = localIdx < remoteIdx
 # REMOTE_IS_SOURCE = not LOCAL_IS_SOURCE
 
+SOURCE_IS_LOCAL = LOCAL_IS_SOURCE or not REMOTE_IS_REMOTE
+DEST_IS_LOCAL   = not LOCAL_IS_SOURCE or not REMOTE_IS_REMOTE
+
+if watchDebounce is not None and (SOURCE_IS_LOCAL or DEST_IS_LOCAL and mode == MODE.SYNC) and not sys.platform.startswith("linux"):
+	raise SimpleError("--watch can watch local folders only on Linux")
+
 if LOCAL_IS_SOURCE:
 	sourceFolder = localFolder
 	destFolder   = remoteFolder
@@ -282,6 +335,31 @@ if shouldSend2trash:
 	from send2trash import send2trash
 	def localRemove(path: str): send2trash(os.path.normpath(path))
 
+def digestsOrNone(digestFun: Callable, paths: list[str]) -> list[str | None]:
+	""" Content hashes of the files (None for the ones that couldn't be read) """
+	digests = []
+	for path in paths:
+		try:
+			digests.append(digestFun(path))
+		except OSError:
+			digests.append(None)
+	return digests
+
+def localHashFiles(paths: list[str]): return digestsOrNone(fileDigest, paths)
+
+def localDuplicateFiles(records: list[tuple[str, str, tuple | None]]) -> list[OSError | None]:
+	""" Copies (sourcePath, destPath, times) on the local side itself - with a reflink when the filesystem supports it """
+	results = []
+	for sourcePath, destPath, times in records:
+		try:
+			localCopy(sourcePath, destPath)
+			if times:
+				os.utime(destPath, times)
+			results.append(None)
+		except OSError as e:
+			results.append(e)
+	return results
+
 def isFolderCaseSensitiveBase(
 	isWindows: bool,
 	realFunc: Callable,
@@ -303,6 +381,14 @@ def isFolderCaseSensitiveBase(
 
 	return (errorOccured, caseSense)
 
+if statThreads:
+	localLister = ParallelLocalLister(statThreads)
+	localFolderIter = localLister.listdir_attr
+	localPrefetch = localLister
+else:
+	localFolderIter = local_listdir_attr_gen
+	localPrefetch = None
+
 if REMOTE_IS_REMOTE: # remoteFolder REALLY refers to a REMOTE folder
 	ssh, thereWasSSHError = getSSH(
 		username    = username   ,
@@ -314,6 +400,7 @@ if REMOTE_IS_REMOTE: # remoteFolder REALLY refers to a REMOTE folder
 		silent      = silent     ,
 	)
 	sftp = ssh.open_sftp()
+	sftpPool = SFTPPool(ssh, sftp) # transfers running in other threads (-q/--jobs) need their own channels
 
 	# Verifying remote folder
 	if LOCAL_IS_SOURCE:
@@ -325,31 +412,89 @@ if REMOTE_IS_REMOTE: # remoteFolder REALLY refers to a REMOTE folder
 		assertRemoteFolderExists(sftp, sourceFolder)
 
 	def remoteMkdir(path): return remoteMkdirBase(sftp, path)
+	def remotePut(localPath: str, remotePath: str): return sftpPut(sftpPool.get(), localPath, remotePath, bandwidth)
+	def remoteGet(remotePath: str, localPath: str): return sftpGet(sftpPool.get(), remotePath, localPath, bandwidth, remoteIsSparse)
+	def remoteUtime(path: str, times: tuple): return sftpPool.get().utime(path, times)
+	def remoteChmod(path: str, mode: int): return sftpPool.get().chmod(path, mode)
+	def remoteStat(path: str): return remote_lstat_attr(sftp, path)
+	def remoteReadFile(path: str): return remoteReadTextFileIfExists(sftp, path)
+	def remoteRename(oldPath: str, newPath: str):
+		try:
+			sftp.posix_rename(oldPath, newPath) # atomic, like rename on POSIX systems
+		except IOError as e:
+			if "unsupported" not in str(e).lower():
+				raise
+			sftp.rename(oldPath, newPath) # the server doesn't have the posix-rename@openssh.com extension
 
 	if fastRemoteListdirAttr and (pythonStr := remoteHasPython(ssh, throwOnNotFound = not listdirAttrFallback)): # don't throw if listdirAttrFallback
 		# it's only noticeably faster if one of the remote folders that will be scanned has more than 5000 entries
 		rld = RemoteListDir(ssh, pythonStr, init=False) # don't init the remote python script because remote_listdir_attr might not get called at all
-		remote_listdir_attr = rld.listdir_attr
 	else:
 		if verbose and fastRemoteListdirAttr and not pythonStr:
 			cprint('Warning: remote host does not have python. Falling back to "slow" listdir-attr', COLOR_WARN)
-		def remote_listdir_attr(path: str): return tuple(sftp.listdir_iter(path)) # this is faster than sftp.listdir_attr because listdir_iter is async
+		rld = SFTPListDir(ssh) # listdir_iter is faster than sftp.listdir_attr because it is async
+	remote_listdir_attr = rld.listdir_attr_iter # streams the entries so the comparison can start before huge folders are fully listed
+
+	# rld may be in the middle of streaming a listing so the downloads ask their own remote helper (one per thread)
+	sparseHelpers = threading.local()
+	def remoteIsSparse(path: str) -> bool:
+		if not isinstance(rld, RemoteListDir):
+			return False # without the remote helper the holes are unknown and the file is written whole
+		helper = getattr(sparseHelpers, "rld", None)
+		if helper is None:
+			helper = sparseHelpers.rld = RemoteListDir(ssh, rld.pythonStr)
+		return bool(helper.sparseFiles([path])[0])
+
+	def remoteHashFiles(paths: list[str]): # without the remote helper the files have to be read over SFTP
+		return rld.hashFiles(paths) if isinstance(rld, RemoteListDir) else digestsOrNone(lambda path: remoteFileDigest(sftp, path), paths)
+	def remoteDuplicateFiles(records: list[tuple[str, str, tuple | None]]): # see localDuplicateFiles - needs the remote helper
+		return rld.batch([("copy", sourcePath, destPath, *(times or (None, None))) for sourcePath, destPath, times in records])
+
+	# COPY mode only needs the source entries that pass the filters so the remote helper drops the rest
+	# before sending the listing. -v/--verbose explains every skipped entry so it needs all of them
+	if isinstance(rld, RemoteListDir) and not LOCAL_IS_SOURCE and mode == MODE.COPY and not verbose:
+		remoteFilters = {
+			recursionOk: RemoteListingFilter(
+				fileRules        = fileMatch.rules,
+				fileDefault      = fileMatch.default,
+				folderRules      = folderMatch.rules if recursionOk else None,
+				folderDefault    = folderMatch.default,
+				filesNewerThan   = filesNewerThanDate,
+				foldersNewerThan = foldersNewerThanDate,
+			)
+			for recursionOk in (True, False)
+		}
+		def remoteFilteredIter(path: str, recursionOk: bool): return rld.listdir_attr_iter(path, remoteFilters[recursionOk])
+	else:
+		remoteFilteredIter = None
 
 	if LOCAL_IS_SOURCE:
-		sourceFolderIter = local_listdir_attr
+		sourceFolderIter = localFolderIter
 		destFolderIter = remote_listdir_attr
 
+		sourcePrefetch = localPrefetch
+		destPrefetch = None
+
+		sourceStat = local_lstat_attr
+		destStat = remoteStat
+
+		sourceFilteredIter = None
+		destFilteredIter = None
+
+		sourceReadFile = readTextFileIfExists
+		destReadFile = remoteReadFile
+
 		sourceMkdir = localMkdir
 		destMkdir = remoteMkdir
 
 		sourceUtime = os.utime
-		destUtime = sftp.utime
+		destUtime = remoteUtime
 
 		sourceChmod = os.chmod
-		destChmod = sftp.chmod
+		destChmod = remoteChmod
 
-		copySourceDest = sftp.put
-		copyDestSource = sftp.get
+		copySourceDest = remotePut
+		copyDestSource = remoteGet
 
 		sourceRemove = localRemove
 		destRemove = sftp.remove
@@ -357,6 +502,15 @@ if REMOTE_IS_REMOTE: # remoteFolder REALLY refers to a REMOTE folder
 		sourceRmdir = os.rmdir
 		destRmdir = sftp.rmdir
 
+		sourceRename = os.rename
+		destRename = remoteRename
+
+		sourceHashFiles = localHashFiles
+		destHashFiles = remoteHashFiles
+
+		sourceDuplicateFiles = localDuplicateFiles
+		destDuplicateFiles = remoteDuplicateFiles
+
 		sourceIsWindows = WINDOWS
 		destIsWindows = remoteIsWindows(ssh)
 
@@ -365,19 +519,31 @@ if REMOTE_IS_REMOTE: # remoteFolder REALLY refers to a REMOTE folder
 		def isDestFolderCaseSensitive  (path: str): return isFolderCaseSensitiveBase(destIsWindows  , isRemoteFolderCaseSensitive, (ssh , path ), DEST_STR  , path)
 	else:
 		sourceFolderIter = remote_listdir_attr
-		destFolderIter = local_listdir_attr
+		destFolderIter = localFolderIter
+
+		sourcePrefetch = None
+		destPrefetch = localPrefetch
+
+		sourceStat = remoteStat
+		destStat = local_lstat_attr
+
+		sourceFilteredIter = remoteFilteredIter
+		destFilteredIter = None
+
+		sourceReadFile = remoteReadFile
+		destReadFile = readTextFileIfExists
 
 		sourceMkdir = remoteMkdir
 		destMkdir = localMkdir
 
-		sourceUtime = sftp.utime
+		sourceUtime = remoteUtime
 		destUtime = os.utime
 
-		sourceChmod = sftp.chmod
+		sourceChmod = remoteChmod
 		destChmod = os.chmod
 
-		copySourceDest = sftp.get
-		copyDestSource = sftp.put
+		copySourceDest = remoteGet
+		copyDestSource = remotePut
 
 		sourceRemove = sftp.remove
 		destRemove = localRemove
@@ -385,6 +551,15 @@ if REMOTE_IS_REMOTE: # remoteFolder REALLY refers to a REMOTE folder
 		sourceRmdir = sftp.rmdir
 		destRmdir = os.rmdir
 
+		sourceRename = remoteRename
+		destRename = os.rename
+
+		sourceHashFiles = remoteHashFiles
+		destHashFiles = localHashFiles
+
+		sourceDuplicateFiles = remoteDuplicateFiles
+		destDuplicateFiles = localDuplicateFiles
+
 		sourceIsWindows = remoteIsWindows(ssh)
 		destIsWindows = WINDOWS
 
@@ -393,8 +568,20 @@ if REMOTE_IS_REMOTE: # remoteFolder REALLY refers to a REMOTE folder
 else: # remoteFolder ACTUALLY refers to a LOCAL folder
 	thereWasSSHError = False
 
-	sourceFolderIter = local_listdir_attr
-	destFolderIter   = local_listdir_attr
+	sourceFolderIter = localFolderIter
+	destFolderIter   = localFolderIter
+
+	sourcePrefetch = localPrefetch
+	destPrefetch   = localPrefetch
+
+	sourceStat = local_lstat_attr
+	destStat   = local_lstat_attr
+
+	sourceFilteredIter = None
+	destFilteredIter   = None
+
+	sourceReadFile = readTextFileIfExists
+	destReadFile   = readTextFileIfExists
 
 	sourceMkdir = localMkdir
 	destMkdir   = localMkdir
@@ -405,8 +592,10 @@ else: # remoteFolder ACTUALLY refers to a LOCAL folder
 	sourceChmod = os.chmod
 	destChmod   = os.chmod
 
-	copySourceDest = shutil.copyfile
-	copyDestSource = shutil.copyfile
+	def copyLocalFile(sourcePath: str, destPath: str): return localCopy(sourcePath, destPath, bandwidth)
+
+	copySourceDest = copyLocalFile
+	copyDestSource = copyLocalFile
 
 	sourceRemove = localRemove
 	destRemove   = localRemove
@@ -414,6 +603,15 @@ else: # remoteFolder ACTUALLY refers to a LOCAL folder
 	sourceRmdir = os.rmdir
 	destRmdir   = os.rmdir
 
+	sourceRename = os.rename
+	destRename   = os.rename
+
+	sourceHashFiles = localHashFiles
+	destHashFiles   = localHashFiles
+
+	sourceDuplicateFiles = localDuplicateFiles
+	destDuplicateFiles   = localDuplicateFiles
+
 	sourceIsWindows = WINDOWS
 	destIsWindows   = WINDOWS
 
@@ -422,6 +620,20 @@ else: # remoteFolder ACTUALLY refers to a LOCAL folder
 
 SOURCE_DESIGNATION =  "local"  if LOCAL_IS_SOURCE  else ("remote" if REMOTE_IS_REMOTE else "local")
 DEST_DESIGNATION   = ("remote" if REMOTE_IS_REMOTE else  "local") if LOCAL_IS_SOURCE  else "local"
+
+def ignoreFileReader(readFile, designation: str, type: str):
+	""" An unreadable ignore file is reported like other inaccessible entries and then treated as missing """
+	def read(path: str):
+		try:
+			return readFile(path)
+		except Exception as e:
+			permissionErrorHandler(e, designation, type, path, "file", "reading")
+			return None
+	return read
+
+# Found in the source folders but in SYNC mode folders that exist only in the destination are walked as the source
+sourceIgnore = IgnoreFiles(ignoreFileName, ignoreFileReader(sourceReadFile, SOURCE_DESIGNATION, SOURCE_STR), sourceFolder) if ignoreFileName else None
+destIgnore   = IgnoreFiles(ignoreFileName, ignoreFileReader(destReadFile  , DEST_DESIGNATION  , DEST_STR  ), destFolder  ) if ignoreFileName else None
 SOURCE_DESIGNATION_PADDED = SOURCE_DESIGNATION.ljust(max(len(SOURCE_DESIGNATION), len(DEST_DESIGNATION)))
 DEST_DESIGNATION_PADDED   = DEST_DESIGNATION  .ljust(max(len(SOURCE_DESIGNATION), len(DEST_DESIGNATION)))
 ENTERING_OK = clr("Entering", COLOR_OK)
@@ -430,6 +642,14 @@ class MyNamespace:
 	def __init__(self,
 		sourceFolderIter,
 		destFolderIter,
+		sourcePrefetch,
+		destPrefetch,
+		sourceFilteredIter,
+		destFilteredIter,
+		sourceStat,
+		destStat,
+		sourceIgnore,
+		destIgnore,
 		sourceMkdir,
 		destMkdir,
 		sourceUtime,
@@ -442,6 +662,12 @@ class MyNamespace:
 		destRemove,
 		sourceRmdir,
 		destRmdir,
+		sourceRename,
+		destRename,
+		sourceHashFiles,
+		destHashFiles,
+		sourceDuplicateFiles,
+		destDuplicateFiles,
 		sourceIsWindows,
 		destIsWindows,
 		isSourceFolderCaseSensitive,
@@ -457,6 +683,14 @@ class MyNamespace:
 	):
 		self.sourceFolderIter            : Callable = sourceFolderIter
 		self.destFolderIter              : Callable = destFolderIter
+		self.sourcePrefetch              : ParallelLocalLister | None = sourcePrefetch
+		self.destPrefetch                : ParallelLocalLister | None = destPrefetch
+		self.sourceFilteredIter          : Callable | None = sourceFilteredIter
+		self.destFilteredIter            : Callable | None = destFilteredIter
+		self.sourceStat                  : Callable = sourceStat
+		self.destStat                    : Callable = destStat
+		self.sourceIgnore                : IgnoreFiles | None = sourceIgnore
+		self.destIgnore                  : IgnoreFiles | None = destIgnore
 		self.sourceMkdir                 : Callable = sourceMkdir
 		self.destMkdir                   : Callable = destMkdir
 		self.sourceUtime                 : Callable = sourceUtime
@@ -469,6 +703,12 @@ class MyNamespace:
 		self.destRemove                  : Callable = destRemove
 		self.sourceRmdir                 : Callable = sourceRmdir
 		self.destRmdir                   : Callable = destRmdir
+		self.sourceRename                : Callable = sourceRename
+		self.destRename                  : Callable = destRename
+		self.sourceHashFiles             : Callable = sourceHashFiles
+		self.destHashFiles               : Callable = destHashFiles
+		self.sourceDuplicateFiles        : Callable = sourceDuplicateFiles
+		self.destDuplicateFiles          : Callable = destDuplicateFiles
 		self.sourceIsWindows             : Callable = sourceIsWindows
 		self.destIsWindows               : Callable = destIsWindows
 		self.isSourceFolderCaseSensitive : Callable = isSourceFolderCaseSensitive
@@ -485,6 +725,14 @@ class MyNamespace:
 normalNS = MyNamespace(
 	sourceFolderIter            = sourceFolderIter,
 	destFolderIter              = destFolderIter,
+	sourcePrefetch              = sourcePrefetch,
+	destPrefetch                = destPrefetch,
+	sourceFilteredIter          = sourceFilteredIter,
+	destFilteredIter            = destFilteredIter,
+	sourceStat                  = sourceStat,
+	destStat                    = destStat,
+	sourceIgnore                = sourceIgnore,
+	destIgnore                  = destIgnore,
 	sourceMkdir                 = sourceMkdir,
 	destMkdir                   = destMkdir,
 	sourceUtime                 = sourceUtime,
@@ -497,6 +745,12 @@ normalNS = MyNamespace(
 	destRemove                  = destRemove,
 	sourceRmdir                 = sourceRmdir,
 	destRmdir                   = destRmdir,
+	sourceRename                = sourceRename,
+	destRename                  = destRename,
+	sourceHashFiles             = sourceHashFiles,
+	destHashFiles               = destHashFiles,
+	sourceDuplicateFiles        = sourceDuplicateFiles,
+	destDuplicateFiles          = destDuplicateFiles,
 	sourceIsWindows             = sourceIsWindows,
 	destIsWindows               = destIsWindows,
 	isSourceFolderCaseSensitive = isSourceFolderCaseSensitive,
@@ -513,6 +767,14 @@ normalNS = MyNamespace(
 reverseNS = MyNamespace(
 	sourceFolderIter            = destFolderIter,
 	destFolderIter              = sourceFolderIter,
+	sourcePrefetch              = destPrefetch,
+	destPrefetch                = sourcePrefetch,
+	sourceFilteredIter          = destFilteredIter,
+	destFilteredIter            = sourceFilteredIter,
+	sourceStat                  = destStat,
+	destStat                    = sourceStat,
+	sourceIgnore                = destIgnore,
+	destIgnore                  = sourceIgnore,
 	sourceMkdir                 = destMkdir,
 	destMkdir                   = sourceMkdir,
 	sourceUtime                 = destUtime,
@@ -525,6 +787,12 @@ reverseNS = MyNamespace(
 	destRemove                  = sourceRemove,
 	sourceRmdir                 = destRmdir,
 	destRmdir                   = sourceRmdir,
+	sourceRename                = destRename,
+	destRename                  = sourceRename,
+	sourceHashFiles             = destHashFiles,
+	destHashFiles               = sourceHashFiles,
+	sourceDuplicateFiles        = destDuplicateFiles,
+	destDuplicateFiles          = sourceDuplicateFiles,
 	sourceIsWindows             = destIsWindows,
 	destIsWindows               = sourceIsWindows,
 	isSourceFolderCaseSensitive = isDestFolderCaseSensitive,
@@ -539,7 +807,7 @@ reverseNS = MyNamespace(
 	destFolderBase              = sourceFolder,
 )
 
-DEST_FILTER_WARN = verbose and filterDest and any(filter(lambda f: f.matchingFunc is fnmatchcase, inExcludeFiles + inExcludeFolders))
+DEST_FILTER_WARN = verbose and filterDest and any(filter(lambda f: f.isCase and not f.isPath, inExcludeFiles + inExcludeFolders))
 
 # Preserving permissions is only sensible when copying files between Unix machines as Windows has
 # different permission system, incompatible with Unix
@@ -567,7 +835,7 @@ def recursiveRemove(
 			permissionErrorHandler(e, designation, type, basePath, "file", "deleting")
 	elif isDir(entry):
 		try:
-			entries = iterFun(basePath)
+			entries = tuple(iterFun(basePath)) # the folder is modified in the loop so don't stream it
 		except Exception as e:
 			permissionErrorHandler(e, designation, type, basePath)
 			return
@@ -597,7 +865,7 @@ def permissionErrorHandler(err: Exception, designation: str, type: str, path: st
 	# "Bad message" text. On Termux on Android running OpenSSH when listdir'ing the root folder "/"
 	# the server returns "Failure" text. I think the servers should return the SFTP_PERMISSION_DENIED
 	# error code so the error could be casted to PermissionError by paramiko but it is what it is...
-	if err is PermissionError or (err is IOError and (errorMsg := str(err)) and (errorMsg == "Failure" or errorMsg == "Bad message")):
+	if isinstance(err, PermissionError) or (isinstance(err, IOError) and (errorMsg := str(err)) and (errorMsg == "Failure" or errorMsg == "Bad message")):
 		txt = f'Warning: permission denied when {operation} the {designation} {type} {fileFolder} "{path}"'
 		if endOnInaccessibleEntry:
 			raise SimpleError(txt)
@@ -608,29 +876,43 @@ def permissionErrorHandler(err: Exception, designation: str, type: str, path: st
 		raise err
 
 class FilterClass:
-	def __init__(self, sourceFolderParam, sourceFolderBase, recursionOk):
+	def __init__(self, sourceFolderParam, sourceFolderBase, recursionOk, ignore: IgnoreFiles | None = None):
 		self.sourceFolderParam = sourceFolderParam
 		self.sourceFolderBase = sourceFolderBase
 		self.recursionOk = recursionOk
+		self.folderPrefix = sourceFolderParam if sourceFolderParam.endswith("/") else sourceFolderParam + "/" # so path filters get posixpath.join(sourceFolderParam, name) without a join per entry
+		self.ignored = ignore.forFolder(sourceFolderParam) if ignore else None # --ignore-files rules of this folder (None when there are none)
 
 	def _innerFilterFun(self, entry: paramiko.SFTPAttributes) -> bool:
 		# ___NewerThanDate comparisons use the < operator so if the user inputs exact modification date
 		# of some file/folder that file/folder will not be included in the operations
-		filePath = posixpath.join(self.sourceFolderParam, entry.filename)
-		return isFile(entry)                      and filesNewerThanDate   < entry.st_mtime and fileMatch  (entry.filename, filePath) \
-		    or isDir (entry) and self.recursionOk and foldersNewerThanDate < entry.st_mtime and folderMatch(entry.filename, filePath)
+		# Names are matched before the dates as local entries only get stat'ed when st_mtime is read
+		if self.ignored and self.ignored(self.folderPrefix, entry.filename, isDir(entry)):
+			return False
+		return isFile(entry)                      and fileMatch  (entry.filename, self.folderPrefix) and filesNewerThanDate   < entry.st_mtime \
+		    or isDir (entry) and self.recursionOk and folderMatch(entry.filename, self.folderPrefix) and foldersNewerThanDate < entry.st_mtime
 
 	def __call__(self, entry: paramiko.SFTPAttributes) -> bool:
-		val = self._innerFilterFun(entry)
+		""" _innerFilterFun that explains why entries were skipped. Every check is evaluated only once """
+		name = entry.filename
+		if self.ignored and self.ignored(self.folderPrefix, name, isDir(entry)):
+			print(f"{posixpath.join(self.sourceFolderParam, name).replace(self.sourceFolderBase, "", 1)} - skipping because of {ignoreFileName}")
+			return False
+		if isFile(entry):
+			nameOk = fileMatch(name, self.folderPrefix)
+			val = nameOk and filesNewerThanDate < entry.st_mtime
+		elif isDir(entry):
+			nameOk = self.recursionOk and folderMatch(name, self.folderPrefix)
+			val = nameOk and foldersNewerThanDate < entry.st_mtime
+		else:
+			val = False
 
 		if not val:
-			name = entry.filename
-			filePath = posixpath.join(self.sourceFolderParam, entry.filename)
-			relPath = filePath.replace(self.sourceFolderBase, "", 1)
+			relPath = posixpath.join(self.sourceFolderParam, name).replace(self.sourceFolderBase, "", 1)
 			if isFile(entry):
 				if not (filesNewerThanDate <= entry.st_mtime):
 					print(f'{relPath} - skipping file because it ({modifiedDate(entry)}) is not newer than -n/--files-newer-than parameter')
-				elif not fileMatch(name, filePath):
+				elif not nameOk:
 					print(f"{relPath} - skipping file because fileMatch returned False")
 				else:
 					cprint(f"{relPath} - skipping file because of unknown reason", COLOR_ERROR) # Shouldn't happen
@@ -639,7 +921,7 @@ class FilterClass:
 					print(f"{relPath} - skipping folder because we are at max recursion depth and createMaxRecFolders is False")
 				elif not (foldersNewerThanDate <= entry.st_mtime):
 					print(f'{relPath} - skipping folder because it ({modifiedDate(entry)}) is not newer than -f/--folders-newer-than parameter')
-				elif not folderMatch(name, filePath):
+				elif not nameOk:
 					print(f"{relPath} - skipping folder because folderMatch returned False")
 				else:
 					cprint(f"{relPath} - skipping folder because of unknown reason", COLOR_ERROR) # Shouldn't happen
@@ -669,22 +951,366 @@ def checkCaseDuplicates(
 		if len(entries) > 1:
 			caseDuplicates.append(entries)
 
+	reportCaseDuplicates(caseDuplicates, sourceErrorOccured, destErrorOccured, designation, type, path)
 	if caseDuplicates:
-		if not silent:
-			print(f'Following files/folders in the {designation} {type} folder "{path}" have names that only differ in letter case:')
-			for i, entries in enumerate(caseDuplicates, start=1):
-				print(f"Group {i}:")
-				for entry in entries:
-					print(entry.filename)
-			cprint(f"And they will not be copied unless you change their names or enable case-sensitivity in the destination Windows folder with fsutil.exe", COLOR_WARN)
-		caseDuplicatesFlattened = tuple(chain.from_iterable(caseDuplicates))
+		caseDuplicatesFlattened = set(chain.from_iterable(caseDuplicates)) # entries hash by identity
 		entriesList = tuple(filter(lambda e: e not in caseDuplicatesFlattened, entriesList))
-	elif sourceErrorOccured or destErrorOccured:
-		if not silent:
-			cprint(f"...but it won't cause any problems because {designation} {type} files/folders are case-sensitivly unique", COLOR_OK)
 
 	return entriesList
 
+def reportCaseDuplicates(
+	caseDuplicates: list[list[paramiko.SFTPAttributes]],
+	sourceErrorOccured: bool,
+	destErrorOccured: bool,
+	designation: str,
+	type: str,
+	path: str
+):
+	if silent:
+		return
+	if caseDuplicates:
+		print(f'Following files/folders in the {designation} {type} folder "{path}" have names that only differ in letter case:')
+		for i, entries in enumerate(caseDuplicates, start=1):
+			print(f"Group {i}:")
+			for entry in entries:
+				print(entry.filename)
+		cprint(f"And they will not be copied unless you change their names or enable case-sensitivity in the destination Windows folder with fsutil.exe", COLOR_WARN)
+	elif sourceErrorOccured or destErrorOccured:
+		cprint(f"...but it won't cause any problems because {designation} {type} files/folders are case-sensitivly unique", COLOR_OK)
+
+def indexEntries(
+	entriesBase: list[paramiko.SFTPAttributes],
+	entries: tuple[paramiko.SFTPAttributes],
+	caseless: bool
+) -> tuple[dict[str, paramiko.SFTPAttributes], set[str]]:
+	"""
+	Indexes the whole listing by (case normalized) name and returns the index with the set of names of
+	the filtered `entries`. `entries` is a subset of `entriesBase` (the same objects) so it doesn't need
+	an index of its own
+	"""
+	if caseless: index = {entry.filename.lower(): entry for entry in entriesBase}
+	else       : index = {entry.filename        : entry for entry in entriesBase}
+
+	names = set()
+	for entry in entries:
+		name = entry.filename.lower() if caseless else entry.filename
+		index[name] = entry # so a filtered entry wins over a filtered out one with the same case-insensitive name
+		names.add(name)
+	return index, names
+
+# When only path include rules can include anything (i.e. `-Y /vol/a/b -Q /vol/a/b/f.txt`) the walker
+# stats the few children on the way to the included paths instead of listing every folder above them
+# and folders off those paths are not entered at all (see CompiledFilters.childTargets)
+PATH_TARGETING = fileMatch.onlyPathIncludes and folderMatch.onlyPathIncludes
+
+def childTargets(folderPath: str) -> set[str] | None:
+	fileTargets = fileMatch.childTargets(folderPath)
+	if fileTargets is None:
+		return None
+	folderTargets = folderMatch.childTargets(folderPath)
+	return None if folderTargets is None else fileTargets | folderTargets
+
+def listFolder(folderIter: Callable, statFun: Callable, folderPath: str, targets: set[str] | None):
+	""" Lists the folder or, when `targets` are given, stats only them (missing ones are skipped) """
+	if targets is None:
+		return folderIter(folderPath)
+	return [entry for name in targets if (entry := statFun(posixpath.join(folderPath, name))) is not None]
+
+class ListingAborted(Exception):
+	""" A streamed listing failed part way through and the error was already handled (see handledListing) """
+
+def handledListing(entries, designation: str, type: str, path: str):
+	"""
+	Yields the entries of a streamed listing. Errors that come up while it is being read (i.e.
+	permission denied or a dropped connection) go to permissionErrorHandler like the errors of opening
+	the folder. The ones it lets through as warnings end the listing with ListingAborted so the caller
+	gives up on the folder like it did when the listing was read whole
+	"""
+	try:
+		yield from entries
+	except Exception as e:
+		permissionErrorHandler(e, designation, type, path)
+		raise ListingAborted(path) from e
+
+def deferFolders(entries, folders: list):
+	""" Yields the non-folder entries and collects the folders into `folders` to be recursed into once `entries` is exhausted """
+	for entry in entries:
+		if isDir(entry):
+			folders.append(entry)
+		else:
+			yield entry
+
+def prefetchFolders(NNS: MyNamespace, sourceFolderParam: str, destFolderParam: str, entryPairs, depth: int):
+	"""
+	Lets --stat-threads start listing the subfolders of (sourceEntryBase, destEntryBase) pairs that the
+	walker is going to enter next
+	"""
+	if not (NNS.sourcePrefetch or NNS.destPrefetch) or depth >= maxRecursionDepth:
+		return
+
+	sourcePaths, destPaths = [], []
+	for sourceEntryBase, destEntryBase in entryPairs:
+		if PATH_TARGETING and childTargets(posixpath.join(sourceFolderParam, (sourceEntryBase or destEntryBase).filename)) is not None:
+			continue # it won't be listed
+		if sourceEntryBase and isDir(sourceEntryBase): sourcePaths.append(posixpath.join(sourceFolderParam, sourceEntryBase.filename))
+		if destEntryBase   and isDir(destEntryBase  ): destPaths  .append(posixpath.join(destFolderParam  , destEntryBase  .filename))
+
+	if NNS.sourcePrefetch and sourcePaths: NNS.sourcePrefetch.prefetch(sourcePaths)
+	if NNS.destPrefetch   and destPaths  : NNS.destPrefetch  .prefetch(destPaths  )
+
+def forgetPrefetched(NNS: MyNamespace, sourceFolderParam: str, destFolderParam: str):
+	""" Called once the walker is done with the folders - drops the listings of their subfolders it skipped """
+	if NNS.sourcePrefetch: NNS.sourcePrefetch.forget(sourceFolderParam)
+	if NNS.destPrefetch  : NNS.destPrefetch  .forget(destFolderParam  )
+
+def prefetchedFolders(folders: list, NNS: MyNamespace, sourceFolderParam: str, destFolderParam: str, depth: int):
+	""" Yields `folders` (source entries) after letting --stat-threads list them ahead of time """
+	prefetchFolders(NNS, sourceFolderParam, destFolderParam, ((entry, None) for entry in folders), depth)
+	yield from folders
+
+def transferFile(
+	NNS: MyNamespace,
+	sourceEntry: paramiko.SFTPAttributes,
+	destEntry: paramiko.SFTPAttributes,
+	sourcePath: str,
+	destPath: str,
+):
+	NNS.copySourceDest(sourcePath, destPath)
+
+	if preserveTimes:
+		NNS.destUtime(destPath, (sourceEntry.st_atime, sourceEntry.st_mtime))
+
+	if preservePermissions and (not destEntry or sourceEntry.st_mode != destEntry.st_mode):
+		NNS.destChmod(destPath, sourceEntry.st_mode)
+
+def transferErrorHandler(err: Exception, NNS: MyNamespace, sourceEntry, destEntry, sourcePath: str, destPath: str):
+	""" Only called for transfers running in the background (-q/--jobs) """
+	permissionErrorHandler(err, NNS.dest_designation, NNS.dest_str, destPath)
+
+transferPool = TransferPool(maxJobs, adaptiveJobs, transferErrorHandler, holdDeferred = bool(detectMoves or dedup)) # they transfer files after the folder times would be set
+
+def submitTransfer(NNS: MyNamespace, sourceEntry, destEntry, sourcePath: str, destPath: str):
+	if deduplicator:
+		deduplicator.add(NNS, sourceEntry, destEntry, sourcePath, destPath)
+	else:
+		transferPool.submit(transferFile, sourceEntry.st_size, NNS, sourceEntry, destEntry, sourcePath, destPath)
+
+class MoveDetector:
+	"""
+	--detect-moves: the destination files -J/--remove-not-in-src would remove and the files new to the
+	destination are held back until the walk is over, as a renamed folder is removed in one place of
+	the walk and created in another. Then the new files are matched with the removed ones by size and
+	modification date (and by content with "hash") and every match is renamed on the destination
+	instead of being transferred again. Whatever is left is transferred and removed as usual. When
+	several files share a size and date they are matched by content even without "hash"
+	"""
+	def __init__(self, NNS: MyNamespace, byHash: bool):
+		self.NNS = NNS
+		self.byHash = byHash
+		self.removedFiles: defaultdict[tuple[int, int], list[tuple[str, paramiko.SFTPAttributes]]] = defaultdict(list) # (size, mtime) -> (path, entry)
+		self.removedFolders: list[str] = [] # subfolders before their parents
+		self.newFiles: list[tuple[paramiko.SFTPAttributes, str, str]] = [] # (sourceEntry, sourcePath, destPath)
+
+	def addNew(self, sourceEntry: paramiko.SFTPAttributes, sourcePath: str, destPath: str):
+		self.newFiles.append((sourceEntry, sourcePath, destPath))
+
+	def addRemoved(self, folderPath: str, entry: paramiko.SFTPAttributes):
+		""" Holds back what recursiveRemove would remove """
+		NNS = self.NNS
+		path = posixpath.join(folderPath, entry.filename)
+		if isFile(entry):
+			self.removedFiles[(entry.st_size, entry.st_mtime)].append((path, entry))
+		elif isDir(entry):
+			try:
+				entries = tuple(NNS.destFolderIter(path))
+			except Exception as e:
+				permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, path)
+				return
+			for child in entries:
+				self.addRemoved(path, child)
+			self.removedFolders.append(path)
+
+	def match(self) -> list[tuple[paramiko.SFTPAttributes, str, str, str, paramiko.SFTPAttributes]]:
+		""" Pairs new files with removed ones: (sourceEntry, sourcePath, destPath, oldPath, oldEntry). The matched ones are taken out """
+		newByKey: defaultdict[tuple[int, int], list[tuple]] = defaultdict(list)
+		for newFile in self.newFiles:
+			newByKey[(newFile[0].st_size, newFile[0].st_mtime)].append(newFile)
+
+		self.newFiles = []
+		matches = []
+		toHash: list[tuple[list[tuple], list[tuple]]] = [] # (newFiles, candidates) matched by content
+		for key, newFiles in newByKey.items():
+			candidates = self.removedFiles.get(key)
+			if not candidates:
+				self.newFiles.extend(newFiles)
+			elif self.byHash or len(newFiles) > 1 or len(candidates) > 1: # size and date alone could pair the wrong files
+				toHash.append((newFiles, candidates))
+			else:
+				matches.append((*newFiles[0], *candidates.pop()))
+		if not toHash:
+			return matches
+
+		# one request per side
+		sourceDigests = iter(self.NNS.sourceHashFiles([newFile[1] for newFiles, _ in toHash for newFile in newFiles]))
+		destDigests   = iter(self.NNS.destHashFiles  ([path for _, candidates in toHash for path, _ in candidates]))
+		for newFiles, candidates in toHash:
+			byContent: defaultdict[str, list[tuple]] = defaultdict(list)
+			for candidate, digest in zip(candidates, destDigests):
+				if digest is not None:
+					byContent[digest].append(candidate)
+			for newFile, digest in zip(newFiles, sourceDigests):
+				olds = byContent.get(digest) if digest is not None else None
+				if not olds:
+					self.newFiles.append(newFile)
+					continue
+				# files in a renamed folder keep their names so the candidate with the same name goes first
+				old = olds.pop(next((i for i, (_, oldEntry) in enumerate(olds) if oldEntry.filename == newFile[0].filename), -1))
+				candidates.remove(old)
+				matches.append((*newFile, *old))
+		return matches
+
+	def apply(self):
+		NNS = self.NNS
+		for sourceEntry, sourcePath, destPath, oldPath, oldEntry in self.match():
+			try:
+				NNS.destRename(oldPath, destPath)
+			except Exception as e:
+				if verbose:
+					print(f"{destPath} - transferring the file because it could not be moved from {oldPath}: {e}")
+				self.newFiles.append((sourceEntry, sourcePath, destPath))
+				self.removedFiles[(oldEntry.st_size, oldEntry.st_mtime)].append((oldPath, oldEntry))
+				continue
+
+			if not silent:
+				cprint(f"Moved: {oldPath} -> {destPath}", COLOR_OK)
+			if preservePermissions and sourceEntry.st_mode != oldEntry.st_mode:
+				NNS.destChmod(destPath, sourceEntry.st_mode)
+
+		for sourceEntry, sourcePath, destPath in self.newFiles:
+			if not silent:
+				cprint(sourcePath.replace(NNS.sourceFolderBase, "", 1), COLOR_OK)
+			try:
+				submitTransfer(NNS, sourceEntry, None, sourcePath, destPath)
+			except Exception as e:
+				permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, destPath)
+
+		for removed in self.removedFiles.values():
+			for path, _ in removed:
+				try:
+					NNS.destRemove(path)
+					if not silent:
+						cprint(f"Removed: {path}", REMOVE_COLOR)
+				except Exception as e:
+					permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, path, "file", "deleting")
+
+		for path in self.removedFolders:
+			try:
+				NNS.destRmdir(path)
+				if not silent:
+					cprint(f"Removed: {path}", REMOVE_COLOR)
+			except Exception as e:
+				permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, path, "folder", "deleting")
+
+		self.removedFiles.clear()
+		self.removedFolders.clear()
+		self.newFiles.clear()
+
+moveDetector = MoveDetector(normalNS, detectMoves == "hash") if detectMoves else None
+
+class Deduplicator:
+	"""
+	--dedup: the transfers are held back until the walk is over. Then the source files of the same
+	size are hashed (on the side they are on) and only one file of every content is transferred. Once
+	it's there the other files with the same content are copied from it on the destination itself. If
+	its transfer failed they are transferred one by one instead
+	"""
+	def __init__(self):
+		self.transfers: list[tuple[MyNamespace, paramiko.SFTPAttributes, paramiko.SFTPAttributes | None, str, str]] = []
+		self.failed: set[str] = set() # destination paths of the transferred files whose transfer failed
+
+	def add(self, NNS: MyNamespace, sourceEntry, destEntry, sourcePath: str, destPath: str):
+		self.transfers.append((NNS, sourceEntry, destEntry, sourcePath, destPath))
+
+	def group(self) -> list[list[tuple]]:
+		""" The transfers grouped by content. Files with a size of their own (or that couldn't be hashed) are groups of one """
+		bySize: defaultdict[tuple[MyNamespace, int], list[tuple]] = defaultdict(list) # SYNC mode transfers in both directions
+		for transfer in self.transfers:
+			bySize[(transfer[0], transfer[1].st_size)].append(transfer)
+
+		groups = []
+		toHash: defaultdict[MyNamespace, list[tuple]] = defaultdict(list)
+		for (NNS, size), transfers in bySize.items():
+			if len(transfers) == 1 or not size:
+				groups.extend([transfer] for transfer in transfers)
+			else:
+				toHash[NNS].extend(transfers)
+
+		for NNS, transfers in toHash.items(): # one request per side
+			byContent: defaultdict[tuple[int, str], list[tuple]] = defaultdict(list)
+			for transfer, digest in zip(transfers, NNS.sourceHashFiles([transfer[3] for transfer in transfers])):
+				if digest is None:
+					groups.append([transfer])
+				else:
+					byContent[(transfer[1].st_size, digest)].append(transfer)
+			groups.extend(byContent.values())
+		return groups
+
+	def transferFirst(self, NNS: MyNamespace, sourceEntry, destEntry, sourcePath: str, destPath: str):
+		""" transferFile that remembers the failure - inline the error reaches apply, in the background transferErrorHandler """
+		try:
+			transferFile(NNS, sourceEntry, destEntry, sourcePath, destPath)
+		except Exception:
+			self.failed.add(destPath)
+			raise
+
+	def apply(self):
+		groups = self.group()
+		self.transfers.clear()
+		self.failed.clear()
+
+		for NNS, sourceEntry, destEntry, sourcePath, destPath in (group[0] for group in groups):
+			try:
+				transferPool.submit(self.transferFirst, sourceEntry.st_size, NNS, sourceEntry, destEntry, sourcePath, destPath)
+			except Exception as e:
+				permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, destPath)
+		transferPool.wait() # the copies are made from the transferred files (and before the folder times are set)
+
+		copies: defaultdict[MyNamespace, list[tuple]] = defaultdict(list) # (transfer, pathOfTheTransferredFile)
+		for group in groups:
+			if group[0][4] not in self.failed:
+				for transfer in group[1:]:
+					copies[transfer[0]].append((transfer, group[0][4]))
+				continue
+
+			for NNS, sourceEntry, destEntry, sourcePath, destPath in group[1:]: # the destination may still have the old file under that path
+				if verbose:
+					print(f"{destPath} - transferring the file because the transfer of {group[0][4]} failed")
+				try:
+					transferPool.submit(transferFile, sourceEntry.st_size, NNS, sourceEntry, destEntry, sourcePath, destPath)
+				except Exception as e:
+					permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, destPath)
+
+		for NNS, transfers in copies.items():
+			records = [(copiedPath, destPath, (sourceEntry.st_atime, sourceEntry.st_mtime) if preserveTimes else None) for (_, sourceEntry, _, _, destPath), copiedPath in transfers]
+			for ((_, sourceEntry, destEntry, sourcePath, destPath), copiedPath), error in zip(transfers, NNS.destDuplicateFiles(records)):
+				if error is None:
+					if not silent:
+						cprint(f"Copied on the {NNS.dest_str}: {copiedPath} -> {destPath}", COLOR_OK)
+					if preservePermissions and (not destEntry or sourceEntry.st_mode != destEntry.st_mode):
+						NNS.destChmod(destPath, sourceEntry.st_mode)
+					continue
+
+				if verbose:
+					print(f"{destPath} - transferring the file because it could not be copied from {copiedPath}: {error.strerror or error}")
+				try:
+					transferPool.submit(transferFile, sourceEntry.st_size, NNS, sourceEntry, destEntry, sourcePath, destPath)
+				except Exception as e:
+					permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, destPath)
+
+if dedup and REMOTE_IS_REMOTE and not isinstance(rld, RemoteListDir):
+	raise SimpleError("--dedup needs the remote Python script of -b/--fast-remote-listdir-attr to hash and copy the remote files")
+deduplicator = Deduplicator() if dedup else None
+
 def recursiveCopyHelper(
 	sourceEntry: paramiko.SFTPAttributes,
 	sourceFolderParam: str,
@@ -714,6 +1340,10 @@ def recursiveCopyHelper(
 			sourcePath = posixpath.join(sourceFolderParam, sourceName)
 			destPath   = posixpath.join(destFolderParam  , destName  )
 
+			if moveDetector and not destEntry: # it may have been moved - known once the whole tree was walked
+				moveDetector.addNew(sourceEntry, sourcePath, destPath)
+				return ACTION.NONE
+
 			if not silent:
 				if mode == MODE.SYNC:
 					cprint(f"{'source -> destination' if NNS is normalNS else 'destination -> source'}: {relPath}", COLOR_OK)
@@ -721,16 +1351,10 @@ def recursiveCopyHelper(
 					cprint(relPath, COLOR_OK)
 
 			try:
-				NNS.copySourceDest(sourcePath, destPath)
+				submitTransfer(NNS, sourceEntry, destEntry, sourcePath, destPath)
 			except Exception as e:
 				permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, destPath)
 				return ACTION.RETURN # because every next file would raise the same exception
-
-			if preserveTimes:
-				NNS.destUtime(destPath, (sourceEntry.st_atime, sourceEntry.st_mtime))
-
-			if preservePermissions and (not destEntry or sourceEntry.st_mode != destEntry.st_mode):
-				NNS.destChmod(destPath, sourceEntry.st_mode)
 		elif verbose:
 			if not (destEntry.st_mtime < sourceEntry.st_mtime):
 				print(f"{relPath} - skipping file because it is not newer than the {NNS.dest_str}")
@@ -748,18 +1372,23 @@ def recursiveCopyHelper(
 		if preservePermissions and (not destEntry or sourceEntry.st_mode != destEntry.st_mode):
 			NNS.destChmod(newDestFolder, sourceEntry.st_mode)
 
-		if depth < maxRecursionDepth:
+		if depth < maxRecursionDepth and not (shallowPass and destEntry): # --watch passes only enter the folders new to the destination
 			newSourceFolder = posixpath.join(sourceFolderParam, sourceName)
-			recursiveCopy(
-				sourceFolderParam = newSourceFolder,
-				destFolderParam   = newDestFolder,
-				NNS = NNS,
-				RNS = RNS,
-				depth = depth + 1,
-			)
-
-		if preserveTimes: # We cannot set the time conditionally as putting any files inside the folder updated it modification date
-			NNS.destUtime(newDestFolder, (sourceEntry.st_atime, sourceEntry.st_mtime))
+			if destEntry and treeSummaries and sameTreeSummaries(NNS, newSourceFolder, newDestFolder): # the folder itself still gets its mode and time above and below
+				if verbose:
+					print(f"{relPath} - skipping folder because nothing changed in it (--tree-summaries)")
+			else:
+				recursiveCopy(
+					sourceFolderParam = newSourceFolder,
+					destFolderParam   = newDestFolder,
+					NNS = NNS,
+					RNS = RNS,
+					depth = depth + 1,
+				)
+			forgetPrefetched(NNS, newSourceFolder, newDestFolder)
+
+		if preserveTimes and not (shallowPass and destEntry and destEntry.st_mtime == sourceEntry.st_mtime): # We cannot set the time conditionally as putting any files inside the folder updated it modification date (unless a --watch pass doesn't enter it)
+			transferPool.defer(NNS.destUtime, newDestFolder, (sourceEntry.st_atime, sourceEntry.st_mtime)) # files may still be in flight
 
 		return ACTION.CONTINUE # so te recursion doesn't happen on the next function call
 	elif verbose:
@@ -771,6 +1400,253 @@ def recursiveCopyHelper(
 
 	return ACTION.NONE
 
+shallowPass = False # set by --watch
+enteredFolders: set[str] | None = None # source folders already walked by the current --watch batch
+
+def sameTreeSummaries(NNS: MyNamespace, sourceFolderPath: str, destFolderPath: str) -> bool:
+	""" True if --tree-summaries found that the two folders hold the same files """
+	sourceSummaries, destSummaries = (sourceTreeSummaries, destTreeSummaries) if NNS is normalNS else (destTreeSummaries, sourceTreeSummaries)
+	sourceSummary = sourceSummaries.get(sourceFolderPath[len(NNS.sourceFolderBase):])
+	return sourceSummary is not None and sourceSummary == destSummaries.get(destFolderPath[len(NNS.destFolderBase):])
+
+def syncEntry(
+	sourceEntry: paramiko.SFTPAttributes | None,
+	destEntry: paramiko.SFTPAttributes | None,
+	sourceEntryBase: paramiko.SFTPAttributes | None,
+	destEntryBase: paramiko.SFTPAttributes | None,
+	sourceFolderParam: str,
+	destFolderParam: str,
+	depth: int,
+	NNS: MyNamespace,
+	RNS: MyNamespace,
+	newestCommonDate: int,
+) -> ACTION:
+	"""
+	Syncs one name of a folder. sourceEntry/destEntry are None when the entry is missing or was filtered
+	out. sourceEntryBase/destEntryBase are None only when the entry is missing.
+
+	When sourceEntry is None sourceEntryBase might not be None (because i.e. folders where filetered out
+	or entries where filtered case-sensitively while the folders are case-insensitive). That's why we
+	need both of them. The same applies to destEntry and destEntryBase.
+	"""
+	if sourceEntry:
+		if not destEntryBase and sourceEntry.st_mtime < newestCommonDate:
+			recursiveRemove(sourceFolderParam, sourceEntry, NNS.sourceFolderIter, NNS.sourceRemove, NNS.sourceRmdir, NNS.source_designation, NNS.source_str)
+		else:
+			action = recursiveCopyHelper(
+				sourceEntry       = sourceEntry,
+				destEntry         = destEntryBase,
+				sourceFolderParam = sourceFolderParam,
+				destFolderParam   = destFolderParam,
+				depth             = depth,
+				NNS               = NNS,
+				RNS               = RNS,
+			)
+			if action != ACTION.NONE:
+				return action
+	if destEntry:
+		if not sourceEntryBase and destEntry.st_mtime < newestCommonDate:
+			recursiveRemove(destFolderParam, destEntry, NNS.destFolderIter, NNS.destRemove, NNS.destRmdir, NNS.dest_designation, NNS.dest_str)
+		else:
+			return recursiveCopyHelper(
+				sourceEntry       = destEntry,
+				destEntry         = sourceEntryBase,
+				sourceFolderParam = destFolderParam,
+				destFolderParam   = sourceFolderParam,
+				depth             = depth,
+				NNS               = RNS,
+				RNS               = NNS,
+			)
+	return ACTION.NONE
+
+def findNewestDestDate(destEntries, filterFun: FilterClass, destCaseSense: bool) -> int:
+	""" The date of the newest file/folder in the destination folder (-N/--newer-than-newest-file, -M/--newer-than-newest-folder) """
+	if DEST_FILTER_WARN and not destCaseSense:
+		cprint("Warning: When searching for newest file in the destination folder you may have excluded some files/folders case-sensitivly but the destination folder is case-insensitive", COLOR_WARN)
+
+	newestDestDate = 0
+	entryCount = 0
+	for entry in (filter(filterFun._innerFilterFun, destEntries) if filterDest else destEntries):
+		if newerThanNewestFile and isFile(entry) or newerThanNewestFolder and isDir(entry):
+			entryCount += 1
+			if newestDestDate < entry.st_mtime:
+				newestDestDate = entry.st_mtime
+
+	if verbose:
+		matching = " matching" if filterDest else ""
+		filesFolders = "files/folders" if newerThanNewestFile and newerThanNewestFolder else ("files" if newerThanNewestFile else "folders")
+		theNewest = f"and the newest from them has date {datetime.fromtimestamp(newestDestDate)} -> newestDestDate" if entryCount else ""
+		print(f"Destination folder has {entryCount}{matching} {filesFolders} {theNewest}")
+	return newestDestDate
+
+# --spill-listings: listings longer than spillListings are not held in memory. They are written to
+# sorted runs in temporary files (see sortedRuns) and the two sides are merge-joined by the (case
+# normalized) name, one name at a time, making the same decisions as the in-memory comparisons of
+# recursiveCopy. Entries with the same case-insensitive name come together in the merge so case
+# duplicates are found without an index
+def readListing(entries, limit: int) -> tuple[tuple, Iterator | None]:
+	"""
+	Reads the whole listing or, with --spill-listings, at most `limit` entries of it. What's left of a
+	longer listing is returned as an iterator (None when nothing is left)
+	"""
+	if not limit:
+		return tuple(entries), None
+	entries = iter(entries)
+	head = tuple(islice(entries, limit))
+	for entry in entries:
+		return head, chain((entry,), entries)
+	return head, None
+
+def spillListing(markedEntries, caseless: bool) -> SortedRuns:
+	""" (entry, passed the filters) pairs as sorted records (key, filename, st_mode, st_size, st_atime, st_mtime, passed) """
+	runs = SortedRuns(spillListings)
+	for entry, passed in markedEntries:
+		runs.add((entry.filename.lower() if caseless else entry.filename, entry.filename, entry.st_mode, entry.st_size, entry.st_atime, entry.st_mtime, passed))
+	return runs
+
+def spilledEntry(record: tuple) -> LocalSFTPAttributes:
+	_, filename, st_mode, st_size, st_atime, st_mtime, _ = record
+	return LocalSFTPAttributes.from_values(filename=filename, st_mode=st_mode, st_size=st_size, st_atime=st_atime, st_mtime=st_mtime)
+
+def spillBothListings(sourceMarked, destMarked, caseless: bool, sourceFolderParam: str, destFolderParam: str, NNS: MyNamespace) -> tuple[SortedRuns, SortedRuns] | None:
+	""" None when any of the listings failed (the error was handled) """
+	try:
+		sourceRuns = spillListing(sourceMarked, caseless)
+	except ListingAborted:
+		return None
+	except Exception as e:
+		permissionErrorHandler(e, NNS.source_designation, NNS.source_str, sourceFolderParam)
+		return None
+	try:
+		destRuns = spillListing(destMarked, caseless)
+	except Exception as e:
+		sourceRuns.close()
+		permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, destFolderParam)
+		return None
+	return sourceRuns, destRuns
+
+def caseDuplicateGroups(runs: SortedRuns, passedOnly: bool) -> list[list[LocalSFTPAttributes]]:
+	""" Groups of (passed) entries whose names only differ in letter case. `runs` have to be keyed case-insensitively """
+	groups = []
+	for _, records, _ in mergeJoin(runs, ()):
+		entries = [spilledEntry(record) for record in records if record[6] or not passedOnly]
+		if len(entries) > 1:
+			groups.append(entries)
+	return groups
+
+def spilledCopy(
+	sourceEntries,
+	destEntries,
+	sourceFolderParam: str,
+	destFolderParam: str,
+	depth: int,
+	NNS: MyNamespace,
+	RNS: MyNamespace,
+	filterFun: FilterClass,
+	caseless: bool,
+	checkCase: bool,
+	sourceErrorOccured: bool,
+	destErrorOccured: bool,
+	destCaseSense: bool,
+):
+	""" COPY mode of recursiveCopy for listings longer than --spill-listings. `sourceEntries` passed the filters already """
+	runs = spillBothListings(((entry, True) for entry in sourceEntries), ((entry, True) for entry in destEntries), caseless, sourceFolderParam, destFolderParam, NNS)
+	if runs is None:
+		return
+	with runs[0] as sourceRuns, runs[1] as destRuns:
+		if not sourceRuns and not removeNotInSrc:
+			return
+
+		if checkCase: # like checkCaseDuplicates, before anything is copied
+			duplicates = caseDuplicateGroups(sourceRuns, False)
+			reportCaseDuplicates(duplicates, sourceErrorOccured, destErrorOccured, NNS.source_designation, NNS.source_str, sourceFolderParam)
+			duplicateKeys = {group[0].filename.lower() for group in duplicates}
+		else:
+			duplicateKeys = ()
+
+		newestDestDate = 0
+		if sourceRuns and (newerThanNewestFile or newerThanNewestFolder):
+			newestDestDate = findNewestDestDate(map(spilledEntry, destRuns), filterFun, destCaseSense)
+
+		for key, sourceRecords, destRecords in mergeJoin(sourceRuns, destRuns):
+			destEntry = spilledEntry(destRecords[-1]) if destRecords else None # like the dict of the destination entries - the last one wins
+			if sourceRecords and key not in duplicateKeys:
+				match recursiveCopyHelper(
+					sourceEntry       = spilledEntry(sourceRecords[0]),
+					destEntry         = destEntry,
+					sourceFolderParam = sourceFolderParam,
+					destFolderParam   = destFolderParam,
+					depth             = depth,
+					NNS               = NNS,
+					RNS               = RNS,
+					force             = force,
+					newestDestDate    = newestDestDate,
+				):
+					case ACTION.RETURN: return
+			elif destEntry and removeNotInSrc:
+				if moveDetector:
+					moveDetector.addRemoved(destFolderParam, destEntry)
+				else:
+					recursiveRemove(destFolderParam, destEntry, NNS.destFolderIter, NNS.destRemove, NNS.destRmdir, NNS.dest_designation, NNS.dest_str)
+
+def spilledSyncPair(sourceRecords: list[tuple], destRecords: list[tuple]) -> tuple:
+	"""
+	(sourceEntry, destEntry, sourceEntryBase, destEntryBase) of one name like the indexes of the
+	in-memory SYNC comparison: an entry passed the filters and is not a case duplicate, and the base
+	is that entry or else the last one with the name
+	"""
+	pair = []
+	for records in (sourceRecords, destRecords):
+		passed = [record for record in records if record[6]]
+		pair.append(spilledEntry(passed[0]) if len(passed) == 1 else None) # more than one are case duplicates
+	for entry, records in zip(pair[:2], (sourceRecords, destRecords)):
+		pair.append(entry or (spilledEntry(records[-1]) if records else None))
+	return tuple(pair)
+
+def spilledSync(
+	sourceMarked,
+	destMarked,
+	sourceFolderParam: str,
+	destFolderParam: str,
+	depth: int,
+	NNS: MyNamespace,
+	RNS: MyNamespace,
+):
+	""" SYNC mode of recursiveCopy for listings longer than --spill-listings. Both listings are (entry, passed the filters) pairs """
+	sourceErrorOccured, sourceCaseSense = NNS.isSourceFolderCaseSensitive(sourceFolderParam)
+	destErrorOccured  , destCaseSense   = NNS.isDestFolderCaseSensitive  (destFolderParam  )
+	caseless = not sourceCaseSense or not destCaseSense
+
+	runs = spillBothListings(sourceMarked, destMarked, caseless, sourceFolderParam, destFolderParam, NNS)
+	if runs is None:
+		return
+	with runs[0] as sourceRuns, runs[1] as destRuns:
+		if caseless:
+			reportCaseDuplicates(caseDuplicateGroups(sourceRuns, True), sourceErrorOccured, destErrorOccured, NNS.source_designation, NNS.source_str, sourceFolderParam)
+			reportCaseDuplicates(caseDuplicateGroups(destRuns  , True), sourceErrorOccured, destErrorOccured, NNS.dest_designation  , NNS.dest_str  , destFolderParam  )
+
+		# The newest common date has to be known before anything is synced so the runs are merged twice
+		newestCommonDate = 0
+		anyEntry = False
+		for _, sourceRecords, destRecords in mergeJoin(sourceRuns, destRuns):
+			sourceEntry, destEntry, _, _ = spilledSyncPair(sourceRecords, destRecords)
+			anyEntry = anyEntry or bool(sourceEntry or destEntry)
+			if sourceEntry and destEntry and (isFile(sourceEntry) or commonDateFromFolders and isDir(sourceEntry)) and sourceEntry.st_mtime == destEntry.st_mtime:
+				if newestCommonDate < sourceEntry.st_mtime:
+					newestCommonDate = sourceEntry.st_mtime
+		if not anyEntry:
+			return
+
+		if printCommonDate and not silent:
+			print(f".{sourceFolderParam.replace(NNS.sourceFolderBase, "", 1) or "/"}: Newest common date: { \
+				datetime.fromtimestamp(newestCommonDate).strftime(printCommonDate).format(rel = getRelTime(newestCommonDate))}")
+
+		for _, sourceRecords, destRecords in mergeJoin(sourceRuns, destRuns):
+			sourceEntry, destEntry, sourceEntryBase, destEntryBase = spilledSyncPair(sourceRecords, destRecords)
+			if not (sourceEntry or destEntry): continue
+			if syncEntry(sourceEntry, destEntry, sourceEntryBase, destEntryBase, sourceFolderParam, destFolderParam, depth, NNS, RNS, newestCommonDate) == ACTION.RETURN:
+				return
+
 def recursiveCopy(
 	sourceFolderParam: str,
 	destFolderParam: str,
@@ -782,177 +1658,240 @@ def recursiveCopy(
 		print(f"{ENTERING_OK} {NNS.source_designation_padded} source      folder: {sourceFolderParam}")
 		print(f"{ENTERING_OK} {NNS.dest_designation_padded  } destination folder: {destFolderParam}")
 
-	filterFun = FilterClass(sourceFolderParam, NNS.sourceFolderBase, recursionOk = depth < maxRecursionDepth or createMaxRecFolders)
+	if enteredFolders is not None:
+		enteredFolders.add(sourceFolderParam.rstrip("/"))
 
+	filterFun = FilterClass(sourceFolderParam, NNS.sourceFolderBase, recursionOk = depth < maxRecursionDepth or createMaxRecFolders, ignore = NNS.sourceIgnore)
+	targets = childTargets(sourceFolderParam) if PATH_TARGETING else None
+
+	# The source listing is streamed while the destination one is read whole into a dict (a hash join)
+	# so files get transferred while huge source folders are still being listed. Subfolders are only
+	# recursed into once the source listing is exhausted so nested listings never have to buffer it.
+	# Whenever the whole source listing is needed anyway (i.e. sorting, case-duplicates checks, removing
+	# entries not in the source) it is read whole up front like before
 	match mode:
 		case MODE.COPY:
+			sourceFolderIter = NNS.sourceFolderIter
+			if NNS.sourceFilteredIter: # the remote helper drops the entries filterFun would reject before sending the listing
+				sourceFolderIter = lambda path: NNS.sourceFilteredIter(path, filterFun.recursionOk)
+
 			try:
-				sourceEntries: tuple[paramiko.SFTPAttributes] = tuple(filter(filterFun, NNS.sourceFolderIter(sourceFolderParam)))
+				sourceEntries = filter(filterFun, handledListing(listFolder(sourceFolderIter, NNS.sourceStat, sourceFolderParam, targets), NNS.source_designation, NNS.source_str, sourceFolderParam))
 			except Exception as e:
 				permissionErrorHandler(e, NNS.source_designation, NNS.source_str, sourceFolderParam)
 				return
 
-			if not sourceEntries and not removeNotInSrc: return
+			try:
+				firstSourceEntry = next(sourceEntries, None)
+			except ListingAborted:
+				return
+			if firstSourceEntry is None and not removeNotInSrc: return
+			sourceEntries = chain((firstSourceEntry,), sourceEntries) if firstSourceEntry is not None else ()
+			hasSourceEntries = firstSourceEntry is not None
 
 			sourceErrorOccured, sourceCaseSense = NNS.isSourceFolderCaseSensitive(sourceFolderParam)
 			destErrorOccured  , destCaseSense   = NNS.isDestFolderCaseSensitive  (destFolderParam  )
 			ALL_CASE_SENSITIVE = sourceCaseSense and destCaseSense
 
+			streamSource = not (sortEntries or removeNotInSrc or sourceCaseSense and not destCaseSense)
+			destTargets = None if removeNotInSrc or newerThanNewestFile or newerThanNewestFolder else targets # they need the whole destination folder
+			if not streamSource:
+				try:
+					sourceEntries, sourceRest = readListing(sourceEntries, spillListings)
+				except ListingAborted:
+					return
+				if sourceRest is not None: # too long to be held in memory
+					try:
+						destListing = listFolder(NNS.destFolderIter, NNS.destStat, destFolderParam, destTargets)
+					except Exception as e:
+						permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, destFolderParam)
+						return
+					return spilledCopy(chain(sourceEntries, sourceRest), destListing, sourceFolderParam, destFolderParam, depth, NNS, RNS, filterFun,
+						not ALL_CASE_SENSITIVE, sourceCaseSense and not destCaseSense, sourceErrorOccured, destErrorOccured, destCaseSense)
+
 			if sourceCaseSense and not destCaseSense: # Most probable scenario: copy from Linux to Windows
 				sourceEntries = checkCaseDuplicates(sourceEntries, sourceErrorOccured, destErrorOccured, NNS.source_designation, NNS.source_str, sourceFolderParam)
+				hasSourceEntries = bool(sourceEntries)
 				if not sourceEntries and not removeNotInSrc: return
 
 			if sortEntries:
 				sourceEntries = sorted(sourceEntries, key=lambda x: x.filename)
 
 			try:
-				destEntries: list[paramiko.SFTPAttributes] = NNS.destFolderIter(destFolderParam)
+				destEntries, destRest = readListing(listFolder(NNS.destFolderIter, NNS.destStat, destFolderParam, destTargets), spillListings)
 			except Exception as e:
 				permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, destFolderParam)
 				return
+			if destRest is not None: # too long to be held in memory. The source entries went through checkCaseDuplicates already unless they are streamed
+				return spilledCopy(sourceEntries, chain(destEntries, destRest), sourceFolderParam, destFolderParam, depth, NNS, RNS, filterFun,
+					not ALL_CASE_SENSITIVE, False, sourceErrorOccured, destErrorOccured, destCaseSense)
 
 			newestDestDate = 0
-			if sourceEntries and (newerThanNewestFile or newerThanNewestFolder): # find newest file/folder in the destination folder
-				if DEST_FILTER_WARN and not destCaseSense:
-					cprint("Warning: When searching for newest file in the destination folder you may have excluded some files/folders case-sensitivly but the destination folder is case-insensitive", COLOR_WARN)
-
-				entryCount = 0
-				for entry in (filter(filterFun._innerFilterFun, destEntries) if filterDest else destEntries):
-					if newerThanNewestFile and isFile(entry) or newerThanNewestFolder and isDir(entry):
-						entryCount += 1
-						if newestDestDate < entry.st_mtime:
-							newestDestDate = entry.st_mtime
-
-				if verbose:
-					matching = " matching" if filterDest else ""
-					filesFolders = "files/folders" if newerThanNewestFile and newerThanNewestFolder else ("files" if newerThanNewestFile else "folders")
-					theNewest = f"and the newest from them has date {datetime.fromtimestamp(newestDestDate)} -> newestDestDate" if entryCount else ""
-					print(f"Destination folder has {entryCount}{matching} {filesFolders} {theNewest}")
+			if hasSourceEntries and (newerThanNewestFile or newerThanNewestFolder):
+				newestDestDate = findNewestDestDate(destEntries, filterFun, destCaseSense)
 
 			# If any of the locations is case-insensitive we have to normalize the case as that is more intuitive
 			if ALL_CASE_SENSITIVE: destEntriesDict = {entry.filename        : entry for entry in destEntries}
 			else                 : destEntriesDict = {entry.filename.lower(): entry for entry in destEntries}
+			del destEntries
 
-			if removeNotInSrc and destEntries:
+			if removeNotInSrc and destEntriesDict:
 				if ALL_CASE_SENSITIVE:
 					sourceNames = {entry.filename for entry in sourceEntries}
 				else:
 					sourceNames = {entry.filename.lower() for entry in sourceEntries}
 				for filename, destEntry in destEntriesDict.items(): # We iterate over destEntriesDict because it has case normalized names if not ALL_CASE_SENSITIVE
 					if filename not in sourceNames:
-						recursiveRemove(destFolderParam, destEntry, NNS.destFolderIter, NNS.destRemove, NNS.destRmdir, NNS.dest_designation, NNS.dest_str)
+						if moveDetector:
+							moveDetector.addRemoved(destFolderParam, destEntry)
+						else:
+							recursiveRemove(destFolderParam, destEntry, NNS.destFolderIter, NNS.destRemove, NNS.destRmdir, NNS.dest_designation, NNS.dest_str)
 
-			for sourceEntry in sourceEntries:
-				name = sourceEntry.filename
-				match recursiveCopyHelper(
-					sourceEntry       = sourceEntry,
-					destEntry         = destEntriesDict.get(name if ALL_CASE_SENSITIVE else name.lower()),
-					sourceFolderParam = sourceFolderParam,
-					destFolderParam   = destFolderParam,
-					depth             = depth,
-					NNS               = NNS,
-					RNS               = RNS,
-					force             = force,
-					newestDestDate    = newestDestDate,
-				):
-					case ACTION.RETURN: return
+			if streamSource:
+				sourceEntries = chain(deferFolders(sourceEntries, sourceFolders := []), prefetchedFolders(sourceFolders, NNS, sourceFolderParam, destFolderParam, depth))
+			else:
+				prefetchFolders(NNS, sourceFolderParam, destFolderParam, ((entry, None) for entry in sourceEntries), depth)
+
+			try:
+				for sourceEntry in sourceEntries:
+					name = sourceEntry.filename
+					match recursiveCopyHelper(
+						sourceEntry       = sourceEntry,
+						destEntry         = destEntriesDict.get(name if ALL_CASE_SENSITIVE else name.lower()),
+						sourceFolderParam = sourceFolderParam,
+						destFolderParam   = destFolderParam,
+						depth             = depth,
+						NNS               = NNS,
+						RNS               = RNS,
+						force             = force,
+						newestDestDate    = newestDestDate,
+					):
+						case ACTION.RETURN: return
+			except ListingAborted: # subfolders of the source folder listed so far are not entered either
+				return
 		case MODE.SYNC:
 			try:
-				sourceEntriesBase: list[paramiko.SFTPAttributes] = NNS.sourceFolderIter(sourceFolderParam)
+				sourceEntriesBase = handledListing(listFolder(NNS.sourceFolderIter, NNS.sourceStat, sourceFolderParam, targets), NNS.source_designation, NNS.source_str, sourceFolderParam)
 			except Exception as e:
 				permissionErrorHandler(e, NNS.source_designation, NNS.source_str, sourceFolderParam)
 				return
 
 			try:
-				destEntriesBase: list[paramiko.SFTPAttributes] = NNS.destFolderIter(destFolderParam)
+				destEntriesBase, destRest = readListing(listFolder(NNS.destFolderIter, NNS.destStat, destFolderParam, targets), spillListings)
 			except Exception as e:
 				permissionErrorHandler(e, NNS.dest_designation, NNS.dest_str, destFolderParam)
 				return
-
-			sourceEntries = tuple(filter(filterFun, sourceEntriesBase))
-			destEntries   = tuple(filter(filterFun, destEntriesBase  ))
-
-			if not (sourceEntries or destEntries): return
+			if destRest is not None: # too long to be held in memory
+				return spilledSync(
+					((entry, filterFun(entry)) for entry in sourceEntriesBase),
+					((entry, filterFun(entry)) for entry in chain(destEntriesBase, destRest)),
+					sourceFolderParam, destFolderParam, depth, NNS, RNS,
+				)
+
+			destEntries = tuple(filter(filterFun, destEntriesBase))
+			sourceMarked = ((entry, filterFun(entry)) for entry in sourceEntriesBase) # (entry, passed the filters)
+
+			if not destEntries: # read the source listing only up to the first entry that passed the filters to know if there is anything to do
+				sourceRead = []
+				try:
+					for item in sourceMarked:
+						sourceRead.append(item)
+						if item[1]: break
+					else:
+						return
+				except ListingAborted:
+					return
+				sourceMarked = chain(sourceRead, sourceMarked)
 
 			sourceErrorOccured, sourceCaseSense = NNS.isSourceFolderCaseSensitive(sourceFolderParam)
 			destErrorOccured  , destCaseSense   = NNS.isDestFolderCaseSensitive  (destFolderParam  )
 
-			if not sourceCaseSense or not destCaseSense:
-				sourceEntries = checkCaseDuplicates(sourceEntries, sourceErrorOccured, destErrorOccured, NNS.source_designation, NNS.source_str, sourceFolderParam)
-				destEntries   = checkCaseDuplicates(destEntries  , sourceErrorOccured, destErrorOccured, NNS.dest_designation  , NNS.dest_str  , destFolderParam  )
-
-				if not (sourceEntries or destEntries): return
-
-				sourceEntriesDictBase = {entry.filename.lower(): entry for entry in sourceEntriesBase}
-				destEntriesDictBase   = {entry.filename.lower(): entry for entry in destEntriesBase  }
-				sourceEntriesDict     = {entry.filename.lower(): entry for entry in sourceEntries    }
-				destEntriesDict       = {entry.filename.lower(): entry for entry in destEntries      }
+			streamed = sourceCaseSense and destCaseSense and not (sortEntries or printCommonDate) # -g/--print-common-date has to print before the transfers
+			if streamed:
+				destEntriesDict, destNames = indexEntries(destEntriesBase, destEntries, False)
+				del destEntriesBase, destEntries
+
+				# Pairs can be synced right away. Entries without a pair have to wait for the newest common date
+				# which is only known once the whole source listing has been read
+				newestCommonDate = 0
+				deferred: list[tuple] = []
+				try:
+					for sourceEntryBase, passed in sourceMarked:
+						destEntryBase = destEntriesDict.pop(sourceEntryBase.filename, None) # what stays in the dict exists only in the destination
+						sourceEntry = sourceEntryBase if passed else None
+						destEntry   = destEntryBase if destEntryBase and sourceEntryBase.filename in destNames else None
+						if not (sourceEntry or destEntry): continue
+
+						if sourceEntry and destEntry and (isFile(sourceEntry) or commonDateFromFolders and isDir(sourceEntry)) and sourceEntry.st_mtime == destEntry.st_mtime:
+							if newestCommonDate < sourceEntry.st_mtime:
+								newestCommonDate = sourceEntry.st_mtime
+
+						if not destEntryBase or isDir(sourceEntryBase) or isDir(destEntryBase):
+							deferred.append((sourceEntry, destEntry, sourceEntryBase, destEntryBase))
+						elif syncEntry(sourceEntry, destEntry, sourceEntryBase, destEntryBase, sourceFolderParam, destFolderParam, depth, NNS, RNS, newestCommonDate) == ACTION.RETURN:
+							return
+				except ListingAborted: # without the whole source listing the entries only in the destination can't be told apart from removed ones
+					return
+
+				for name, destEntry in destEntriesDict.items():
+					if name in destNames:
+						deferred.append((None, destEntry, None, destEntry))
+				del destEntriesDict, destNames
 			else:
-				sourceEntriesDictBase = {entry.filename: entry for entry in sourceEntriesBase}
-				destEntriesDictBase   = {entry.filename: entry for entry in destEntriesBase  }
-				sourceEntriesDict     = {entry.filename: entry for entry in sourceEntries    }
-				destEntriesDict       = {entry.filename: entry for entry in destEntries      }
-
-			allNames = sourceEntriesDict.keys() | destEntriesDict.keys()
-
-			if sortEntries:
-				allNames = sorted(allNames)
-
-			newestCommonDate = 0
-			allEntries: List[Tuple[paramiko.SFTPAttributes, paramiko.SFTPAttributes, str]] = []
-			for name in allNames:
-				sourceEntry = sourceEntriesDict.get(name)
-				destEntry   = destEntriesDict  .get(name)
-				allEntries.append((sourceEntry, destEntry, name)) # We save the name because it might have been .lower()ed
-				if sourceEntry and destEntry and (isFile(sourceEntry) or commonDateFromFolders and isDir(sourceEntry)) and sourceEntry.st_mtime == destEntry.st_mtime:
-					if newestCommonDate < sourceEntry.st_mtime:
-						newestCommonDate = sourceEntry.st_mtime
+				try:
+					sourceMarked, sourceRest = readListing(sourceMarked, spillListings)
+				except ListingAborted:
+					return
+				if sourceRest is not None: # too long to be held in memory
+					destPassed = set(destEntries) # entries hash by identity
+					return spilledSync(chain(sourceMarked, sourceRest), ((entry, entry in destPassed) for entry in destEntriesBase), sourceFolderParam, destFolderParam, depth, NNS, RNS)
+				sourceEntriesBase = [entry for entry, _ in sourceMarked]
+				sourceEntries = tuple(entry for entry, passed in sourceMarked if passed)
+				del sourceMarked
+
+				if not sourceCaseSense or not destCaseSense:
+					sourceEntries = checkCaseDuplicates(sourceEntries, sourceErrorOccured, destErrorOccured, NNS.source_designation, NNS.source_str, sourceFolderParam)
+					destEntries   = checkCaseDuplicates(destEntries  , sourceErrorOccured, destErrorOccured, NNS.dest_designation  , NNS.dest_str  , destFolderParam  )
+
+					if not (sourceEntries or destEntries): return
+
+				# One index per side holding every entry plus the names of the ones that passed the filters
+				sourceEntriesDict, sourceNames = indexEntries(sourceEntriesBase, sourceEntries, not sourceCaseSense or not destCaseSense)
+				destEntriesDict  , destNames   = indexEntries(destEntriesBase  , destEntries  , not sourceCaseSense or not destCaseSense)
+				del sourceEntriesBase, destEntriesBase, sourceEntries, destEntries # the indexes hold the entries from now on and they stay alive during the whole recursion
+
+				newestCommonDate = 0
+				for name in sourceNames & destNames:
+					sourceEntry = sourceEntriesDict[name]
+					destEntry   = destEntriesDict  [name]
+					if (isFile(sourceEntry) or commonDateFromFolders and isDir(sourceEntry)) and sourceEntry.st_mtime == destEntry.st_mtime:
+						if newestCommonDate < sourceEntry.st_mtime:
+							newestCommonDate = sourceEntry.st_mtime
+
+				allNames = sourceNames | destNames
+				if sortEntries:
+					allNames = sorted(allNames)
+
+				deferred = ( # name might have been .lower()ed
+					(
+						sourceEntriesDict[name] if name in sourceNames else None,
+						destEntriesDict  [name] if name in destNames   else None,
+						sourceEntriesDict.get(name),
+						destEntriesDict  .get(name),
+					)
+					for name in allNames
+				)
 
 			if printCommonDate and not silent:
 				print(f".{sourceFolderParam.replace(NNS.sourceFolderBase, "", 1) or "/"}: Newest common date: { \
 					datetime.fromtimestamp(newestCommonDate).strftime(printCommonDate).format(rel = getRelTime(newestCommonDate))}")
 
-			for sourceEntry, destEntry, name in allEntries:
-				# When sourceEntry is None sourceEntryBase might not be None (because i.e. folders where
-				# filetered out or entries where filtered case-sensitively while the folders are
-				# case-insensitive). That's why we need to get it from the dict and check it. The same
-				# applies to destEntry and destEntryBase.
+			if streamed: prefetchFolders(NNS, sourceFolderParam, destFolderParam, ((pair[2], pair[3]) for pair in deferred), depth)
+			else       : prefetchFolders(NNS, sourceFolderParam, destFolderParam, ((sourceEntriesDict.get(name), destEntriesDict.get(name)) for name in allNames), depth)
 
-				# When sourceEntry is not None and sourceEntryBase is not None then they should refer to
-				# the same object so sourceEntry is sourceEntryBase == True
-				sourceEntryBase = sourceEntriesDictBase.get(name)
-				destEntryBase   = destEntriesDictBase  .get(name)
-
-				if sourceEntry:
-					if not destEntryBase and sourceEntry.st_mtime < newestCommonDate:
-						recursiveRemove(sourceFolderParam, sourceEntry, NNS.sourceFolderIter, NNS.sourceRemove, NNS.sourceRmdir, NNS.source_designation, NNS.source_str)
-					else:
-						match recursiveCopyHelper(
-							sourceEntry       = sourceEntry,
-							destEntry         = destEntryBase,
-							sourceFolderParam = sourceFolderParam,
-							destFolderParam   = destFolderParam,
-							depth             = depth,
-							NNS               = NNS,
-							RNS               = RNS,
-						):
-							case ACTION.CONTINUE: continue
-							case ACTION.RETURN: return
-				if destEntry:
-					if not sourceEntryBase and destEntry.st_mtime < newestCommonDate:
-						recursiveRemove(destFolderParam, destEntry, NNS.destFolderIter, NNS.destRemove, NNS.destRmdir, NNS.dest_designation, NNS.dest_str)
-					else:
-						match recursiveCopyHelper(
-							sourceEntry       = destEntry,
-							destEntry         = sourceEntryBase,
-							sourceFolderParam = destFolderParam,
-							destFolderParam   = sourceFolderParam,
-							depth             = depth,
-							NNS               = RNS,
-							RNS               = NNS,
-						):
-							case ACTION.CONTINUE: continue
-							case ACTION.RETURN: return
+			for sourceEntry, destEntry, sourceEntryBase, destEntryBase in deferred:
+				if syncEntry(sourceEntry, destEntry, sourceEntryBase, destEntryBase, sourceFolderParam, destFolderParam, depth, NNS, RNS, newestCommonDate) == ACTION.RETURN:
+					return
 
 if not silent:
 	match mode:
@@ -964,21 +1903,202 @@ if not silent:
 	print(f"Destination folder: {destFolder}")
 	print(f"{operation} files:\n")
 
-recursiveCopy(
-	sourceFolderParam = sourceFolder,
-	destFolderParam   = destFolder,
-	NNS = normalNS,
-	RNS = reverseNS,
-	depth = 0,
-)
+if watchDebounce is not None:
+	# Watching starts before the first copy/sync so nothing changed during it gets lost. In SYNC mode
+	# the destination folder is watched too, local folders with inotify and remote ones by a remote
+	# helper of their own
+	def inWatchedTree(rel: str) -> bool:
+		""" Whether a full run would enter the folder `rel` (relative to the root folders) judging by the names and the depth only """
+		parent = sourceFolder
+		for depth, name in enumerate(rel.split("/") if rel else ()):
+			ignored = sourceIgnore.forFolder(parent) if sourceIgnore else None
+			if depth >= maxRecursionDepth or not folderMatch(name, parent) or ignored and ignored(parent, name, True):
+				return False
+			parent += name + "/"
+		return True
+
+	def relPath(root: str, folder: str) -> str:
+		return folder[len(root):].strip("/")
+
+	if REMOTE_IS_REMOTE and (not SOURCE_IS_LOCAL or mode == MODE.SYNC):
+		watchPython = rld.pythonStr if isinstance(rld, RemoteListDir) else remoteHasPython(ssh, throwOnNotFound = False)
+		if not watchPython:
+			raise SimpleError("--watch needs Python 3 on the remote host to watch the remote folder")
+		watchFilter = RemoteListingFilter(fileMatch.rules, fileMatch.default, folderMatch.rules, folderMatch.default) # the helper doesn't know the ignore files - inWatchedTree checks them
+
+	def startWatching(root: str, isLocal: bool) -> InotifyWatcher | RemoteWatcher:
+		if not isLocal:
+			return RemoteWatcher(ssh, watchPython, root, watchDebounce, watchFilter, sourceFolder, maxRecursionDepth)
+		try:
+			return InotifyWatcher(root, lambda parentPath, name: inWatchedTree(posixpath.join(relPath(root, parentPath), name)))
+		except OSError as e:
+			raise SimpleError(f"--watch could not watch the folder {root}: {e}")
+
+	watchedFolders = [(sourceFolder, SOURCE_IS_LOCAL)] + ([(destFolder, DEST_IS_LOCAL)] if mode == MODE.SYNC else [])
+	watchers = [startWatching(root, isLocal) for root, isLocal in watchedFolders]
+
+if treeSummaries:
+	# One walk per side up front (remotely a single request) so whole subtrees where nothing changed are
+	# skipped. Entries are filtered like FilterClass does (without --ignore-files, which only costs some
+	# precision) with the source paths on both sides. The summaries are only valid during this run -
+	# changing a file doesn't change the modification date of its folder so a summary saved for the next
+	# run could not be trusted without walking the folder again
+	summaryAccept = filterAcceptor(fileMatch, folderMatch, filesNewerThanDate, foldersNewerThanDate)
+	def localTreeSummaries(path: str): return summarizeTree(path, summaryAccept, sourceFolder, preservePermissions)
+
+	if REMOTE_IS_REMOTE:
+		if not isinstance(rld, RemoteListDir):
+			raise SimpleError("--tree-summaries needs the remote Python script of -b/--fast-remote-listdir-attr")
+		summaryFilter = RemoteListingFilter(fileMatch.rules, fileMatch.default, folderMatch.rules, folderMatch.default, filesNewerThanDate, foldersNewerThanDate)
+		def remoteTreeSummaries(path: str): return rld.summarizeTree(path, summaryFilter, sourceFolder, preservePermissions)
+
+		sourceTreeSummaries = (localTreeSummaries if LOCAL_IS_SOURCE else remoteTreeSummaries)(sourceFolder)
+		destTreeSummaries   = (remoteTreeSummaries if LOCAL_IS_SOURCE else localTreeSummaries)(destFolder  )
+	else:
+		sourceTreeSummaries = localTreeSummaries(sourceFolder)
+		destTreeSummaries   = localTreeSummaries(destFolder  )
+
+	if verbose:
+		print(f"Tree summaries: {len(sourceTreeSummaries)} source and {len(destTreeSummaries)} destination folders\n")
+
+if treeSummaries and sameTreeSummaries(normalNS, sourceFolder, destFolder):
+	if not silent:
+		print("Nothing changed (--tree-summaries)")
+else:
+	recursiveCopy(
+		sourceFolderParam = sourceFolder,
+		destFolderParam   = destFolder,
+		NNS = normalNS,
+		RNS = reverseNS,
+		depth = 0,
+	)
+	forgetPrefetched(normalNS, sourceFolder, destFolder)
+if moveDetector:
+	moveDetector.apply()
+if deduplicator:
+	deduplicator.apply()
+transferPool.join()
+
+if watchDebounce is not None:
+	# Every batch of changes is pushed through recursiveCopy again but only for the folders where
+	# something changed (shallowPass) and the folders that appeared (as a whole) on either side.
+	# Subfolders are only entered when they are missing on the destination. Deleted entries are
+	# handled by the folder that contained them - like in a full run they are removed with
+	# -J/--remove-not-in-src or by the newest common date rules in SYNC mode. When the kernel dropped
+	# events or an ignore file changed everything is walked again
+	treeSummaries = False # they describe the trees before the first run
+	watchQueue = queue.Queue() # (root, changed, appeared, overflow) of every batch or the exception that ended watching
+
+	def watchFeed(root: str, isLocal: bool, watcher: InotifyWatcher | RemoteWatcher):
+		try:
+			while True:
+				changed, appeared, overflow = watcher.waitForChanges(watchDebounce) if isLocal else watcher.waitForChanges()
+				if ignoreFileName and any(ignoreFileName in names for names in changed.values()):
+					overflow = True
+				if overflow and isLocal: # the watches have to follow the new ignore rules too
+					if sourceIgnore:
+						sourceIgnore.cache.clear()
+					watcher.close()
+					watcher = startWatching(root, isLocal)
+				watchQueue.put((root, changed, appeared, overflow))
+		except FileNotFoundError:
+			watchQueue.put(SimpleError(f"The watched folder {root} was removed or moved"))
+		except Exception as e:
+			watchQueue.put(e)
+		finally:
+			watcher.close()
+
+	def restoreFolderTimes(sourcePath: str, destPath: str):
+		""" A full run sets the times of a folder after its contents - transfers into the folder changed them on the destination """
+		sourceEntry, destEntry = normalNS.sourceStat(sourcePath), normalNS.destStat(destPath)
+		if sourceEntry and destEntry and sourceEntry.st_mtime != destEntry.st_mtime:
+			normalNS.destUtime(destPath, (sourceEntry.st_atime, sourceEntry.st_mtime))
+
+	def watchPass(rel: str, shallow: bool):
+		global shallowPass
+		if (sourceFolder + rel).rstrip("/") in enteredFolders or not inWatchedTree(rel): # walked already or filtered out
+			return
+		shallowPass = shallow
+		try:
+			recursiveCopy(
+				sourceFolderParam = sourceFolder + rel,
+				destFolderParam   = destFolder + rel,
+				NNS = normalNS,
+				RNS = reverseNS,
+				depth = rel.count("/") + 1 if rel else 0,
+			)
+		except FileNotFoundError: # removed in the meantime or not created by the pass of its parent folder (filtered out there)
+			if verbose:
+				print(f"{rel} - skipping folder because it is missing on one of the sides")
+			return
+		finally:
+			forgetPrefetched(normalNS, sourceFolder + rel, destFolder + rel)
+		if rel and preserveTimes:
+			transferPool.defer(restoreFolderTimes, sourceFolder + rel, destFolder + rel)
+
+	for (root, isLocal), watcher in zip(watchedFolders, watchers):
+		threading.Thread(target=watchFeed, args=(root, isLocal, watcher), daemon=True).start()
+	if not silent:
+		print(f"\nWatching {" and ".join(f"{root} ({watcher.method})" if not isLocal else root for (root, isLocal), watcher in zip(watchedFolders, watchers))} for changes (Ctrl+C to stop)")
+
+	try:
+		while True:
+			batches = [watchQueue.get()]
+			while not watchQueue.empty(): # the other side may have changed at the same time
+				batches.append(watchQueue.get_nowait())
+
+			passes: dict[str, bool] = {} # relative folder path -> shallow
+			overflow = False
+			for batch in batches:
+				if isinstance(batch, Exception):
+					raise batch
+				root, changed, appeared, batchOverflow = batch
+				overflow = overflow or batchOverflow
+				for folder in changed:
+					passes.setdefault(relPath(root, folder), True)
+				for folder in appeared:
+					passes[relPath(root, folder)] = False
+
+			if overflow:
+				for ignore in (sourceIgnore, destIgnore):
+					if ignore:
+						ignore.cache.clear()
+				passes = {"": False}
+				if verbose:
+					print("Walking the whole folders again")
+			elif verbose:
+				print(f"Changes in: {", ".join(rel or "/" for rel in sorted(passes))}")
+
+			enteredFolders = set()
+			for rel in sorted(passes, key=len): # parents first so they create the new folders and the passes that enter them cover everything inside
+				watchPass(rel, passes[rel])
+			enteredFolders = None
+			shallowPass = False
+			if moveDetector:
+				moveDetector.apply()
+			if deduplicator:
+				deduplicator.apply()
+			transferPool.join()
+	except KeyboardInterrupt:
+		if not silent:
+			print("\nStopped watching")
+	transferPool.join()
+
+transferPool.shutdown()
 
 # the try...finally block is not needed because when an exception happens "the program ends, the
 # Python process shuts down. As part of process teardown, the underlying socket to the SSH server is
 # closed by the OS"
 if REMOTE_IS_REMOTE:
+	sftpPool.close()
+	if isinstance(rld, SFTPListDir):
+		rld.close()
 	sftp.close()
 	ssh.close()
 
+if statThreads:
+	localLister.close()
+
 if not silent:
 	print(f"\nExecution time: {perf_counter() - start:.3f} s")
 
@@ -1,15 +1,19 @@
 import sys; from pathlib import Path; p = Path(__file__).resolve().parent; __package__ = p.name; sys.path.append(p.parent.as_posix()) # To be able to use relative imports
 
 from argparse import Namespace
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from enum import auto, IntEnum
 from fnmatch import fnmatchcase
 from functools import partial as bindKwarg
-from operator import attrgetter as getAttr, itemgetter as getItem
+import io
 import os
 import shutil
+import sys
+import threading
 from time import perf_counter
-from typing import Callable, Tuple
+from typing import Callable, Iterable, Tuple
 
 from termcolor import colored as clr, cprint
 
@@ -18,13 +22,13 @@ from .fileUtils import assertFolderExists as assertLocalFolderExists, isDir, isF
 from .LocalSFTPAttributes import local_listdir_attr, LocalSFTPAttributes
 from .printRelTime import getRelTime
 from .SimpleError import SimpleError
-from .sshUtils import assertRemoteFolderExists, getSSH, remoteIsWindows, RemoteListDir
+from .sshUtils import assertRemoteFolderExists, getSSH, remoteIsWindows, RemoteListDir, RemoteListingFilter, SFTPPool
+from .transferUtils import localCopy, parseByteRate, parseJobs, sftpGet, sftpPut, TokenBucket, TransferPool
 
 """
 Edge cases that were disregarded:
 - case-insensitivity of file names on Windows - use `fsutil file setCaseSensitiveInfo "C:/path to folder" enable` to enable case-sensitivity for your folder(s)
-- caching of directory listings - while it speeds up the copying process it may result in omitting some files in more complex setups that's why it's disabled by default and you can enable it using --cache-directory-listings flag
-- this script is supposed to be simple so no recursion is performed
+- this script is supposed to be simple so no recursion is performed unless an operation asks for it (-R/--recursive-operation)
 """
 
 def printReturn(thing):
@@ -71,17 +75,6 @@ def parseFilePattern(txt: str):
 	filePattern, filePatternBool = txt.split("/", 1)
 	return (filePattern, parseBool(filePatternBool, "filePatternBool"))
 
-class CallAccumulator:
-	def __init__( self, ) -> None:
-		self.args = []
-
-	def __call__(self, *args) -> None:
-		self.args.append(args)
-		return self
-
-	def __repr__(self):
-		return f"CallAccumulator(calls={self.args})"
-
 def filterFun(file: LocalSFTPAttributes, filePatterns: Tuple[Tuple[str, bool], ...], defaultMatch: bool) -> bool:
 	if isDir(file): return False # this script is supposed to be simple so no recursion is performed
 
@@ -91,12 +84,156 @@ def filterFun(file: LocalSFTPAttributes, filePatterns: Tuple[Tuple[str, bool], .
 
 	return defaultMatch
 
+def copyAndUtime(copy: Callable, utime: Callable, sourcePath: str, destPath: str, times: tuple, record: Callable | None = None):
+	copy(sourcePath, destPath)
+	utime(destPath, times)
+	if record: record() # only once the file is really there (see ListingCache)
+
+def moveAndUtime(move: Callable, utime: Callable, delete: Callable, sourcePath: str, destPath: str, times: tuple, record: Callable | None = None):
+	move(sourcePath, destPath)
+	utime(destPath, times)
+	delete(sourcePath)
+	if record: record()
+
+class GroupedOutput:
+	"""
+	Stands in for sys.stdout while operations run concurrently. What a thread prints between start()
+	and end() is collected and printed in one piece so the lines of concurrent operations don't
+	interleave. Everything else goes straight to `stream`
+	"""
+	def __init__(self, stream):
+		self.stream = stream
+		self.local = threading.local()
+		self.lock = threading.Lock()
+
+	def start(self):
+		self.local.buffer = io.StringIO()
+
+	def end(self):
+		buffer, self.local.buffer = self.local.buffer, None
+		with self.lock:
+			self.stream.write(buffer.getvalue())
+			self.stream.flush()
+
+	def write(self, text: str) -> int:
+		buffer = getattr(self.local, "buffer", None)
+		if buffer is not None:
+			return buffer.write(text)
+		with self.lock:
+			return self.stream.write(text)
+
+	def flush(self):
+		if getattr(self.local, "buffer", None) is None:
+			self.stream.flush()
+
+	def __getattr__(self, name: str): # isatty, encoding, ... (termcolor checks isatty)
+		return getattr(self.stream, name)
+
+class ListingCache:
+	"""
+	Raw (unfiltered) listings of the folders used by more than one operation so every folder is listed
+	only once per run and every operation applies its own file patterns to it. Write-through: the
+	operations record every file they copy, move or remove so the later operations see the folders as
+	they are. Listings of the folders used only once are not kept (they are filtered remotely instead)
+	"""
+	def __init__(self, sharedFolders: set[tuple[PLACE, str]]):
+		self.sharedFolders = sharedFolders
+		self.listings: dict[tuple[PLACE, str], dict[str, LocalSFTPAttributes]] = {}
+		self.locks: dict[tuple[PLACE, str], threading.Lock] = {}
+
+	def list(self, place: PLACE, folder: str, listFolder: Callable[[], Iterable[LocalSFTPAttributes]]) -> tuple[LocalSFTPAttributes, ...] | None:
+		""" The listing of the folder (listed by `listFolder` the first time) or None if the folder is not shared """
+		key = (place, folder)
+		if key not in self.sharedFolders:
+			return None
+		with self.locks.setdefault(key, threading.Lock()): # concurrent operations list the folder only once too
+			listing = self.listings.get(key)
+			if listing is None:
+				listing = self.listings[key] = {entry.filename: entry for entry in listFolder()}
+			return tuple(listing.values())
+
+	def put(self, place: PLACE, folder: str, entry: LocalSFTPAttributes):
+		listing = self.listings.get((place, folder))
+		if listing is not None:
+			listing[entry.filename] = entry
+
+	def remove(self, place: PLACE, folder: str, filename: str):
+		listing = self.listings.get((place, folder))
+		if listing is not None:
+			listing.pop(filename, None)
+
+	def invalidate(self, place: PLACE, folder: str):
+		""" For changes that are not known file by file - the folder gets listed again when needed """
+		self.listings.pop((place, folder), None)
+
+def foldersOverlap(foldersA: set, foldersB: set) -> bool:
+	"""
+	The folders are (place, folder, recursive) - a recursive operation uses every folder below its own
+	ones too
+	"""
+	return any(
+		placeA == placeB and (folderA == folderB or recursiveA and folderB.startswith(folderA) or recursiveB and folderA.startswith(folderB))
+		for placeA, folderA, recursiveA in foldersA
+		for placeB, folderB, recursiveB in foldersB
+	)
+
+def operationDependencies(folders: list[tuple[set, set]]) -> list[set[int]]:
+	"""
+	`folders` holds the (read, written) folders of every operation (see foldersOverlap). An operation
+	depends on every earlier one that writes a folder it uses or uses a folder it writes, so they run in
+	the given order
+	"""
+	return [
+		{j for j, (readJ, writtenJ) in enumerate(folders[:i]) if foldersOverlap(written, readJ | writtenJ) or foldersOverlap(writtenJ, read | written)}
+		for i, (read, written) in enumerate(folders)
+	]
+
+def localListTree(folder: str, maxDepth: int, onError: Callable[[str, OSError], None]) -> dict[str, list[LocalSFTPAttributes]]:
+	""" Local equivalent of RemoteListDir.listTree (without the filtering) """
+	tree = {}
+	stack = [("", 0)]
+	while stack:
+		rel, depth = stack.pop()
+		try:
+			listing = local_listdir_attr(folder + rel)
+		except OSError as e:
+			if not rel: # the folder itself
+				raise
+			onError(rel, e)
+			continue
+		entries = tree[rel] = []
+		for entry in listing:
+			if isDir(entry):
+				if depth >= maxDepth:
+					continue
+				stack.append((rel + entry.filename + "/", depth + 1))
+			entries.append(entry)
+	return tree
+
+def parseRecursionDepth(txt: str) -> int:
+	if txt.lower().strip() in ("inf", "max"):
+		return sys.maxsize
+	try:
+		depth = int(txt)
+	except ValueError:
+		depth = -1
+	if depth < 0:
+		raise SimpleError(f"Invalid MAX_DEPTH: {txt}")
+	return depth
+
+def operationDepth(operation: tuple) -> int:
+	""" Operations given by scripts (see ssh-sync-bulk-example.py) may leave the recursion depth out """
+	return operation[7] if len(operation) > 7 else 0
+
 def normalizeLocalFolderPath(localFolder: str) -> str:
 	return os.path.abspath(localFolder).replace("\\", "/").rstrip("/") + "/"
 
 def normalizeRemoteFolderPath(remoteFolder: str) -> str:
 	return remoteFolder.replace("\\", "/").rstrip("/") + "/"
 
+def folderKey(folder: str, place: PLACE) -> tuple[PLACE, str]:
+	return (place, normalizeLocalFolderPath(folder) if place == PLACE.LOCAL else normalizeRemoteFolderPath(folder))
+
 def pathJoin(folder, file):
 	return folder + file
 
@@ -124,7 +261,6 @@ def main(args: Namespace = None):
 		required.add_argument(
 			"-o",
 			"--operation",
-			required=True,
 			action="append",
 			nargs=7,
 			metavar=(
@@ -136,7 +272,7 @@ def main(args: Namespace = None):
 				"FILE_PATTERNS",
 				"DEFAULT_MATCH"
 			),
-			help="Operation to perform. Can be specified multiple times",
+			help="Operation to perform. Can be specified multiple times. At least one -o/--operation or -R/--recursive-operation is required",
 			dest="operations",
 		)
 		required.add_argument("-u", "--username", required=True, default="", help="Remote username")
@@ -144,6 +280,24 @@ def main(args: Namespace = None):
 
 		parser._optionals.title = "Optional arguments"
 
+		parser.add_argument(
+			"-R",
+			"--recursive-operation",
+			action="append",
+			nargs=8,
+			metavar=(
+				"SOURCE_DIR",
+				"SOURCE_PLACE",
+				"DEST_DIR",
+				"DEST_PLACE",
+				"MODE",
+				"FILE_PATTERNS",
+				"DEFAULT_MATCH",
+				"MAX_DEPTH",
+			),
+			help='Like -o/--operation but also for the subfolders down to MAX_DEPTH ("inf" for no limit). The source and destination folders are at depth 0. Every folder tree is listed with one request to the remote script and the missing destination folders are created all at once. Folders are never removed. Runs in the given order together with the -o/--operation operations',
+			dest="operations",
+		)
 		parser.add_argument("-p", "--password"                , default=None         , help="Remote password")
 		parser.add_argument("-P", "--port"                    , default=22, type=int , help="Remote port (default: 22)")
 		parser.add_argument("-T", "--timeout"                 , default=5, type=float, help="TCP 3-way handshake timeout in seconds (default: 5.0)", metavar="SECONDS")
@@ -151,7 +305,10 @@ def main(args: Namespace = None):
 		parser.add_argument("-s", "--silent"                  , action="store_true"  , help="Print only errors")
 		parser.add_argument("-d", "--dry-run"                 , action="store_true"  , help="Do not perform any copying and just print the information that would normally be printed. Good for testing", dest="dryRun")
 		parser.add_argument("-O", "--remote-os"               , default="auto"       , help="Remote host's operating system. Can be (a, auto, auto-detect) or (w, win, windows) or (u, unix, l, linux, p, posix, m, macos). Windows just needs to be handled in a special way so we need to differentiate it from the others. Auto will run a few commands on the remote machine to determine it's OS and they are not 100%% relaible so if you know the remote's OS and want to save time you can use this argument (default: auto)", dest="remoteOs")
-		parser.add_argument("-c", "--cache-directory-listings", action="store_true"  , help="Listing all entries in a directory is a bit expensive operation so caching speeds up the copying process but it may result in omitting some files in more complex setups (i.e. for folders [A: 1 file, B: empty, C: empty] and operations ['copy from A to B', 'copy from B to C'] running the script would result in folder C still being empty because cached empty listing of folder B would be used in the second operation). To reduce confusion the caching is disabled by default and you have to enable it using this flag", dest="cacheDirectoryListings")
+		parser.add_argument("-b", "--bwlimit"                 , default=""           , help="Limit the bandwidth of all transfers combined to RATE bytes per second. Accepts K, M, G suffixes (i.e. 500K, 10M)", metavar="RATE")
+		parser.add_argument("-j", "--jobs"                    , default="1"          , help='Number of files transferred at the same time, each over its own SFTP channel (default: 1). "auto" or "auto:MAX" grows and shrinks the number of in-flight transfers (up to MAX, default 16) based on measured throughput and round-trip time', metavar="N")
+		parser.add_argument("-a", "--parallel-operations"     , default=1, type=int  , help="Run up to N operations at the same time, each with its own SFTP channel and its own -j/--jobs transfers (default: 1). An operation that uses a folder written by an earlier operation (or writes a folder an earlier one uses) waits for it to finish. The output of every operation is printed in one piece once it ends", dest="parallelOperations", metavar="N")
+		parser.add_argument("-c", "--cache-directory-listings", action="store_true"  , help="Has no effect - listings of the folders used by more than one operation are always cached now and kept up to date with the changes the operations make. Kept so existing command lines keep working", dest="cacheDirectoryListings")
 
 		args = parser.parse_args()
 
@@ -165,14 +322,25 @@ def main(args: Namespace = None):
 	silent                 : bool              = args.silent
 	dryRun                 : bool              = args.dryRun
 	remoteOs               : str               = args.remoteOs
-	cacheDirectoryListings : bool              = args.cacheDirectoryListings
+	bwlimit                : str               = getattr(args, "bwlimit", "") # getattr so Namespaces built by older scripts keep working
+	jobs                   : str               = getattr(args, "jobs"   , "1")
+	parallelOperations     : int               = getattr(args, "parallelOperations", 1)
+
+	if not operations:
+		raise SimpleError("At least one -o/--operation or -R/--recursive-operation has to be specified")
 
 	if silent and verbose:
 		raise SimpleError("-s/--silent and -v/--verbose options cannot both be specified at the same time")
 
+	if parallelOperations < 1:
+		raise SimpleError("-a/--parallel-operations option's parameter has to be at least 1")
+
+	bandwidth = TokenBucket(parseByteRate(bwlimit)) if bwlimit else None
+	maxJobs, adaptiveJobs = parseJobs(jobs)
+
 	if argsFromCli:
 		parsedOperations = []
-		for sourceDir, sourcePlace, destDir, destPlace, mode, filePatterns, defaultMatch in operations:
+		for sourceDir, sourcePlace, destDir, destPlace, mode, filePatterns, defaultMatch, *recursionDepth in operations:
 			sourcePlace  = PLACE.parseMember(sourcePlace)
 			destPlace    = PLACE.parseMember(destPlace)
 			if sourcePlace == PLACE.LOCAL: assertLocalFolderExists(sourceDir)
@@ -180,7 +348,8 @@ def main(args: Namespace = None):
 			mode         = MODE.parseMember(mode)
 			filePatterns = tuple(map(parseFilePattern, filePatterns.split("|"))) if filePatterns else []
 			defaultMatch = parseBool(defaultMatch, "defaultMatch")
-			parsedOperations.append((sourceDir, sourcePlace, destDir, destPlace, mode, filePatterns, defaultMatch))
+			recursionDepth = parseRecursionDepth(recursionDepth[0]) if recursionDepth else 0
+			parsedOperations.append((sourceDir, sourcePlace, destDir, destPlace, mode, filePatterns, defaultMatch, recursionDepth))
 	else:
 		parsedOperations = operations
 
@@ -193,6 +362,13 @@ def main(args: Namespace = None):
 		silent    = silent  ,
 	)
 	sftp = ssh.open_sftp()
+	sftpPool = SFTPPool(ssh, sftp) # transfers and operations running in other threads (-j/--jobs, -a/--parallel-operations) need their own channels
+	inlinePool = TransferPool()
+
+	def remotePut(localPath: str, remotePath: str): return sftpPut(sftpPool.get(), localPath, remotePath, bandwidth, confirm=False)
+	def remoteGet(remotePath: str, localPath: str): return sftpGet(sftpPool.get(), remotePath, localPath, bandwidth, remoteIsSparse)
+	def remoteUtime(path: str, times: tuple): return sftpPool.get().utime(path, times)
+	def remoteRemove(path: str): return sftpPool.get().remove(path)
 
 	match remoteOs.lower().strip():
 		case "w" | "win" | "windows": REMOTE_IS_WINDOWS = True
@@ -202,45 +378,67 @@ def main(args: Namespace = None):
 
 	if verbose: print(f"Remote OS is {"Windows" if REMOTE_IS_WINDOWS else "not Windows"}")
 
-	class RemoteCopyBatch:
-		def __init__(
-			self,
-			sourceDir: str,
-			destDir: str,
-			command: str,
-			printFiles = False,
-			printColor = "green",
-		) -> None:
-			self.files: list[str] = []
-			self.sourceDir = sourceDir
-			self.destDir = destDir
-			self.command = command
-			self.printFiles = printFiles
-			self.printColor = printColor
-
-		def __call__(self, filename: str, _) -> None:
-			self.files.append(filename)
+	# it's only noticeably faster if one of the remote folders that will be scanned has more than 5000 entries
+	# Every thread gets its own remote script as it answers one request at a time
+	rlds = threading.local()
+	def remoteHelper() -> RemoteListDir:
+		rld = getattr(rlds, "rld", None)
+		if rld is None:
+			rld = rlds.rld = RemoteListDir(ssh, init=False) # don't init the remote python script because it might not be needed at all
+		return rld
+
+	def remoteIsSparse(path: str) -> bool:
+		return bool(remoteHelper().sparseFiles([path])[0])
+
+	def remote_listdir_attr(path: str, remoteFilter: RemoteListingFilter):
+		return remoteHelper().listdir_attr(path, remoteFilter)
+
+	class RemoteBatch:
+		"""
+		Stands in for the copy/move/utime/remove functions of the other branches when both folders are
+		remote: the calls are collected and `finalize` has the remote helper carry them out on the server
+		itself in one round trip (see RemoteListDir.batch). The times of a copied or moved file are set
+		by the same record. The operations update the ListingCache as soon as a call is collected, so
+		`finalize` drops the cached listings of the folders a failed record touched
+		"""
+		def __init__(self) -> None:
+			self.records: list[list] = []
+			self.lastByDest: dict[str, list] = {} # record waiting for the times of its destination
+
+		def _add(self, op: str, sourcePath: str | None, destPath: str | None) -> None:
+			record = [op, sourcePath, destPath, None, None]
+			self.records.append(record)
+			if destPath is not None:
+				self.lastByDest[destPath] = record
+
+		def copy  (self, sourcePath: str, destPath: str) -> None: self._add("copy", sourcePath, destPath)
+		def move  (self, sourcePath: str, destPath: str) -> None: self._add("move", sourcePath, destPath)
+		def remove(self, path: str) -> None:                      self._add("delete", path, None)
+		def mkdir (self, path: str) -> None:                      self._add("mkdir", None, path)
+
+		def utime(self, path: str, times: tuple) -> None:
+			record = self.lastByDest.pop(path, None)
+			if record is None:
+				record = ["utime", None, path, None, None]
+				self.records.append(record)
+			record[3], record[4] = times
 
 		def finalize(self) -> None:
-			if not self.files:
+			records, self.records = self.records, []
+			self.lastByDest.clear()
+			if not records:
 				return
 
-			if not dryRun:
-				stdin, stdout, stderr = ssh.exec_command(f'cd {"/d" if REMOTE_IS_WINDOWS else ""} "{self.sourceDir}" && xargs -0 {self.command} -t "{self.destDir}"')
-
-				if self.printFiles and not silent and not isinstance(self.files, (list, tuple)): # nenecessary because self.files might be an iterable
-					self.files = tuple(self.files)
-
-				stdin.write("\0".join(self.files).replace(self.destDir, "") + "\0")
-				stdin.channel.shutdown_write()
-
-				exitCode = stdout.channel.recv_exit_status()
-
-				if exitCode != 0:
-					raise RuntimeError(f"Remote copy failed:\n{stdout.read().decode()}\n{stderr.read().decode()}")
-
-			if self.printFiles and not silent:
-				cprint("\n".join(self.files), self.printColor)
+			failed = []
+			for record, error in zip(records, remoteHelper().batch(records)):
+				if error is None:
+					continue
+				failed.append(f"{record[0]} {error.filename}: {error.strerror}")
+				for path in record[1:3]:
+					if path is not None:
+						listingCache.invalidate(PLACE.REMOTE, path[:path.rindex("/") + 1])
+			if failed:
+				raise SimpleError("Remote file operations failed:\n" + "\n".join(failed))
 
 	def filterFun(file: LocalSFTPAttributes, filePatterns: Tuple[Tuple[str, bool], ...], defaultMatch: bool) -> bool:
 		if isDir(file): return False # this script is supposed to be simple so no recursion is performed
@@ -251,35 +449,39 @@ def main(args: Namespace = None):
 
 		return defaultMatch
 
-	def syncFun(sourceFiles: dict[str, LocalSFTPAttributes], sourcePlace: PLACE, destFiles: dict[str, LocalSFTPAttributes], destPlace: PLACE, sourceDir: str, destDir: str):
+	def syncFun(sourceFiles: dict[str, LocalSFTPAttributes], sourcePlace: PLACE, destFiles: dict[str, LocalSFTPAttributes], destPlace: PLACE, sourceDir: str, destDir: str, transferPool: TransferPool):
 		if sourcePlace == PLACE.LOCAL and destPlace == PLACE.LOCAL:
-			copySourceDest = bindKwarg(shutil.copyfile, follow_symlinks=False)
+			copySourceDest = bindKwarg(localCopy, bucket=bandwidth, follow_symlinks=False)
 			copyDestSource = copySourceDest
 			utimeDest      = os.utime
 			utimeSource    = os.utime
 			removeDest     = os.remove
 			removeSource   = os.remove
 		elif sourcePlace == PLACE.REMOTE and destPlace == PLACE.LOCAL:
-			copySourceDest = sftp.get
-			copyDestSource = bindKwarg(sftp.put, confirm=False)
+			copySourceDest = remoteGet
+			copyDestSource = remotePut
 			utimeDest      = os.utime
-			utimeSource    = sftp.utime
+			utimeSource    = remoteUtime
 			removeDest     = os.remove
-			removeSource   = sftp.remove
+			removeSource   = remoteRemove
 		elif sourcePlace == PLACE.LOCAL and destPlace == PLACE.REMOTE:
-			copySourceDest = bindKwarg(sftp.put, confirm=False)
-			copyDestSource = sftp.get
-			utimeDest      = sftp.utime
+			copySourceDest = remotePut
+			copyDestSource = remoteGet
+			utimeDest      = remoteUtime
 			utimeSource    = os.utime
-			removeDest     = sftp.remove
+			removeDest     = remoteRemove
 			removeSource   = os.remove
 		elif sourcePlace == PLACE.REMOTE and destPlace == PLACE.REMOTE:
-			copySourceDest = RemoteCopyBatch(sourceDir, destDir, "cp -u", False)
-			copyDestSource = RemoteCopyBatch(destDir, sourceDir, "cp -u", False)
-			utimeDest      = CallAccumulator()
-			utimeSource    = CallAccumulator()
-			removeDest     = sftp.remove
-			removeSource   = sftp.remove
+			batch = RemoteBatch()
+			copySourceDest = batch.copy
+			copyDestSource = batch.copy
+			utimeDest      = batch.utime
+			utimeSource    = batch.utime
+			removeDest     = batch.remove
+			removeSource   = batch.remove
+
+		# The batch collects the calls instead of making them so they have to stay in this thread
+		pool = inlinePool if sourcePlace == PLACE.REMOTE and destPlace == PLACE.REMOTE else transferPool
 
 		newestCommonDate = 0 # start from smallest (reasonably) possible date
 		for filename in sourceFiles.keys() & destFiles.keys(): # common keys
@@ -304,41 +506,39 @@ def main(args: Namespace = None):
 					if not dryRun:
 						sPath = pathJoin(sourceDir, filename)
 						dPath = pathJoin(destDir  , filename)
-						copySourceDest(sPath, dPath)
-						utimeDest(dPath, (sourceFile.st_atime, sourceFile.st_mtime))
+						pool.submit(copyAndUtime, sourceFile.st_size, copySourceDest, utimeDest, sPath, dPath, (sourceFile.st_atime, sourceFile.st_mtime), bindKwarg(listingCache.put, destPlace, destDir, sourceFile))
 				elif sourceFile.st_mtime < destFile.st_mtime:                               # Case 2
 					if not silent: print(f"{cyanD} -> {magentaS}: {clr(filename, "green")}")
 					if not dryRun:
 						sPath = pathJoin(sourceDir, filename)
 						dPath = pathJoin(destDir  , filename)
-						copyDestSource(dPath, sPath)
-						utimeSource(sPath, (destFile.st_atime, destFile.st_mtime))
+						pool.submit(copyAndUtime, destFile.st_size, copyDestSource, utimeSource, dPath, sPath, (destFile.st_atime, destFile.st_mtime), bindKwarg(listingCache.put, sourcePlace, sourceDir, destFile))
 			elif sourceFile:
 				if sourceFile.st_mtime >= newestCommonDate:                                 # Case 1
 					if not silent: print(f"{magentaS} -> {cyanD}: {clr(filename, "green")}")
 					if not dryRun:
 						sPath = pathJoin(sourceDir, filename)
 						dPath = pathJoin(destDir  , filename)
-						copySourceDest(sPath, dPath)
-						utimeDest(dPath, (sourceFile.st_atime, sourceFile.st_mtime))
+						pool.submit(copyAndUtime, sourceFile.st_size, copySourceDest, utimeDest, sPath, dPath, (sourceFile.st_atime, sourceFile.st_mtime), bindKwarg(listingCache.put, destPlace, destDir, sourceFile))
 				else:                                                                       # Case 3
 					if not silent: print(f"{magentaS}: {clr(filename, "red")}")
 					if not dryRun:
 						sPath = pathJoin(sourceDir, filename)
 						removeSource(sPath)
+						listingCache.remove(sourcePlace, sourceDir, filename)
 			elif destFile:
 				if destFile.st_mtime >= newestCommonDate:                                   # Case 2
 					if not silent: print(f"{cyanD} -> {magentaS}: {clr(filename, "green")}")
 					if not dryRun:
 						sPath = pathJoin(sourceDir, filename)
 						dPath = pathJoin(destDir  , filename)
-						copyDestSource(dPath, sPath)
-						utimeSource(sPath, (destFile.st_atime, destFile.st_mtime))
+						pool.submit(copyAndUtime, destFile.st_size, copyDestSource, utimeSource, dPath, sPath, (destFile.st_atime, destFile.st_mtime), bindKwarg(listingCache.put, sourcePlace, sourceDir, destFile))
 				else:                                                                       # Case 4
 					if not silent: print(f"{cyanD}: {clr(filename, "red")}")
 					if not dryRun:
 						dPath = pathJoin(destDir  , filename)
 						removeDest(dPath)
+						listingCache.remove(destPlace, destDir, filename)
 
 			# # Alternative logic
 			# if (sourceFile and destFile and sourceFile.st_mtime > destFile.st_mtime) or (sourceFile and not destFile and sourceFile.st_mtime >= newestCommonDate): # Case 1
@@ -362,27 +562,24 @@ def main(args: Namespace = None):
 			# 	dPath = pathJoin(destDir  , filename)
 			# 	removeDest(dPath)
 
-		if sourcePlace == PLACE.REMOTE and destPlace == PLACE.REMOTE and not dryRun:
-			copySourceDest.finalize()
-			copyDestSource.finalize()
-			for path, times in utimeDest  .args: sftp.utime(path, times)
-			for path, times in utimeSource.args: sftp.utime(path, times)
+		if sourcePlace == PLACE.REMOTE and destPlace == PLACE.REMOTE:
+			batch.finalize()
 
-	def copyFun(sourceFiles: list[LocalSFTPAttributes], sourcePlace: PLACE, destFiles: dict[str, LocalSFTPAttributes], destPlace: PLACE, sourceDir: str, destDir: str):
+	def copyFun(sourceFiles: list[LocalSFTPAttributes], sourcePlace: PLACE, destFiles: dict[str, LocalSFTPAttributes], destPlace: PLACE, sourceDir: str, destDir: str, transferPool: TransferPool):
 		if sourcePlace == PLACE.LOCAL and destPlace == PLACE.LOCAL:
-			copy = bindKwarg(shutil.copyfile, follow_symlinks=False)
+			copy = bindKwarg(localCopy, bucket=bandwidth, follow_symlinks=False)
 			utime = os.utime
 		elif sourcePlace == PLACE.REMOTE and destPlace == PLACE.LOCAL:
-			copy = sftp.get
+			copy = remoteGet
 			utime = os.utime
 		elif sourcePlace == PLACE.LOCAL and destPlace == PLACE.REMOTE:
-			copy = bindKwarg(sftp.put, confirm=False)
-			utime = sftp.utime
+			copy = remotePut
+			utime = remoteUtime
 		elif sourcePlace == PLACE.REMOTE and destPlace == PLACE.REMOTE:
-			copy = RemoteCopyBatch(sourceDir, destDir, "cp -u", True)
-			copy.files = map(getAttr("filename"), sourceFiles)
-			copy.finalize()
-			return
+			batch = RemoteBatch()
+			copy = batch.copy
+			utime = batch.utime
+			transferPool = inlinePool
 
 		for file in sourceFiles:
 			destFile = destFiles.get(file.filename)
@@ -391,27 +588,30 @@ def main(args: Namespace = None):
 			if not dryRun:
 				sPath = pathJoin(sourceDir, file.filename)
 				dPath = pathJoin(destDir  , file.filename)
-				copy(sPath, dPath)
-				utime(dPath, (file.st_atime, file.st_mtime))
+				transferPool.submit(copyAndUtime, file.st_size, copy, utime, sPath, dPath, (file.st_atime, file.st_mtime), bindKwarg(listingCache.put, destPlace, destDir, file))
 
-	def delCopyFun(sourceFiles: list[LocalSFTPAttributes], sourcePlace: PLACE, destFiles: dict[str, LocalSFTPAttributes], destPlace: PLACE, sourceDir: str, destDir: str):
+		if sourcePlace == PLACE.REMOTE and destPlace == PLACE.REMOTE:
+			batch.finalize()
+
+	def delCopyFun(sourceFiles: list[LocalSFTPAttributes], sourcePlace: PLACE, destFiles: dict[str, LocalSFTPAttributes], destPlace: PLACE, sourceDir: str, destDir: str, transferPool: TransferPool):
 		if sourcePlace == PLACE.LOCAL and destPlace == PLACE.LOCAL:
-			copy = bindKwarg(shutil.copyfile, follow_symlinks=False)
+			copy = bindKwarg(localCopy, bucket=bandwidth, follow_symlinks=False)
 			utime = os.utime
 			removeDest = os.remove
 		elif sourcePlace == PLACE.REMOTE and destPlace == PLACE.LOCAL:
-			copy = sftp.get
+			copy = remoteGet
 			utime = os.utime
 			removeDest = os.remove
 		elif sourcePlace == PLACE.LOCAL and destPlace == PLACE.REMOTE:
-			copy = bindKwarg(sftp.put, confirm=False)
-			utime = sftp.utime
-			removeDest = sftp.remove
-		elif sourcePlace == PLACE.REMOTE and destPlace == PLACE.REMOTE: #TODO correct this part as it does not do proper DEL_COPY
-			copy = RemoteCopyBatch(sourceDir, destDir, "cp -u", True)
-			copy.files = map(getAttr("filename"), sourceFiles)
-			copy.finalize()
-			return
+			copy = remotePut
+			utime = remoteUtime
+			removeDest = remoteRemove
+		elif sourcePlace == PLACE.REMOTE and destPlace == PLACE.REMOTE:
+			batch = RemoteBatch()
+			copy = batch.copy
+			utime = batch.utime
+			removeDest = batch.remove
+			transferPool = inlinePool
 
 		for file in sourceFiles:
 			destFile = destFiles.pop(file.filename, None)
@@ -420,69 +620,89 @@ def main(args: Namespace = None):
 			if not dryRun:
 				sPath = pathJoin(sourceDir, file.filename)
 				dPath = pathJoin(destDir  , file.filename)
-				copy(sPath, dPath)
-				utime(dPath, (file.st_atime, file.st_mtime))
+				transferPool.submit(copyAndUtime, file.st_size, copy, utime, sPath, dPath, (file.st_atime, file.st_mtime), bindKwarg(listingCache.put, destPlace, destDir, file))
 
 		for file in destFiles.values():
 			if not silent: cprint(file.filename, "red")
 			if not dryRun:
 				dPath = pathJoin(destDir, file.filename)
 				removeDest(dPath)
+				listingCache.remove(destPlace, destDir, file.filename)
 
-	def moveFun(sourceFiles: list[LocalSFTPAttributes], sourcePlace: PLACE, destPlace: PLACE, sourceDir: str, destDir: str):
+		if sourcePlace == PLACE.REMOTE and destPlace == PLACE.REMOTE:
+			batch.finalize()
+
+	def recordMove(sourcePlace: PLACE, sourceDir: str, destPlace: PLACE, destDir: str, file: LocalSFTPAttributes):
+		listingCache.remove(sourcePlace, sourceDir, file.filename)
+		listingCache.put(destPlace, destDir, file)
+
+	def moveFun(sourceFiles: list[LocalSFTPAttributes], sourcePlace: PLACE, destPlace: PLACE, sourceDir: str, destDir: str, transferPool: TransferPool):
 		if sourcePlace == PLACE.LOCAL and destPlace == PLACE.LOCAL:
 			move = shutil.move
 			def utime(x, y): pass
 			def delete(x): pass
 		elif sourcePlace == PLACE.REMOTE and destPlace == PLACE.LOCAL:
-			move = sftp.get
+			move = remoteGet
 			utime = os.utime
-			delete = sftp.remove
+			delete = remoteRemove
 		elif sourcePlace == PLACE.LOCAL and destPlace == PLACE.REMOTE:
-			move = bindKwarg(sftp.put, confirm=False)
-			utime = sftp.utime
+			move = remotePut
+			utime = remoteUtime
 			delete = os.remove
 		elif sourcePlace == PLACE.REMOTE and destPlace == PLACE.REMOTE:
-			copy = RemoteCopyBatch(sourceDir, destDir, "mv", True)
-			copy.files = map(getAttr("filename"), sourceFiles)
-			copy.finalize()
-			return
+			batch = RemoteBatch()
+			move = batch.move
+			utime = batch.utime
+			def delete(x): pass
+			transferPool = inlinePool
 
 		for file in sourceFiles:
 			if not silent: cprint(file.filename, "green")
 			if not dryRun:
 				sPath = pathJoin(sourceDir, file.filename)
 				dPath = pathJoin(destDir  , file.filename)
-				move(sPath, dPath)
-				utime(dPath, (file.st_atime, file.st_mtime))
-				delete(sPath)
+				transferPool.submit(moveAndUtime, file.st_size, move, utime, delete, sPath, dPath, (file.st_atime, file.st_mtime), bindKwarg(recordMove, sourcePlace, sourceDir, destPlace, destDir, file))
 
-	# it's only noticeably faster if one of the remote folders that will be scanned has more than 5000 entries
-	rld = RemoteListDir(ssh, init=False) # don't init the remote python script because remote_listdir_attr might not get called at all
-	remote_listdir_attr = rld.listdir_attr
+		if sourcePlace == PLACE.REMOTE and destPlace == PLACE.REMOTE:
+			batch.finalize()
+
+	folderUses = defaultdict(int)
+	for operation in parsedOperations:
+		if operationDepth(operation): # folder trees are always listed whole
+			continue
+		sourceDir, sourcePlace, destDir, destPlace, *_ = operation
+		folderUses[folderKey(sourceDir, sourcePlace)] += 1
+		folderUses[folderKey(destDir  , destPlace  )] += 1
+	listingCache = ListingCache({key for key, uses in folderUses.items() if uses > 1})
 
-	localDirListCache = {}
-	remoteDirListCache = {}
-	for sourceDir, sourcePlace, destDir, destPlace, mode, filePatterns, defaultMatch in parsedOperations:
+	def createFolders(place: PLACE, folders: list[str]):
+		if not folders or dryRun:
+			return
+		if place == PLACE.LOCAL:
+			for folder in folders:
+				os.makedirs(folder, exist_ok=True)
+		else: # one round trip for all of them
+			batch = RemoteBatch()
+			for folder in folders:
+				batch.mkdir(folder)
+			batch.finalize()
+
+	def runOperation(sourceDir: str, sourcePlace: PLACE, destDir: str, destPlace: PLACE, mode: MODE, filePatterns: Tuple[Tuple[str, bool], ...], defaultMatch: bool, recursionDepth = 0):
 		if sourcePlace == PLACE.LOCAL:
 			sourceDir = normalizeLocalFolderPath(sourceDir)
 			assertLocalFolderExists(sourceDir)
-			sourceDirListCache = localDirListCache
 		elif sourcePlace == PLACE.REMOTE:
 			sourceDir = normalizeRemoteFolderPath(sourceDir)
-			assertRemoteFolderExists(sftp, sourceDir)
-			sourceDirListCache = remoteDirListCache
+			assertRemoteFolderExists(sftpPool.get(), sourceDir)
 		else:
 			raise SimpleError(f"Invalid sourcePlace: {sourcePlace}")
 
 		if destPlace == PLACE.LOCAL:
 			destDir = normalizeLocalFolderPath(destDir)
 			assertLocalFolderExists(destDir)
-			destDirListCache = localDirListCache
 		elif destPlace == PLACE.REMOTE:
 			destDir = normalizeRemoteFolderPath(destDir)
-			assertRemoteFolderExists(sftp, destDir)
-			destDirListCache = remoteDirListCache
+			assertRemoteFolderExists(sftpPool.get(), destDir)
 		else:
 			raise SimpleError(f"Invalid destPlace: {destPlace}")
 
@@ -492,45 +712,154 @@ def main(args: Namespace = None):
 			print(f"# {cyanDest   }   ({clr(destPlace  ._padded_name_, blueColor)}): {destDir  }")
 			print(f"# Mode: {clr(mode._padded_name_, blueColor)}")
 			print(f"# File patterns: {" ".join(clr(pattern, "green" if matchVal else "red") for pattern, matchVal in filePatterns)} | {clr("defaultMatch", "green" if defaultMatch else "red")}")
+			if recursionDepth: print(f"# Max depth: {clr("inf" if recursionDepth == sys.maxsize else recursionDepth, blueColor)}")
 
-		sourceFiles: list[LocalSFTPAttributes] = sourceDirListCache.get(sourceDir)
-		if sourceFiles is None:
-			sourceFiles = local_listdir_attr(sourceDir) if sourcePlace == PLACE.LOCAL else remote_listdir_attr(sourceDir)
-			if mode == MODE.SYNC:
-				sourceFiles = {file.filename: file for file in sourceFiles if filterFun(file, filePatterns, defaultMatch)}
-			else:
-				sourceFiles = tuple(file for file in sourceFiles if filterFun(file, filePatterns, defaultMatch))
-			if cacheDirectoryListings: sourceDirListCache[sourceDir] = sourceFiles
+		# The remote helper sends only the files filterFun accepts
+		remoteFilter = RemoteListingFilter([(pattern, matchVal, False, True) for pattern, matchVal in filePatterns], defaultMatch, othersAsFiles=True)
 
-		if not silent: print(f"# {magentaSource} file count: {len(sourceFiles)}")
+		def listFolder(place: PLACE, folder: str) -> Iterable[LocalSFTPAttributes]:
+			listing = listingCache.list(place, folder, lambda: local_listdir_attr(folder) if place == PLACE.LOCAL else remote_listdir_attr(folder, None))
+			if listing is not None:
+				return listing
+			return local_listdir_attr(folder) if place == PLACE.LOCAL else remote_listdir_attr(folder, remoteFilter)
 
-		if not sourceFiles and mode != MODE.SYNC:
-			continue
+		if recursionDepth:
+			return runTreeOperation(sourceDir, sourcePlace, destDir, destPlace, mode, filePatterns, defaultMatch, recursionDepth, remoteFilter)
 
-		if mode == MODE.SYNC and isinstance(sourceFiles, tuple):
+		sourceFiles = tuple(file for file in listFolder(sourcePlace, sourceDir) if filterFun(file, filePatterns, defaultMatch))
+		if mode == MODE.SYNC:
 			sourceFiles = {file.filename: file for file in sourceFiles}
-		elif mode != MODE.SYNC and isinstance(sourceFiles, dict):
-			sourceFiles = sourceFiles.values()
+
+		if not silent: print(f"# {magentaSource} file count: {len(sourceFiles)}")
+
+		if not sourceFiles and mode != MODE.SYNC:
+			return
 
 		if mode != MODE.MOVE:
-			destFiles = destDirListCache.get(destDir)
-			if destFiles is None:
-				destFiles: list[LocalSFTPAttributes] = local_listdir_attr(destDir) if destPlace == PLACE.LOCAL else remote_listdir_attr(destDir)
-				destFiles = {file.filename: file for file in destFiles if filterFun(file, filePatterns, defaultMatch)}
-				if cacheDirectoryListings: destDirListCache[destDir] = destFiles
+			destFiles = {file.filename: file for file in listFolder(destPlace, destDir) if filterFun(file, filePatterns, defaultMatch)}
 
 			if not silent: print(f"# {cyanDest}   file count: {len(destFiles)}")
 
 			if not sourceFiles and not destFiles and mode == MODE.SYNC:
-				continue
+				return
 
-		match mode:
-			case MODE.SYNC    : syncFun   (sourceFiles, sourcePlace, destFiles, destPlace, sourceDir, destDir)
-			case MODE.COPY    : copyFun   (sourceFiles, sourcePlace, destFiles, destPlace, sourceDir, destDir)
-			case MODE.DEL_COPY: delCopyFun(sourceFiles, sourcePlace, destFiles, destPlace, sourceDir, destDir)
-			case MODE.MOVE    : moveFun   (sourceFiles, sourcePlace,            destPlace, sourceDir, destDir)
-			case _: raise SimpleError(f"Invalid mode: {mode}")
+		transferPool = TransferPool(maxJobs, adaptiveJobs)
+		try:
+			match mode:
+				case MODE.SYNC    : syncFun   (sourceFiles, sourcePlace, destFiles, destPlace, sourceDir, destDir, transferPool)
+				case MODE.COPY    : copyFun   (sourceFiles, sourcePlace, destFiles, destPlace, sourceDir, destDir, transferPool)
+				case MODE.DEL_COPY: delCopyFun(sourceFiles, sourcePlace, destFiles, destPlace, sourceDir, destDir, transferPool)
+				case MODE.MOVE    : moveFun   (sourceFiles, sourcePlace,            destPlace, sourceDir, destDir, transferPool)
+				case _: raise SimpleError(f"Invalid mode: {mode}")
+
+			transferPool.join() # the next operation may list the folders this one writes to
+		finally:
+			transferPool.shutdown()
+
+	def runTreeOperation(sourceDir: str, sourcePlace: PLACE, destDir: str, destPlace: PLACE, mode: MODE, filePatterns: Tuple[Tuple[str, bool], ...], defaultMatch: bool, recursionDepth: int, remoteFilter: RemoteListingFilter):
+		""" runOperation for every folder of the trees, each tree listed with one request """
+		treeFilter = RemoteListingFilter(remoteFilter.spec["files"], defaultMatch, folderRules=[], folderDefault=True, othersAsFiles=True) # all folders are entered
+
+		unlisted = set() # relative paths of the subfolders that couldn't be listed on either side
+
+		def listTree(place: PLACE, folder: str) -> dict[str, list[LocalSFTPAttributes]]:
+			def onError(rel: str, error: OSError):
+				if not silent: cprint(f"Warning: skipping the folder {pathJoin(folder, rel)} because it couldn't be listed: {error.strerror or error}", "yellow")
+				unlisted.add(rel)
+			tree = localListTree(folder, recursionDepth, onError) if place == PLACE.LOCAL else remoteHelper().listTree(folder, treeFilter, recursionDepth, onError)
+			return {rel: [file for file in entries if filterFun(file, filePatterns, defaultMatch)] for rel, entries in tree.items()}
+
+		sourceTree = listTree(sourcePlace, sourceDir)
+		destTree = listTree(destPlace, destDir) if mode != MODE.MOVE else None # moved files don't care what's already there
+
+		if unlisted: # their files are unknown on one side so nothing in them is copied or removed on the other one either
+			def isListed(rel: str) -> bool: return not any(rel.startswith(folder) for folder in unlisted)
+			sourceTree = {rel: files for rel, files in sourceTree.items() if isListed(rel)}
+			if destTree is not None:
+				destTree = {rel: files for rel, files in destTree.items() if isListed(rel)}
 
+		if not silent:
+			print(f"# {magentaSource} file count: {sum(map(len, sourceTree.values()))} in {len(sourceTree)} folders")
+			if destTree is not None: print(f"# {cyanDest}   file count: {sum(map(len, destTree.values()))} in {len(destTree)} folders")
+
+		# the folders that are going to get files but don't exist yet
+		createFolders(destPlace, [pathJoin(destDir, rel) for rel, files in sourceTree.items() if files and (destTree is None or rel not in destTree)])
+		if mode == MODE.SYNC:
+			createFolders(sourcePlace, [pathJoin(sourceDir, rel) for rel, files in destTree.items() if files and rel not in sourceTree])
+			folders = sourceTree.keys() | destTree.keys()
+		elif mode == MODE.DEL_COPY: # so files get removed from the folders missing in the source too
+			folders = sourceTree.keys() | destTree.keys()
+		else:
+			folders = sourceTree.keys()
+
+		transferPool = TransferPool(maxJobs, adaptiveJobs)
+		try:
+			for rel in sorted(folders):
+				sourceFiles = sourceTree.get(rel, [])
+				destFiles = {file.filename: file for file in destTree.get(rel, [])} if destTree is not None else {}
+				if not sourceFiles and not destFiles:
+					continue
+
+				if not silent and rel: print(f"# Folder: {clr(rel, blueColor)}")
+				sourcePath = pathJoin(sourceDir, rel)
+				destPath   = pathJoin(destDir  , rel)
+				match mode:
+					case MODE.SYNC    : syncFun   ({file.filename: file for file in sourceFiles}, sourcePlace, destFiles, destPlace, sourcePath, destPath, transferPool)
+					case MODE.COPY    : copyFun   (sourceFiles, sourcePlace, destFiles, destPlace, sourcePath, destPath, transferPool)
+					case MODE.DEL_COPY: delCopyFun(sourceFiles, sourcePlace, destFiles, destPlace, sourcePath, destPath, transferPool)
+					case MODE.MOVE    : moveFun   (sourceFiles, sourcePlace,            destPlace, sourcePath, destPath, transferPool)
+					case _: raise SimpleError(f"Invalid mode: {mode}")
+
+			transferPool.join()
+		finally:
+			transferPool.shutdown()
+
+	if parallelOperations == 1:
+		for operation in parsedOperations:
+			runOperation(*operation)
+	else:
+		def operationFolders(sourceDir: str, sourcePlace: PLACE, destDir: str, destPlace: PLACE, mode: MODE, filePatterns, defaultMatch, recursionDepth = 0) -> tuple[set, set]:
+			""" (read, written) folders of the operation (see foldersOverlap) """
+			source, dest = (*folderKey(sourceDir, sourcePlace), bool(recursionDepth)), (*folderKey(destDir, destPlace), bool(recursionDepth))
+			if mode in (MODE.SYNC, MODE.MOVE):
+				return {source, dest}, {source, dest}
+			return {source, dest}, {dest}
+
+		dependencies = operationDependencies([operationFolders(*operation) for operation in parsedOperations])
+		output = GroupedOutput(sys.stdout)
+
+		def runGrouped(operation: tuple):
+			output.start()
+			try:
+				runOperation(*operation)
+			finally:
+				output.end()
+
+		sys.stdout = output
+		try:
+			pending = list(range(len(parsedOperations)))
+			running = {}
+			finished = set()
+			error = None
+			with ThreadPoolExecutor(max_workers=parallelOperations) as executor:
+				while pending or running:
+					if error is None: # no new operations after an error, like when running them one by one
+						ready = [i for i in pending if dependencies[i] <= finished][:parallelOperations - len(running)]
+						for i in ready:
+							pending.remove(i)
+							running[executor.submit(runGrouped, parsedOperations[i])] = i
+					if not running:
+						break
+					done, _ = wait(running, return_when=FIRST_COMPLETED)
+					for future in done:
+						finished.add(running.pop(future))
+						error = error or future.exception()
+		finally:
+			sys.stdout = output.stream
+		if error is not None:
+			raise error
+
+	sftpPool.close()
 	sftp.close()
 	ssh.close()
 
@@ -27,10 +27,12 @@ class NoRepeatAction(_argparse.Action):
 		setattr(namespace, self.dest, values)
 
 class NameFilter:
-	def __init__(self, pattern: str, matchVal: bool, matchingFunc: _Callable[[str, str], bool]):
+	def __init__(self, pattern: str, matchVal: bool, matchingFunc: _Callable[[str, str], bool], isPath = False, isCase = True):
 		self.pattern = pattern
 		self.matchVal = matchVal
 		self.matchingFunc = matchingFunc
+		self.isPath = isPath # isPath and isCase describe matchingFunc so the filters can be compiled (see filterEngine)
+		self.isCase = isCase
 
 def filenameMatchCase(name: str, path: str, pat: str) -> bool:
 	return _fnmatchcase(name, pat)
@@ -99,5 +101,7 @@ class IncludeExcludeAction(_argparse.Action):
 				items.append(NameFilter(
 					pattern,
 					self.matchVal,
-					self.matchingFunc
+					self.matchingFunc,
+					self.isPath,
+					self.isCase,
 				))
@@ -6,6 +6,7 @@ import os as _os
 import re as _re
 from stat import S_ISDIR as _S_ISDIR, S_ISREG as _S_ISREG
 
+from .LocalSFTPAttributes import LazyLocalSFTPAttributes as _LazyLocalSFTPAttributes
 from .SimpleError import SimpleError as _SimpleError
 
 WINDOWS_RESERVED_NAMES = set("con, prn, aux, nul, com1, com2, com3, com4, com5, com6, com7, com8, com9, com¹, com², com³, lpt1, lpt2, lpt3, lpt4, lpt5, lpt6, lpt7, lpt8, lpt9, lpt¹, lpt², lpt³".split(", "))
@@ -41,9 +42,13 @@ def sanitizeFilename(name: str):
 	return base + ext
 
 def isFile(stats: _os.stat_result):
+	if type(stats) is _LazyLocalSFTPAttributes: # knows its type without a stat
+		return stats.isFile()
 	return _S_ISREG(stats.st_mode)
 
 def isDir(stats: _os.stat_result):
+	if type(stats) is _LazyLocalSFTPAttributes:
+		return stats.isDir()
 	return _S_ISDIR(stats.st_mode)
 
 def safeStat(path: str) -> _os.stat_result | None:
@@ -124,6 +129,13 @@ def readTextFile(path: str | _Path, encoding="UTF-8"):
 	with open(path, "rt", encoding=encoding) as f:
 		return f.read()
 
+def readTextFileIfExists(path: str | _Path, encoding="UTF-8") -> str | None:
+	try:
+		with open(path, "rt", encoding=encoding, errors="replace") as f:
+			return f.read()
+	except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+		return None
+
 def readSplitLines(path: str | _Path, encoding="UTF-8"):
 	with open(path, "rt", encoding=encoding) as f:
 		return f.read().splitlines()
@@ -0,0 +1,169 @@
+"""
+Include/exclude filters compiled into a matcher with first-match-wins semantics.
+
+Stdlib only and without relative imports so the source can be sent to and exec'ed by a remote Python
+as is
+"""
+from __future__ import annotations # the remote helper may run on an older Python (see remoteHelper)
+
+import fnmatch as _fnmatch
+import re as _re
+
+_GLOB_CHARS = frozenset("*?[")
+
+def _isLiteral(pattern: str) -> bool:
+	return _GLOB_CHARS.isdisjoint(pattern)
+
+class CompiledFilters:
+	"""
+	Compiles ordered rules `(pattern, matchVal, isPath, isCase)` (see argparseUtils.IncludeExcludeAction)
+	into a matcher. Calling it returns the matchVal of the first rule matching the entry or `default`
+	when none matches, exactly like testing the rules one by one, but instead of one fnmatch per rule an
+	entry costs:
+	- one dict lookup for all literal names (`node_modules`, `Thumbs.db`)
+	- one dict lookup per dot in the name for all extension-like suffixes (`*.log`, `*.tar.gz`)
+	- one regex match for all other glob patterns combined into one alternation. Python tries the
+	  alternatives from left to right so the group that matched is the first matching pattern. The
+	  groups are named after the rule index because fnmatch.translate of Python 3.9 and 3.10 (the remote
+	  helper's Python may be that old) adds groups of its own for patterns with several `*`
+	- path rules (few in practice) are tested one by one like argparseUtils.pathMatchCase does: a rule
+	  matches the paths starting with it and the paths it starts with (so the walker can get to it)
+
+	Every group knows the index of its first rule so groups which cannot beat the best match found so
+	far are skipped. Case-insensitive rules must already be lowercase (IncludeExcludeAction does that)
+	and the name/path is lowercased at most once per entry.
+	"""
+	def __init__(self, rules: list[tuple[str, bool, bool, bool]], default: bool):
+		self.default = default
+		self.rules = rules # kept so the filters can be sent to the remote helper (see sshUtils.RemoteListingFilter)
+		self.values = [matchVal for _, matchVal, _, _ in rules]
+
+		# index 0 -> case-insensitive rules, index 1 -> case-sensitive rules
+		self.literals: tuple[dict[str, int], dict[str, int]] = ({}, {})
+		self.suffixes: tuple[dict[str, int], dict[str, int]] = ({}, {})
+		regexRules: tuple[list[tuple[int, str]], list[tuple[int, str]]] = ([], [])
+		self.paths: list[tuple[int, str, bool, bool]] = []
+
+		for idx, (pattern, matchVal, isPath, isCase) in enumerate(rules):
+			if isPath:
+				self.paths.append((idx, pattern, isCase, matchVal))
+			elif _isLiteral(pattern):
+				self.literals[isCase].setdefault(pattern, idx) # setdefault so the first of duplicate rules wins
+			elif pattern.startswith("*.") and _isLiteral(pattern[1:]):
+				self.suffixes[isCase].setdefault(pattern[1:], idx)
+			else:
+				regexRules[isCase].append((idx, pattern))
+
+		self.regexes = tuple(
+			_re.compile("|".join(f"(?P<r{idx}>{_fnmatch.translate(pattern)})" for idx, pattern in group)) if group else None
+			for group in regexRules
+		)
+
+		# first rule index of every group so groups that can't win are skipped
+		noRule = len(self.values)
+		self.firstLiteral = tuple(min(group.values(), default=noRule) for group in self.literals)
+		self.firstSuffix  = tuple(min(group.values(), default=noRule) for group in self.suffixes)
+		self.firstRegex   = tuple(group[0][0] if group else noRule for group in regexRules)
+
+		self.needsPath = bool(self.paths)
+		self.needsLower = bool(self.literals[0] or self.suffixes[0] or regexRules[0])
+		self.onlyPathIncludes = self._onlyPathIncludes(rules)
+
+	def _onlyPathIncludes(self, rules: list[tuple[str, bool, bool, bool]]) -> bool:
+		""" True when nothing but path include rules can include an entry with an unknown name """
+		for pattern, matchVal, isPath, isCase in rules:
+			if isPath:
+				continue
+			if matchVal:
+				return False # a name rule can include anything
+			if pattern == "*":
+				return True # excludes everything the rules before it did not match
+		return not self.default
+
+	def childTargets(self, folderPath: str) -> set[str] | None:
+		"""
+		Names of the only children of `folderPath` that can be included when only path include rules can
+		include anything (see onlyPathIncludes), so the walker can stat them instead of listing the
+		folder. An empty set means nothing in the folder can be included. None means the folder has to
+		be listed.
+
+		A rule matches the paths it starts with, so when it goes on below a child its candidates are the
+		prefixes of the child's name (`/vol/ab/c` makes `a` and `ab` candidates in `/vol`). Children
+		starting with the rule's last component are not known without the listing, and neither is the
+		real letter case of the names for case-insensitive rules
+		"""
+		if not self.onlyPathIncludes:
+			return None
+
+		prefix = folderPath if folderPath.endswith("/") else folderPath + "/"
+		prefixLower = None
+		targets = set()
+		for _, pattern, isCase, matchVal in self.paths:
+			if not matchVal:
+				continue
+			if not isCase:
+				prefixLower = prefixLower or prefix.lower()
+			candidate = prefix if isCase else prefixLower
+			if not pattern.startswith(candidate):
+				if candidate.startswith(pattern): # folderPath is inside an included path (or starts with it)
+					return None
+				continue
+			rest = pattern[len(candidate):]
+			child, slash, _ = rest.partition("/")
+			if not slash or not isCase:
+				return None
+			targets.update(child[:end] for end in range(1, len(child) + 1))
+		return targets
+
+	def firstMatch(self, name: str, folderPrefix: str = "") -> int:
+		"""
+		Index of the first rule matching the entry or `len(rules)` if none does. `folderPrefix` is the
+		path of the entry's folder ending with "/" and is only used by path rules
+		"""
+		best = len(self.values)
+		if self.needsLower:
+			best = self._firstNameMatch(name.lower(), 0, best)
+		best = self._firstNameMatch(name, 1, best)
+
+		if self.paths and self.paths[0][0] < best:
+			path = folderPrefix + name
+			pathLower = None
+			for idx, pattern, isCase, matchVal in self.paths:
+				if idx >= best:
+					break
+				if not isCase:
+					candidate = pathLower = pathLower or path.lower()
+				else:
+					candidate = path
+				# see argparseUtils.pathMatchCase
+				if candidate.startswith(pattern) or pattern.startswith(candidate):
+					best = idx
+					break
+		return best
+
+	def _firstNameMatch(self, name: str, isCase: int, best: int) -> int:
+		if self.firstLiteral[isCase] < best:
+			idx = self.literals[isCase].get(name)
+			if idx is not None and idx < best:
+				best = idx
+
+		if self.firstSuffix[isCase] < best:
+			suffixes = self.suffixes[isCase]
+			dot = name.find(".")
+			while dot != -1:
+				idx = suffixes.get(name[dot:])
+				if idx is not None and idx < best:
+					best = idx
+				dot = name.find(".", dot + 1)
+
+		if self.firstRegex[isCase] < best:
+			mObj = self.regexes[isCase].match(name)
+			if mObj:
+				idx = int(mObj.lastgroup[1:]) # the rule's group closes after any group inside of it
+				if idx < best:
+					best = idx
+		return best
+
+	def __call__(self, name: str, folderPrefix: str = "") -> bool:
+		idx = self.firstMatch(name, folderPrefix)
+		return self.values[idx] if idx < len(self.values) else self.default
@@ -2,6 +2,9 @@ from pathlib import Path; __package__ = __package__ or Path(__file__).resolve().
 
 import json
 import os
+from stat import FILE_ATTRIBUTE_SPARSE_FILE, S_ISDIR, S_ISREG
+import sys
+from time import perf_counter
 
 from .getSelectedFilesFromExplorer import getSelectedFilesFromExplorer
 
@@ -11,31 +14,36 @@ if not selectedFiles: # finish early if there were no files selected
 	exit(69) # (¬‿¬)
 
 baseFolder = os.path.dirname(selectedFiles[0])
-subFolders = []
-files = []
-
-def getFileStructureRecursively(fileOrDirPath: str):
-	if os.path.isfile(fileOrDirPath):
-		files.append(os.path.relpath(fileOrDirPath, baseFolder).replace("\\", "/"))
-	elif os.path.isdir(fileOrDirPath):
-		subFolders.append(os.path.relpath(fileOrDirPath, baseFolder).replace("\\", "/"))
-		for item in os.listdir(fileOrDirPath):
-			getFileStructureRecursively(os.path.join(fileOrDirPath, item).replace("\\", "/"))
-
+lastFlush = perf_counter()
+
+def emit(record):
+	""" One JSON record per line, flushed at least every 0.1 s so SSH_GET can start while the walk goes on """
+	global lastFlush
+	print(json.dumps(record, ensure_ascii=False, check_circular=False, indent=None, separators=(",",":")))
+	if perf_counter() - lastFlush > 0.1:
+		sys.stdout.flush()
+		lastFlush = perf_counter()
+
+def isSparse(info: os.stat_result) -> bool:
+	""" Whether the file has holes - fewer blocks allocated than its size needs or the NTFS sparse attribute on Windows """
+	if getattr(info, "st_blocks", None) is not None:
+		return info.st_blocks * 512 < info.st_size
+	return bool(getattr(info, "st_file_attributes", 0) & FILE_ATTRIBUTE_SPARSE_FILE)
+
+def addEntry(relPath: str, info: os.stat_result, isDir: bool):
+	emit([relPath, info.st_size, info.st_mode, int(info.st_atime), int(info.st_mtime), not isDir and isSparse(info)]) # folders before everything inside them
+	if isDir:
+		with os.scandir(os.path.join(baseFolder, relPath)) as it:
+			for entry in it:
+				if entry.is_dir() or entry.is_file(): # like os.path.isdir/isfile (symlinks followed)
+					addEntry(relPath + "/" + entry.name, entry.stat(), entry.is_dir())
+
+# The first line is {"baseFolder": PATH} and every next one is an entry [relPath, size, mode, atime, mtime, sparse] (see SSH_GET.py)
+emit({"baseFolder": baseFolder})
 for fileOrDirPath in selectedFiles:
-	getFileStructureRecursively(fileOrDirPath)
-
-print(
-	json.dumps(
-		{
-			"baseFolder": baseFolder,
-			"subFolders": subFolders,
-			"files": files,
-		},
-		ensure_ascii=False,
-		check_circular=False,
-		indent=None,
-		separators=(",",":")
-	),
-	end=""
-)
+	try:
+		info = os.stat(fileOrDirPath)
+	except OSError:
+		continue
+	if S_ISDIR(info.st_mode) or S_ISREG(info.st_mode):
+		addEntry(os.path.relpath(fileOrDirPath, baseFolder).replace("\\", "/"), info, S_ISDIR(info.st_mode))
@@ -0,0 +1,122 @@
+"""
+`.gitignore`-style ignore files discovered during a folder walk.
+
+Stdlib only and without relative imports (like filterEngine) - reading the files is left to the
+caller so the same code works for local and remote folders
+"""
+import posixpath as _posixpath
+import re as _re
+from typing import Callable as _Callable
+
+DEFAULT_IGNORE_FILE = ".sshsyncignore"
+
+def _translate(pattern: str) -> str:
+	""" Glob -> regex like fnmatch.translate but `*`, `?` and `[...]` never match "/" and `**` matches across folders """
+	res = []
+	i, n = 0, len(pattern)
+	while i < n:
+		c = pattern[i]
+		if c == "*":
+			if pattern.startswith("**/", i): # any number of leading folders, including none
+				res.append("(?:.*/)?")
+				i += 3
+				continue
+			if pattern.startswith("**", i):
+				res.append(".*")
+				i += 2
+				continue
+			res.append("[^/]*")
+		elif c == "?":
+			res.append("[^/]")
+		elif c == "[" and (j := pattern.find("]", i + 2)) != -1: # i + 2 so "[]...]" treats the first "]" literally
+			body = pattern[i + 1:j].replace("\\", "\\\\")
+			res.append("[^" + body[1:] + "]" if body[0] in "!^" else "[" + body + "]")
+			i = j
+		elif c == "\\" and i + 1 < n:
+			i += 1
+			res.append(_re.escape(pattern[i]))
+		else:
+			res.append(_re.escape(c))
+		i += 1
+	return "".join(res)
+
+class IgnoreRules:
+	"""
+	Rules of one ignore file. Follows the .gitignore syntax: `#` comments, `!` re-includes, a trailing
+	`/` matches only folders, a pattern with a `/` at the beginning or in the middle is relative to the
+	folder of the ignore file (otherwise it matches names at any depth), `**` matches across folders.
+	The last matching rule wins
+	"""
+	def __init__(self, text: str):
+		self.rules: list[tuple[_re.Pattern, bool, bool, bool]] = [] # (regex, ignore, dirOnly, anchored)
+		for line in text.splitlines():
+			line = line.rstrip()
+			if not line or line.startswith("#"):
+				continue
+
+			ignore = not line.startswith("!")
+			if not ignore:
+				line = line[1:]
+			elif line.startswith(("\\#", "\\!")):
+				line = line[1:]
+
+			dirOnly = line.endswith("/")
+			line = line.rstrip("/")
+			anchored = "/" in line
+			line = line.lstrip("/")
+			if line:
+				self.rules.append((_re.compile(_translate(line) + r"\Z"), ignore, dirOnly, anchored))
+
+	def match(self, relPath: str, name: str, isDir: bool) -> bool | None:
+		""" True/False if the last matching rule ignores/re-includes the entry, None if no rule matches """
+		for regex, ignore, dirOnly, anchored in reversed(self.rules):
+			if dirOnly and not isDir:
+				continue
+			if regex.match(relPath if anchored else name):
+				return ignore
+		return None
+
+class IgnoreMatcher:
+	""" Rules of the ignore file in `folderPath` on top of the rules inherited from the folders above it """
+	def __init__(self, folderPath: str, rules: IgnoreRules, parent: "IgnoreMatcher | None"):
+		self.base = folderPath if folderPath.endswith("/") else folderPath + "/"
+		self.rules = rules
+		self.parent = parent
+
+	def __call__(self, folderPrefix: str, name: str, isDir: bool) -> bool:
+		""" `folderPrefix` is the path of the entry's folder ending with "/" (see FilterClass) """
+		path = folderPrefix + name
+		matcher = self
+		while matcher is not None:
+			ignored = matcher.rules.match(path[len(matcher.base):], name, isDir) # deeper ignore files take precedence
+			if ignored is not None:
+				return ignored
+			matcher = matcher.parent
+		return False
+
+class IgnoreFiles:
+	"""
+	Finds the ignore file of every folder the walker enters and caches the compiled result per folder.
+	Folders without an ignore file share the matcher of their parent and forFolder returns None as long
+	as there are no rules at all. Ignore files above `rootFolder` are not looked for. `readFile` returns
+	the text of a file or None if it doesn't exist
+	"""
+	def __init__(self, fileName: str, readFile: _Callable[[str], str | None], rootFolder: str):
+		self.fileName = fileName
+		self.readFile = readFile
+		self.root = rootFolder.rstrip("/") or "/"
+		self.cache: dict[str, IgnoreMatcher | None] = {}
+
+	def forFolder(self, folderPath: str) -> IgnoreMatcher | None:
+		key = folderPath.rstrip("/") or "/"
+		try:
+			return self.cache[key]
+		except KeyError:
+			pass
+
+		isBelowRoot = key != self.root and key != "/" and (self.root == "/" or key.startswith(self.root + "/"))
+		parent = self.forFolder(_posixpath.dirname(key)) if isBelowRoot else None # cached already when walking from the top down
+		text = self.readFile(_posixpath.join(key, self.fileName))
+		matcher = IgnoreMatcher(key, IgnoreRules(text), parent) if text else parent
+		self.cache[key] = matcher
+		return matcher
@@ -0,0 +1,233 @@
+"""
+Recursive folder watching with Linux inotify (through ctypes, no dependencies) and a polling fallback
+with the same interface for other systems.
+
+Stdlib only and without relative imports (like filterEngine) - it's also sent to the remote helper
+(see remoteHelper)
+"""
+import ctypes as _ctypes
+import ctypes.util as _ctypes_util
+import errno as _errno
+import os as _os
+import select as _select
+from stat import S_ISDIR as _S_ISDIR
+import struct as _struct
+from time import monotonic as _monotonic, sleep as _sleep
+from typing import Callable as _Callable
+
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR       = 0x40000000
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+
+WATCH_MASK = (
+	IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+	IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW
+)
+
+_EVENT_HEADER = _struct.Struct("iIII") # wd, mask, cookie, len
+
+class InotifyWatcher:
+	"""
+	Watches `root` and every folder below it for which `includeFolder(parentPath, name)` returns True
+	(folders that are not included are not watched, and so never reported, at all). Folders created
+	or moved in later are watched as soon as their events are read. Paths use "/" and have no trailing
+	"/" (except for the root of the filesystem)
+	"""
+	def __init__(self, root: str, includeFolder: _Callable[[str, str], bool] | None = None):
+		libcName = _ctypes_util.find_library("c")
+		self.libc = _ctypes.CDLL(libcName, use_errno=True)
+		if not hasattr(self.libc, "inotify_init1"):
+			raise OSError(_errno.ENOSYS, "inotify is not available on this system")
+
+		self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			err = _ctypes.get_errno()
+			raise OSError(err, _os.strerror(err))
+
+		self.root = root.rstrip("/") or "/"
+		self.includeFolder = includeFolder
+		self.paths: dict[int, str] = {} # watch descriptor -> folder path
+		self.wds: dict[str, int] = {}   # folder path -> watch descriptor
+		self.watchTree(self.root)
+
+	def _join(self, folder: str, name: str) -> str:
+		return folder + name if folder.endswith("/") else folder + "/" + name
+
+	def watchTree(self, folder: str):
+		""" Watches `folder` and all the included folders below it """
+		stack = [folder]
+		while stack:
+			path = stack.pop()
+			wd = self.libc.inotify_add_watch(self.fd, _os.fsencode(path), WATCH_MASK)
+			if wd < 0:
+				err = _ctypes.get_errno()
+				if path == self.root:
+					raise OSError(err, _os.strerror(err), path)
+				continue # removed in the meantime or not accessible - it's not synced either way
+
+			self.paths[wd] = path
+			self.wds[path] = wd
+			try:
+				with _os.scandir(path) as it:
+					for entry in it:
+						if entry.is_dir(follow_symlinks=False) and (self.includeFolder is None or self.includeFolder(path, entry.name)):
+							stack.append(self._join(path, entry.name))
+			except OSError:
+				pass
+
+	def _forgetTree(self, folder: str):
+		""" Stops watching `folder` and the folders below it (i.e. when it was moved away) """
+		prefix = folder + "/"
+		for path in [path for path in self.wds if path == folder or path.startswith(prefix)]:
+			wd = self.wds.pop(path)
+			self.paths.pop(wd, None)
+			self.libc.inotify_rm_watch(self.fd, wd)
+
+	def _readEvents(self, timeout: float | None):
+		""" Yields (folderPath, name, mask, wd) of the events available within `timeout` seconds """
+		if not _select.select([self.fd], [], [], timeout)[0]:
+			return
+		try:
+			data = _os.read(self.fd, 1 << 16)
+		except BlockingIOError:
+			return
+
+		offset = 0
+		while offset < len(data):
+			wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+			offset += _EVENT_HEADER.size
+			name = _os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+			offset += length
+			yield self.paths.get(wd), name, mask, wd
+
+	def waitForChanges(self, debounce: float, maxWait: float | None = None) -> tuple[dict[str, set[str]], set[str], bool]:
+		"""
+		Blocks until something changes and then collects the events until there were none for
+		`debounce` seconds (but at most for `maxWait` seconds, 10 * debounce by default). Returns the
+		names of the changed entries by their folder, the folders that appeared as a whole (created or
+		moved in, everything inside them is new) and whether the kernel dropped events (then nothing is
+		known)
+		"""
+		changed: dict[str, set[str]] = {}
+		appeared: set[str] = set()
+		overflow = False
+		maxWait = maxWait if maxWait is not None else 10 * debounce
+
+		deadline = None
+		while True:
+			timeout = None if deadline is None else max(0.0, min(debounce, deadline - _monotonic()))
+			gotEvents = False
+			for folder, name, mask, wd in self._readEvents(timeout):
+				gotEvents = True
+				if mask & IN_Q_OVERFLOW:
+					overflow = True
+					continue
+				if mask & IN_IGNORED: # the watch is gone (the folder was removed)
+					path = self.paths.pop(wd, None)
+					if path is not None and self.wds.get(path) == wd:
+						del self.wds[path]
+					continue
+				if folder is None:
+					continue
+
+				if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+					if folder == self.root:
+						raise FileNotFoundError(_errno.ENOENT, "The watched folder was removed or moved", folder)
+					continue # reported by its parent folder as well
+				if not name: # i.e. the times of the folder itself changed - it's the change of an entry of its parent folder
+					continue
+
+				changed.setdefault(folder, set()).add(name)
+				if mask & IN_ISDIR:
+					path = self._join(folder, name)
+					if mask & IN_MOVED_FROM:
+						self._forgetTree(path)
+					elif mask & (IN_CREATE | IN_MOVED_TO) and (self.includeFolder is None or self.includeFolder(folder, name)):
+						self.watchTree(path) # before anything else happens inside it
+						appeared.add(path)
+
+			if gotEvents:
+				if deadline is None:
+					deadline = _monotonic() + maxWait
+			elif deadline is not None: # quiet for `debounce` seconds or maxWait is over
+				break
+			if deadline is not None and _monotonic() >= deadline:
+				break
+
+		return changed, appeared, overflow
+
+	def close(self):
+		if self.fd >= 0:
+			_os.close(self.fd)
+			self.fd = -1
+
+class PollingWatcher:
+	"""
+	InotifyWatcher for systems without inotify: the watched folders are listed every `interval`
+	seconds and compared with the previous listing
+	"""
+	def __init__(self, root: str, includeFolder: _Callable[[str, str], bool] | None = None, interval: float = 2.0):
+		self.root = root.rstrip("/") or "/"
+		self.includeFolder = includeFolder
+		self.interval = interval
+		self.snapshot = self._snapshot()
+
+	def _snapshot(self) -> dict[str, dict[str, tuple[int, int, int]]]:
+		""" (mode, size, mtime) of every entry by its name by the folder path """
+		folders = {}
+		stack = [self.root]
+		while stack:
+			path = stack.pop()
+			entries = {}
+			try:
+				with _os.scandir(path) as it:
+					for entry in it:
+						try:
+							info = entry.stat(follow_symlinks=False)
+						except OSError:
+							continue
+						entries[entry.name] = (info.st_mode, info.st_size, info.st_mtime_ns)
+						if _S_ISDIR(info.st_mode) and (self.includeFolder is None or self.includeFolder(path, entry.name)):
+							stack.append(path + entry.name if path.endswith("/") else path + "/" + entry.name)
+			except FileNotFoundError:
+				if path == self.root:
+					raise FileNotFoundError(_errno.ENOENT, "The watched folder was removed or moved", path)
+				continue
+			except OSError:
+				continue
+			folders[path] = entries
+		return folders
+
+	def waitForChanges(self, debounce: float = 0, maxWait: float | None = None) -> tuple[dict[str, set[str]], set[str], bool]:
+		""" Like InotifyWatcher.waitForChanges but the changes are collected for `interval` seconds instead """
+		while True:
+			_sleep(self.interval)
+			snapshot = self._snapshot()
+			changed: dict[str, set[str]] = {}
+			for path, entries in snapshot.items():
+				old = self.snapshot.get(path)
+				if old is None:
+					continue # a new folder - it's a new entry of its parent
+				names = {name for name in entries.keys() | old.keys() if entries.get(name) != old.get(name)}
+				if names:
+					changed[path] = names
+			appeared = snapshot.keys() - self.snapshot.keys()
+			self.snapshot = snapshot
+			if changed or appeared:
+				return changed, appeared, False
+
+	def close(self):
+		self.snapshot = {}
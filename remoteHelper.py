@@ -0,0 +1,238 @@
+"""
+Persistent helper run by a remote Python (see sshUtils.RemoteListDir). Its source is sent over stdin
+right after the ones of filterEngine, treeSummary and inotifyWatcher and all of them are exec'ed
+together, so the remote host needs nothing but a Python 3.8+ interpreter and CompiledFilters,
+filterAcceptor, summarizeTree, fileDigest, InotifyWatcher and PollingWatcher are used here as globals. Stdlib only, without relative imports and without a
+`from __future__` import of its own (it has to be the first statement of the exec'ed source and
+filterEngine's is)
+
+Every request is one JSON object per line:
+- `{"op": "filter", "id": ID, ...}` registers filters (see sshUtils.RemoteListingFilter) used by the
+  listings referring to ID. No response
+- `{"op": "list", "path": PATH, "filter": ID or null}` lists the folder. Every entry is printed as
+  "name/mode/size/atime/mtime" (hex numbers, names cannot contain "/") and the listing ends with an
+  empty line. A line starting with "/" is an error: "/errno/message"
+- `{"op": "tree", "path": PATH, "filter": ID or null, "maxDepth": INT}` lists the folder and the
+  folders below it down to maxDepth in one go (see sshUtils.RemoteListDir.listTree). The response is
+  one JSON line `{"folders": {RELPATH: [[name, mode, size, atime, mtime], ...]}, "errors": {RELPATH:
+  [errno, message, path]}}` ("" is the folder itself, the others end with "/"). A subfolder that
+  couldn't be listed is in "errors" only and nothing below it is listed. When the folder itself
+  can't be listed the response is `{"error": [errno, message, path]}`
+- `{"op": "summary", "path": PATH, "filter": ID or null, "filterRoot": PATH, "modes": BOOL}` prints
+  the summaries of the folder tree (see treeSummary.summarizeTree) as one JSON object line
+- `{"op": "watch", "path": PATH, "filter": ID or null, "filterRoot": PATH, "maxDepth": INT,
+  "debounce": SECONDS, "interval": SECONDS}` watches the folder tree (see sshUtils.RemoteWatcher)
+  and never returns. The first line is `{"watching": "inotify" or "polling"}` and then every batch
+  of changes is one line `{"changed": {FOLDER: [NAME, ...]}, "appeared": [FOLDER, ...], "overflow":
+  BOOL}`. `{"gone": true}` ends the stream when the folder was removed
+- `{"op": "batch", "records": [[OP, SRC, DST, ATIME, MTIME], ...]}` carries out file operations on
+  the remote host itself (see sshUtils.RemoteListDir.batch). OP is "copy", "move", "delete" (of
+  SRC), "mkdir" (of DST and the folders above it) or "utime" (of DST only) and the times of DST are
+  set right after the copy/move unless ATIME is null. The response is one JSON line with a result
+  per record: null or `[errno, message, path]`
+- `{"op": "hash", "paths": [PATH, ...]}` hashes the contents of the files (see treeSummary.fileDigest).
+  The response is one JSON line with the hex digest of every file or null when it couldn't be read
+- `{"op": "sparse", "paths": [PATH, ...]}` tells which files have holes (fewer blocks allocated than
+  their size needs). The response is one JSON line with true/false for every file or null when it
+  couldn't be stat'ed
+"""
+import json
+import os
+import shutil
+import sys
+
+def _scanFolder(path: str, filterSpec):
+	""" Yields (entry, stat) of the entries passing the filters """
+	if filterSpec is not None:
+		files, folders, filesNewerThan, foldersNewerThan, othersAsFiles = filterSpec
+		folderPrefix = path if path.endswith("/") else path + "/"
+
+	with os.scandir(path) as d:
+		for e in d:
+			if filterSpec is not None: # mirrors SSH_SYNC's FilterClass._innerFilterFun - names before dates so rejected entries don't get stat'ed
+				if e.is_dir(follow_symlinks=False):
+					if folders is None or not folders(e.name, folderPrefix):
+						continue
+					newerThan = foldersNewerThan
+				elif othersAsFiles or e.is_file(follow_symlinks=False):
+					if not files(e.name, folderPrefix):
+						continue
+					newerThan = filesNewerThan
+				else:
+					continue
+
+			try: i = e.stat(follow_symlinks=False)
+			except OSError: continue
+
+			if filterSpec is not None and newerThan is not None and not newerThan < int(i.st_mtime):
+				continue
+			yield e, i
+
+def _listFolder(out, path: str, filterSpec):
+	try:
+		for e, i in _scanFolder(path, filterSpec):
+			out.write("%s/%x/%x/%x/%x\n" % (e.name, i.st_mode, i.st_size, int(i.st_atime), int(i.st_mtime)))
+	except OSError as x:
+		out.write("/%d/%s\n" % (x.errno or 0, x.strerror))
+	out.write("\n")
+	out.flush()
+
+def _listTree(out, path: str, filterSpec, maxDepth: int):
+	root = path if path.endswith("/") else path + "/"
+	folders = {}
+	errors = {}
+	stack = [("", 0)]
+	while stack:
+		rel, depth = stack.pop()
+		entries = []
+		subfolders = []
+		try:
+			for e, i in _scanFolder(root + rel, filterSpec):
+				if e.is_dir(follow_symlinks=False):
+					if depth >= maxDepth:
+						continue
+					subfolders.append((rel + e.name + "/", depth + 1))
+				entries.append((e.name, i.st_mode, i.st_size, int(i.st_atime), int(i.st_mtime)))
+		except OSError as x:
+			error = [x.errno or 0, x.strerror or str(x), x.filename if x.filename is not None else root + rel]
+			if not rel: # the folder itself
+				out.write(json.dumps({"error": error}) + "\n")
+				out.flush()
+				return
+			errors[rel] = error
+			continue
+		folders[rel] = entries
+		stack.extend(subfolders)
+	out.write(json.dumps({"folders": folders, "errors": errors}) + "\n")
+	out.flush()
+
+def _compileFilter(req: dict):
+	folders = req["folders"]
+	return (
+		CompiledFilters([tuple(rule) for rule in req["files"]], req["filesDefault"]),
+		CompiledFilters([tuple(rule) for rule in folders], req["foldersDefault"]) if folders is not None else None,
+		req["filesNewerThan"],
+		req["foldersNewerThan"],
+		req["othersAsFiles"],
+	)
+
+def _watch(out, req: dict, filterSpec):
+	root = req["path"].rstrip("/") or "/"
+	filterRoot = req["filterRoot"].rstrip("/")
+	folders = filterSpec[1] if filterSpec is not None else None
+	maxDepth = req["maxDepth"]
+
+	def includeFolder(parentPath: str, name: str) -> bool: # names and depth only, like SSH_SYNC's inWatchedTree
+		rel = parentPath[len(root):].strip("/")
+		if (rel.count("/") + 1 if rel else 0) >= maxDepth:
+			return False
+		return filterSpec is None or folders is not None and folders(name, filterRoot + "/" + (rel + "/" if rel else ""))
+
+	watcher = None
+	if sys.platform.startswith("linux"): # elsewhere loading libc for inotify fails in ways that differ between OSes
+		try:
+			watcher = InotifyWatcher(root, includeFolder)
+			method = "inotify"
+		except (OSError, AttributeError): # inotify is not available (i.e. disabled or out of instances)
+			pass
+	if watcher is None:
+		watcher = PollingWatcher(root, includeFolder, req["interval"])
+		method = "polling"
+	out.write(json.dumps({"watching": method}) + "\n")
+	out.flush()
+
+	while True:
+		try:
+			changed, appeared, overflow = watcher.waitForChanges(req["debounce"])
+		except FileNotFoundError:
+			out.write(json.dumps({"gone": True}) + "\n")
+			out.flush()
+			return
+		if overflow: # nothing is known so the watches are set up from scratch
+			watcher.close()
+			watcher = InotifyWatcher(root, includeFolder)
+		out.write(json.dumps({"changed": {path: sorted(names) for path, names in changed.items()}, "appeared": sorted(appeared), "overflow": overflow}) + "\n")
+		out.flush()
+
+def _nativePath(path):
+	""" SFTP paths of Windows drives ("/C:/folder") -> "C:/folder" """
+	if path is not None and os.name == "nt" and path[:1] == "/" and path[2:3] == ":":
+		return path[1:]
+	return path
+
+def _runBatch(out, records: list):
+	results = []
+	for op, src, dst, atime, mtime in records:
+		src, dst = _nativePath(src), _nativePath(dst)
+		try:
+			if op == "copy":
+				shutil.copyfile(src, dst)
+			elif op == "move":
+				shutil.move(src, dst)
+			elif op == "delete":
+				os.remove(src)
+			elif op == "mkdir":
+				os.makedirs(dst, exist_ok=True)
+			elif op != "utime":
+				raise OSError(0, "Unknown batch operation: %s" % op, src)
+			if op in ("copy", "move", "utime") and atime is not None:
+				os.utime(dst, (atime, mtime))
+			results.append(None)
+		except OSError as x:
+			results.append([x.errno or 0, x.strerror or str(x), x.filename if x.filename is not None else src])
+	out.write(json.dumps(results) + "\n")
+	out.flush()
+
+def _hashFiles(out, paths: list):
+	digests = []
+	for path in paths:
+		try:
+			digests.append(fileDigest(_nativePath(path)))
+		except OSError:
+			digests.append(None)
+	out.write(json.dumps(digests) + "\n")
+	out.flush()
+
+def _sparseFiles(out, paths: list):
+	results = []
+	for path in paths:
+		try:
+			info = os.stat(_nativePath(path))
+			results.append(getattr(info, "st_blocks", None) is not None and info.st_blocks * 512 < info.st_size) # no st_blocks on Windows
+		except OSError:
+			results.append(None)
+	out.write(json.dumps(results) + "\n")
+	out.flush()
+
+def main():
+	out = sys.stdout
+	filters = {}
+	while True:
+		line = sys.stdin.readline()
+		if not line.strip():
+			break
+		req = json.loads(line)
+		op = req["op"]
+		if op == "list":
+			_listFolder(out, req["path"], filters[req["filter"]] if req.get("filter") is not None else None)
+		elif op == "tree":
+			_listTree(out, req["path"], filters[req["filter"]] if req.get("filter") is not None else None, req["maxDepth"])
+		elif op == "summary":
+			filterSpec = filters[req["filter"]] if req.get("filter") is not None else None
+			accept = filterAcceptor(*filterSpec[:4]) if filterSpec is not None else None
+			out.write(json.dumps(summarizeTree(req["path"], accept, req["filterRoot"], req["modes"])) + "\n")
+			out.flush()
+		elif op == "watch":
+			_watch(out, req, filters[req["filter"]] if req.get("filter") is not None else None)
+			break
+		elif op == "batch":
+			_runBatch(out, req["records"])
+		elif op == "hash":
+			_hashFiles(out, req["paths"])
+		elif op == "sparse":
+			_sparseFiles(out, req["paths"])
+		elif op == "filter":
+			filters[req["id"]] = _compileFilter(req)
+		else:
+			out.write("/0/Unknown operation: %s\n\n" % op)
+			out.flush()
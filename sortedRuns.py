@@ -0,0 +1,95 @@
+"""
+External sorting for more records than should be held in memory (i.e. listings of folders with
+millions of entries): the records are collected in runs, every full run is sorted and written to a
+temporary file and iterating merges the runs and the records still in memory into one sorted stream.
+
+Stdlib only
+"""
+import heapq as _heapq
+from itertools import groupby as _groupby
+from operator import itemgetter as _itemgetter
+import pickle as _pickle
+import tempfile as _tempfile
+from typing import Iterable as _Iterable, Iterator as _Iterator
+
+CHUNK_RECORDS = 1024 # records pickled together - reading a run back holds only one chunk of it in memory
+
+class SortedRuns:
+	"""
+	Sorts the added records (tuples compared as a whole, so the sort key goes first) keeping at most
+	`runSize` of them in memory. It can be iterated more than once but not by two iterations at the
+	same time
+	"""
+	def __init__(self, runSize: int):
+		self.runSize = max(1, runSize)
+		self.records: list[tuple] = []
+		self.files = []
+		self.count = 0
+
+	def add(self, record: tuple):
+		self.records.append(record)
+		self.count += 1
+		if len(self.records) >= self.runSize:
+			self._spill()
+
+	def extend(self, records: _Iterable[tuple]):
+		for record in records:
+			self.add(record)
+
+	def _spill(self):
+		self.records.sort()
+		file = _tempfile.TemporaryFile() # deleted as soon as it's closed
+		for start in range(0, len(self.records), CHUNK_RECORDS):
+			_pickle.dump(self.records[start:start + CHUNK_RECORDS], file, _pickle.HIGHEST_PROTOCOL)
+		self.files.append(file)
+		self.records = []
+
+	@staticmethod
+	def _readRun(file) -> _Iterator[tuple]:
+		file.seek(0)
+		while True:
+			try:
+				chunk = _pickle.load(file)
+			except EOFError:
+				return
+			yield from chunk
+
+	def __iter__(self) -> _Iterator[tuple]:
+		self.records.sort()
+		return _heapq.merge(*map(self._readRun, self.files), self.records)
+
+	def __len__(self):
+		return self.count
+
+	def close(self):
+		for file in self.files:
+			file.close()
+		self.files = []
+		self.records = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *_):
+		self.close()
+
+def mergeJoin(left: _Iterable[tuple], right: _Iterable[tuple]) -> _Iterator[tuple[object, list[tuple], list[tuple]]]:
+	"""
+	Joins two streams of records sorted by their first item. Yields (key, leftRecords, rightRecords)
+	for every key found in any of them (one of the lists is empty when the key is on one side only)
+	"""
+	leftGroups  = _groupby(left , _itemgetter(0))
+	rightGroups = _groupby(right, _itemgetter(0))
+	leftKey , leftGroup  = next(leftGroups , (None, None))
+	rightKey, rightGroup = next(rightGroups, (None, None))
+	while leftGroup is not None or rightGroup is not None:
+		if rightGroup is None or leftGroup is not None and leftKey < rightKey:
+			yield leftKey, list(leftGroup), []
+			leftKey, leftGroup = next(leftGroups, (None, None))
+		elif leftGroup is None or rightKey < leftKey:
+			yield rightKey, [], list(rightGroup)
+			rightKey, rightGroup = next(rightGroups, (None, None))
+		else:
+			yield leftKey, list(leftGroup), list(rightGroup)
+			leftKey , leftGroup  = next(leftGroups , (None, None))
+			rightKey, rightGroup = next(rightGroups, (None, None))
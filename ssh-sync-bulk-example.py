@@ -16,7 +16,8 @@ main(Namespace(
 	remoteOs               = "windows",
 	cacheDirectoryListings = True,
 	operations             = (
-		# sourceDir                   , sourcePlace , destDir                           , destPlace  , mode     , filePatterns     , defaultMatch
+		# sourceDir                   , sourcePlace , destDir                           , destPlace  , mode     , filePatterns     , defaultMatch, recursionDepth (optional)
 		(f"G:/Test/Nowy folder/Source", PLACE.REMOTE, f"G:/Test/Nowy folder/Destination", PLACE.LOCAL, MODE.SYNC, [("*.txt", True)], True        ),
+		(f"G:/Test/Nowy folder/Tree"  , PLACE.REMOTE, f"G:/Test/Nowy folder/Tree copy"  , PLACE.LOCAL, MODE.COPY, [                ], True        , 3             ),
 	),
 ))
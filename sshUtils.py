@@ -1,6 +1,12 @@
 from pathlib import Path as _Path; __package__ = __package__ or _Path(__file__).resolve().parent.name # To be able to use relative imports when run directly - never override a __package__ Python already set (see README)
 
+import errno as _errno
+from itertools import chain as _chain
+import json as _json
 import socket as _socket
+import sys as _sys
+import threading as _threading
+from typing import Callable as _Callable
 
 import paramiko as _paramiko
 from paramiko.ssh_exception import (
@@ -24,6 +30,7 @@ from .commonConstants import COLOR_ERROR as _COLOR_ERROR
 from .fileUtils import isDir as _isDir, iteratePathParts as _iteratePathParts
 from .LocalSFTPAttributes import LocalSFTPAttributes as _LocalSFTPAttributes
 from .SimpleError import SimpleError as _SimpleError
+from .treeSummary import DIGEST_CHUNK_SIZE as _DIGEST_CHUNK_SIZE, digestChunks as _digestChunks
 
 def getSSH(
 	username: str,
@@ -151,6 +158,28 @@ def remoteFolderExists(sftp: _paramiko.SFTPClient, remotePath: str) -> bool:
 	except FileNotFoundError:
 		return False
 
+def remote_lstat_attr(sftp: _paramiko.SFTPClient, remotePath: str) -> _LocalSFTPAttributes | None:
+	""" Remote equivalent of LocalSFTPAttributes.local_lstat_attr """
+	try:
+		attr = sftp.lstat(remotePath)
+	except FileNotFoundError:
+		return None
+	attr.filename = remotePath.rstrip("/").rsplit("/", 1)[-1]
+	return _LocalSFTPAttributes.from_sftp_attributes(attr)
+
+def remoteReadTextFileIfExists(sftp: _paramiko.SFTPClient, remotePath: str, encoding="UTF-8") -> str | None:
+	try:
+		with sftp.open(remotePath, "r") as f:
+			return f.read().decode(encoding, errors="replace")
+	except FileNotFoundError:
+		return None
+
+def remoteFileDigest(sftp: _paramiko.SFTPClient, remotePath: str) -> str:
+	""" treeSummary.fileDigest of a remote file read over SFTP (RemoteListDir.hashFiles hashes without the download) """
+	with sftp.open(remotePath, "rb") as f:
+		f.prefetch(f.stat().st_size)
+		return _digestChunks(iter(lambda: f.read(_DIGEST_CHUNK_SIZE), b""))
+
 def assertRemoteFolderExists(sftp: _paramiko.SFTPClient, remotePath: str, additionalComment = ""):
 	if not remoteFolderExists(sftp, remotePath):
 		raise _SimpleError(f'The remote folder "{remotePath}" does not exist or is not a folder{additionalComment}')
@@ -171,6 +200,68 @@ def ensureRemoteFolderExists(sftp: _paramiko.SFTPClient, remotePath: str):
 			created = remoteMkdir(sftp, part) or created
 	return created
 
+class _ListingStream:
+	"""
+	Iterator over a listing that is still being read from a channel shared by all the listings of its
+	owner. When the owner has to start another listing before this one is exhausted (i.e. when the
+	consumer recursed into a subfolder or gave up early) the rest of this one is read into memory
+	first (`detach`) so the responses of the two never get mixed up
+	"""
+	def __init__(self, entries):
+		self.entries = entries
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		return next(self.entries)
+
+	def detach(self):
+		rest = []
+		try:
+			rest.extend(self.entries)
+		except Exception as e: # belongs to the consumer of this listing so raise it there
+			self.entries = _chain(rest, _raiseLater(e))
+		else:
+			self.entries = iter(rest)
+
+def _raiseLater(err: Exception):
+	raise err
+	yield
+
+class RemoteListingFilter:
+	"""
+	Filters applied by the remote helper before the entries are sent (see remoteHelper._listFolder).
+	`fileRules`/`folderRules` are CompiledFilters rules `(pattern, matchVal, isPath, isCase)`.
+	`folderRules = None` drops every folder and `othersAsFiles` makes entries that are neither files
+	nor folders (i.e. symlinks) go through the file rules instead of being dropped. Only entries newer
+	than `filesNewerThan`/`foldersNewerThan` (timestamps, None for no date check) are sent. Callers
+	still filter the entries they get, the remote filtering only saves the bandwidth
+	"""
+	def __init__(
+		self,
+		fileRules: list[tuple[str, bool, bool, bool]],
+		fileDefault: bool,
+		folderRules: list[tuple[str, bool, bool, bool]] | None = None,
+		folderDefault = False,
+		filesNewerThan: int | None = None,
+		foldersNewerThan: int | None = None,
+		othersAsFiles = False,
+	):
+		self.spec = {
+			"files"           : fileRules,
+			"filesDefault"    : fileDefault,
+			"folders"         : folderRules,
+			"foldersDefault"  : folderDefault,
+			"filesNewerThan"  : filesNewerThan,
+			"foldersNewerThan": foldersNewerThan,
+			"othersAsFiles"   : othersAsFiles,
+		}
+
+def _remoteHelperSource() -> str:
+	folder = _Path(__file__).resolve().parent
+	return "\n".join((folder / name).read_text(encoding="utf-8") for name in ("filterEngine.py", "treeSummary.py", "inotifyWatcher.py", "remoteHelper.py")) + "\nmain()\n"
+
 class RemoteListDir:
 	def __init__(self, ssh: _paramiko.SSHClient, pythonStr = "python", init = False):
 		self.ssh = ssh
@@ -178,29 +269,137 @@ class RemoteListDir:
 		self.stdin: _paramiko.ChannelFile | None = None
 		self.stdout: _paramiko.ChannelFile | None = None
 		self.stderr: _paramiko.ChannelFile | None = None
+		self.stream: _ListingStream | None = None
+		self.filterIds: dict[RemoteListingFilter, int] = {} # filters already sent to the current remote helper
 		if init:
 			self.init()
 
 	def init(self):
 		if self.stdin is None:
-			code = (
-				"import os\\n"
-				"while (s := input()):\\n"
-				"	with os.scandir(s) as d:\\n"
-				"		for e in d:\\n"
-				"			i = e.stat(follow_symlinks=0); print(e.name, '%x/%x/%x/%x' % (i.st_mode, i.st_size, int(i.st_atime), int(i.st_mtime)), sep='/')\\n"
-				"		print('', flush=1)"
-			)
-			cmd = f'{self.pythonStr} -c "exec(\\\"{code}\\\")"'
+			# The helper's source is the first line read from stdin (see remoteHelper for the protocol)
+			cmd = f'{self.pythonStr} -c "import sys,json;exec(json.loads(sys.stdin.readline()))"'
 			self.stdin, self.stdout, self.stderr = self.ssh.exec_command(cmd)
+			self.stdin.write(_json.dumps(_remoteHelperSource()) + "\n")
+			self.filterIds.clear()
 
-	def listdir_attr(self, path: str):
+	def _request(self, **req):
+		self.stdin.write(_json.dumps(req) + "\n")
+
+	def listdir_attr(self, path: str, remoteFilter: RemoteListingFilter | None = None):
+		return list(self.listdir_attr_iter(path, remoteFilter))
+
+	def _filterId(self, remoteFilter: RemoteListingFilter | None) -> int | None:
+		""" Sends the filter to the helper the first time it's used """
+		if remoteFilter is None:
+			return None
+		filterId = self.filterIds.get(remoteFilter)
+		if filterId is None:
+			filterId = self.filterIds[remoteFilter] = len(self.filterIds)
+			self._request(op="filter", id=filterId, **remoteFilter.spec)
+		return filterId
+
+	def summarizeTree(self, path: str, remoteFilter: RemoteListingFilter | None = None, filterRoot: str | None = None, modes = True) -> dict[str, str | None]:
+		""" treeSummary.summarizeTree computed by the remote helper (folders are rejected by `remoteFilter` only when its folderRules are None) """
 		self.init()
+		if self.stream is not None:
+			self.stream.detach()
+
+		self._request(op="summary", path=path, filter=self._filterId(remoteFilter), filterRoot=filterRoot if filterRoot is not None else path, modes=modes)
+		self.stdin.flush()
+		line = self.stdout.readline()
+		if not line.strip():
+			raise _SimpleError(f'RemoteListDir.summarizeTree: remote script returned error when summarizing folder "{path}":\n{self.stderr.read().decode(errors="ignore").strip()}')
+		return _json.loads(line)
+
+	def listTree(self, path: str, remoteFilter: RemoteListingFilter | None = None, maxDepth = _sys.maxsize, onError: _Callable[[str, OSError], None] | None = None) -> dict[str, list[_LocalSFTPAttributes]]:
+		"""
+		Listings of `path` and of the folders below it down to `maxDepth` in one request, by their path
+		relative to `path` ("" is `path` itself, the others end with "/"). Subfolders at `maxDepth` are
+		left out of the listings. With `remoteFilter` only the entries passing it are sent and entered.
+		A subfolder that couldn't be listed is left out together with everything below it and `onError`
+		gets its relative path and the error - without `onError` the error is raised
+		"""
+		self.init()
+		if self.stream is not None:
+			self.stream.detach()
+
+		self._request(op="tree", path=path, filter=self._filterId(remoteFilter), maxDepth=maxDepth)
+		self.stdin.flush()
+		line = self.stdout.readline()
+		if not line.strip():
+			raise _SimpleError(f'RemoteListDir.listTree: remote script returned error when listing folder "{path}":\n{self.stderr.read().decode(errors="ignore").strip()}')
+		response = _json.loads(line)
+		if "error" in response:
+			raise OSError(*response["error"])
+		for rel, error in response["errors"].items():
+			if onError is None:
+				raise OSError(*error)
+			onError(rel, OSError(*error))
+		return {
+			rel: [
+				_LocalSFTPAttributes.from_values(filename=filename, st_mode=st_mode, st_size=st_size, st_atime=st_atime, st_mtime=st_mtime)
+				for filename, st_mode, st_size, st_atime, st_mtime in entries
+			]
+			for rel, entries in response["folders"].items()
+		}
+
+	def batch(self, records: list[tuple[str, str, str | None, int | None, int | None]]) -> list[OSError | None]:
+		"""
+		Copies, moves, deletes files and sets their times on the remote host itself. `records` are `(op,
+		src, dst, atime, mtime)` (see remoteHelper) and the result of every record is None or the OSError
+		it failed with
+		"""
+		self.init()
+		if self.stream is not None:
+			self.stream.detach()
+
+		self._request(op="batch", records=records)
+		self.stdin.flush()
+		line = self.stdout.readline()
+		if not line.strip():
+			raise _SimpleError(f'RemoteListDir.batch: remote script returned error when running a batch of {len(records)} file operations:\n{self.stderr.read().decode(errors="ignore").strip()}')
+		return [OSError(*result) if result is not None else None for result in _json.loads(line)]
+
+	def hashFiles(self, paths: list[str]) -> list[str | None]:
+		""" treeSummary.fileDigest of every file computed on the remote host. None for the files that couldn't be read """
+		self.init()
+		if self.stream is not None:
+			self.stream.detach()
+
+		self._request(op="hash", paths=paths)
+		self.stdin.flush()
+		line = self.stdout.readline()
+		if not line.strip():
+			raise _SimpleError(f'RemoteListDir.hashFiles: remote script returned error when hashing {len(paths)} files:\n{self.stderr.read().decode(errors="ignore").strip()}')
+		return _json.loads(line)
+
+	def sparseFiles(self, paths: list[str]) -> list[bool | None]:
+		""" Whether the files have holes on the remote host (see transferUtils.sftpGet). None for the files that couldn't be stat'ed """
+		self.init()
+		if self.stream is not None:
+			self.stream.detach()
+
+		self._request(op="sparse", paths=paths)
+		self.stdin.flush()
+		line = self.stdout.readline()
+		if not line.strip():
+			raise _SimpleError(f'RemoteListDir.sparseFiles: remote script returned error when checking {len(paths)} files:\n{self.stderr.read().decode(errors="ignore").strip()}')
+		return _json.loads(line)
+
+	def listdir_attr_iter(self, path: str, remoteFilter: RemoteListingFilter | None = None):
+		"""
+		Yields the entries as the remote script prints them. Errors of opening the folder are raised by
+		the call itself (not by the first next()) just like with listdir_attr. With `remoteFilter` only
+		the entries passing it are sent
+		"""
+		self.init()
+		if self.stream is not None:
+			self.stream.detach()
 
 		try:
-			self.stdin.write(path + "\n")
+			self._request(op="list", path=path, filter=self._filterId(remoteFilter))
 			self.stdin.flush()
-		except OSError: # Socket is closed (probably because remote python crashed because the scanned folder was inaccessible because script did not have suficent permissions)
+		except OSError: # Socket is closed (probably because remote python crashed)
 			self.stdin = None # reset stdin so the remote script gets recreated on the next use # TODO find a better solution for this
 			raise _SimpleError(
 				f'RemoteListDir.listdir_attr: remote script returned error when listing folder "{path}":\n{ \
@@ -208,17 +407,140 @@ class RemoteListDir:
 				or self.stdout.read().decode(errors="ignore").strip()}'
 			)
 
-		entries = []
-		while (line := self.stdout.readline().rstrip()):
+		line = self._readLine(path)
+		self.stream = _ListingStream(self._entries(line, path))
+		return self.stream
+
+	def _readLine(self, path: str) -> str:
+		line = self.stdout.readline().rstrip("\r\n")
+		if line.startswith("/"):
+			_, errno, message = line.split("/", 2)
+			self.stdout.readline() # the empty line ending the listing
+			raise OSError(int(errno), message, path) # OSError picks the right subclass (i.e. PermissionError) by errno
+		return line
+
+	def _entries(self, line: str, path: str):
+		while line:
 			filename, st_mode, st_size, st_atime, st_mtime = line.split("/")
-			entries.append(_LocalSFTPAttributes.from_values(
+			yield _LocalSFTPAttributes.from_values(
 				filename=filename,
 				st_mode =int(st_mode , 16),
 				st_size =int(st_size , 16),
 				st_atime=int(st_atime, 16),
 				st_mtime=int(st_mtime, 16),
-			))
-		return entries
+			)
+			line = self._readLine(path)
+
+class RemoteWatcher:
+	"""
+	Streams the changes of a remote folder tree from a remote helper process of its own (the helper
+	can't answer anything else while watching, see remoteHelper). The remote host uses inotify when it
+	can and polls every `pollInterval` seconds otherwise. Only the folders passing the folder rules of
+	`remoteFilter` (matched with paths under `filterRoot`) down to `maxDepth` are watched.
+	waitForChanges works like inotifyWatcher.InotifyWatcher.waitForChanges
+	"""
+	def __init__(
+		self,
+		ssh: _paramiko.SSHClient,
+		pythonStr: str,
+		path: str,
+		debounce: float,
+		remoteFilter: RemoteListingFilter | None = None,
+		filterRoot: str | None = None,
+		maxDepth = _sys.maxsize,
+		pollInterval = 2.0,
+	):
+		cmd = f'{pythonStr} -c "import sys,json;exec(json.loads(sys.stdin.readline()))"'
+		self.stdin, self.stdout, self.stderr = ssh.exec_command(cmd)
+		self.stdin.write(_json.dumps(_remoteHelperSource()) + "\n")
+		if remoteFilter is not None:
+			self.stdin.write(_json.dumps({"op": "filter", "id": 0, **remoteFilter.spec}) + "\n")
+		self.stdin.write(_json.dumps({
+			"op"        : "watch",
+			"path"      : path,
+			"filter"    : 0 if remoteFilter is not None else None,
+			"filterRoot": filterRoot if filterRoot is not None else path,
+			"maxDepth"  : maxDepth,
+			"debounce"  : debounce,
+			"interval"  : pollInterval,
+		}) + "\n")
+		self.stdin.flush()
+		self.method: str = self._readMessage()["watching"] # "inotify" or "polling"
+
+	def _readMessage(self) -> dict:
+		line = self.stdout.readline()
+		if not line.strip():
+			raise _SimpleError(f'RemoteWatcher: remote script stopped watching:\n{self.stderr.read().decode(errors="ignore").strip()}')
+		return _json.loads(line)
+
+	def waitForChanges(self) -> tuple[dict[str, set[str]], set[str], bool]:
+		message = self._readMessage()
+		if message.get("gone"):
+			raise FileNotFoundError(_errno.ENOENT, "The watched folder was removed or moved")
+		return {path: set(names) for path, names in message["changed"].items()}, set(message["appeared"]), message["overflow"]
+
+	def close(self):
+		self.stdin.channel.close()
+
+class SFTPListDir:
+	"""
+	Streaming listings over paramiko's sftp.listdir_iter. It reads the responses straight from its
+	channel so it gets a channel of its own - a transfer or a nested listing on the same channel would
+	steal its packets
+	"""
+	def __init__(self, ssh: _paramiko.SSHClient):
+		self.ssh = ssh
+		self.sftp: _paramiko.SFTPClient | None = None
+		self.stream: _ListingStream | None = None
+
+	def listdir_attr(self, path: str):
+		return list(self.listdir_attr_iter(path))
+
+	def listdir_attr_iter(self, path: str):
+		""" Yields compact entries (see LocalSFTPAttributes). Errors of opening the folder are raised by the call itself """
+		if self.sftp is None:
+			self.sftp = self.ssh.open_sftp()
+		if self.stream is not None:
+			self.stream.detach()
+
+		entries = self.sftp.listdir_iter(path)
+		first = next(entries, None) # listdir_iter only opens the folder on the first next()
+		entries = _chain((first,), entries) if first is not None else iter(())
+		self.stream = _ListingStream(map(_LocalSFTPAttributes.from_sftp_attributes, entries))
+		return self.stream
+
+	def close(self):
+		if self.sftp is not None:
+			self.sftp.close()
+			self.sftp = None
+
+class SFTPPool:
+	"""
+	Hands every thread its own SFTP channel multiplexed over the same SSH connection.
+	A single SFTPClient must not be shared between threads as they would read each other's responses
+	"""
+	def __init__(self, ssh: _paramiko.SSHClient, sftp: _paramiko.SFTPClient | None = None):
+		self.ssh = ssh
+		self.local = _threading.local()
+		self.lock = _threading.Lock()
+		self.clients: list[_paramiko.SFTPClient] = []
+		if sftp is not None: # reuse the already opened channel in the creating thread
+			self.local.sftp = sftp
+
+	def get(self) -> _paramiko.SFTPClient:
+		sftp = getattr(self.local, "sftp", None)
+		if sftp is None:
+			sftp = self.local.sftp = self.ssh.open_sftp()
+			with self.lock:
+				self.clients.append(sftp)
+		return sftp
+
+	def close(self):
+		""" Closes the channels opened by the pool. The one passed to __init__ is left to its owner """
+		with self.lock:
+			for sftp in self.clients:
+				sftp.close()
+			self.clients.clear()
 
 def remoteHasPython(ssh: _paramiko.SSHClient, throwOnNotFound = True, enforcePythonVer = "3") -> str:
 	"""
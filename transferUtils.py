@@ -0,0 +1,420 @@
+from pathlib import Path as _Path; __package__ = __package__ or _Path(__file__).resolve().parent.name # To be able to use relative imports when run directly - never override a __package__ Python already set (see README)
+
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+import errno as _errno
+import os as _os
+import re as _re
+import shutil as _shutil
+import sys as _sys
+import threading as _threading
+from time import perf_counter as _perf_counter, sleep as _sleep
+from typing import Callable as _Callable
+
+from .SimpleError import SimpleError as _SimpleError
+
+try:
+	import fcntl as _fcntl
+except ImportError: # Windows
+	_fcntl = None
+
+_BYTE_RATE_REGEX = _re.compile(r"^\s*(\d+(?:\.\d*)?)\s*([kmgt]?)(?:i?b)?(?:/s)?\s*$", _re.IGNORECASE)
+_BYTE_RATE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+ADAPTIVE_MAX_JOBS = 16
+SFTP_CHUNK_SIZE = 32768 # paramiko reads and writes remote files in chunks of this size
+_ZERO_CHUNK = bytes(SFTP_CHUNK_SIZE)
+FICLONE = 0x40049409 # _IOW(0x94, 9, int) from linux/fs.h - makes a file share the data of another one (btrfs, XFS)
+ZERO_COPY_CHUNK_SIZE = 64 * 1024 * 1024 # how much copy_file_range and sendfile copy per call without --bwlimit
+_LINUX = _sys.platform.startswith("linux")
+SPARSE_MIN_SIZE = 1024 * 1024 # smaller downloads are never checked for holes (see sftpGet)
+
+def parseByteRate(txt: str) -> float:
+	""" Parses bandwidth like `500K`, `12.5M` or `1GiB/s` into bytes per second (binary multiples) """
+	mObj = _BYTE_RATE_REGEX.match(txt)
+	if not mObj or not float(mObj[1]):
+		raise _SimpleError(f'Invalid bandwidth: "{txt}". Should be a positive number of bytes per second optionally followed by K, M, G or T (i.e. 500K, 10M)')
+	return float(mObj[1]) * _BYTE_RATE_UNITS[mObj[2].lower()]
+
+def parseJobs(txt: str) -> tuple[int, bool]:
+	""" Parses `N`, `auto` or `auto:MAX`. Returns (maxJobs, adaptive) """
+	txt = str(txt).strip().lower()
+	adaptive = txt.startswith("auto")
+	if adaptive:
+		txt = txt[len("auto"):].lstrip(":") or str(ADAPTIVE_MAX_JOBS)
+	try:
+		maxJobs = int(txt)
+	except ValueError:
+		maxJobs = 0
+	if maxJobs < 1:
+		raise _SimpleError(f'Invalid number of jobs: "{txt}". Should be a positive integer, "auto" or "auto:MAX"')
+	return maxJobs, adaptive
+
+class TokenBucket:
+	"""
+	Thread-safe token bucket. One token is one byte.
+
+	Tokens are allowed to go into debt: `consume` always takes what it asked for and then sleeps
+	for as long as it takes to pay the debt back, so a single big chunk never deadlocks and
+	concurrent consumers automatically share the rate
+	"""
+	def __init__(self, rate: float, burst: float = 0):
+		self.rate = rate
+		self.burst = burst or max(rate / 4, SFTP_CHUNK_SIZE) # a quarter of a second of traffic
+		self.tokens = self.burst
+		self.last = _perf_counter()
+		self.lock = _threading.Lock()
+
+	def consume(self, amount: int):
+		with self.lock:
+			now = _perf_counter()
+			self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate) - amount
+			self.last = now
+			debt = -self.tokens
+
+		if debt > 0:
+			_sleep(debt / self.rate)
+
+def throttleCallback(bucket: TokenBucket | None):
+	""" Returns a paramiko-style `callback(transferred, total)` charging `bucket` for every chunk """
+	if bucket is None:
+		return None
+
+	transferredBefore = 0
+	def callback(transferred: int, total: int):
+		nonlocal transferredBefore
+		bucket.consume(transferred - transferredBefore)
+		transferredBefore = transferred
+	return callback
+
+def dataExtents(file, size: int) -> list[tuple[int, int]] | None:
+	"""
+	(offset, length) of the data of the open `file` of `size` bytes, its holes left out. None when the
+	file has no holes or the system can't tell (no SEEK_DATA, i.e. on Windows)
+	"""
+	if not hasattr(_os, "SEEK_DATA") or size == 0:
+		return None
+	fd = file.fileno()
+	if _os.fstat(fd).st_blocks * 512 >= size: # fully allocated - don't bother seeking
+		return None
+
+	extents = []
+	offset = 0
+	try:
+		while offset < size:
+			try:
+				start = _os.lseek(fd, offset, _os.SEEK_DATA)
+			except OSError as e:
+				if e.errno == _errno.ENXIO: # only a hole up to the end
+					break
+				raise
+			end = min(_os.lseek(fd, start, _os.SEEK_HOLE), size)
+			extents.append((start, end - start))
+			offset = end
+	except OSError: # the filesystem does not support it
+		return None
+	finally:
+		_os.lseek(fd, 0, _os.SEEK_SET)
+	return None if extents == [(0, size)] else extents
+
+def _copyExtents(fsrc, fdst, extents: list[tuple[int, int]], size: int, bucket: TokenBucket | None, chunkSize: int):
+	""" Copies only the data of a sparse file - `fdst` (local or SFTP) gets holes where `fsrc` has them """
+	for start, length in extents:
+		fsrc.seek(start)
+		fdst.seek(start)
+		while length > 0 and (chunk := fsrc.read(min(chunkSize, length))):
+			if bucket: bucket.consume(len(chunk))
+			fdst.write(chunk)
+			length -= len(chunk)
+	fdst.truncate(size) # the hole at the end, if any
+
+def _writeSparse(fl, data: bytes):
+	""" Writes `data`, skipping over it when it's all zeros so the local file gets a hole instead """
+	if (data == _ZERO_CHUNK) if len(data) == SFTP_CHUNK_SIZE else not data.strip(b"\0"):
+		fl.seek(len(data), _os.SEEK_CUR)
+	else:
+		fl.write(data)
+
+def _writeDense(fl, data: bytes):
+	fl.write(data)
+
+def sftpPut(sftp, localPath: str, remotePath: str, bucket: TokenBucket | None = None, confirm = True):
+	with open(localPath, "rb") as fl:
+		size = _os.fstat(fl.fileno()).st_size
+		extents = dataExtents(fl, size)
+		if extents is None:
+			return sftp.putfo(fl, remotePath, size, callback=throttleCallback(bucket), confirm=confirm)
+
+		with sftp.open(remotePath, "wb") as fr:
+			fr.set_pipelined(True)
+			_copyExtents(fl, fr, extents, size, bucket, SFTP_CHUNK_SIZE)
+	if confirm:
+		attrs = sftp.stat(remotePath)
+		if attrs.st_size != size:
+			raise OSError(f"size mismatch in put!  {attrs.st_size} != {size}")
+		return attrs
+
+def sftpGet(sftp, remotePath: str, localPath: str, bucket: TokenBucket | None = None, isSparse: _Callable[[str], bool] | None = None):
+	"""
+	SFTP can't tell which zeros of the remote file are holes, so runs of zeros are written as holes only
+	when `isSparse` (i.e. asking the remote helper) says the remote file has any - it's asked only for
+	files of at least SPARSE_MIN_SIZE bytes. Everything else is written whole
+	"""
+	with sftp.open(remotePath, "rb") as fr, open(localPath, "wb") as fl:
+		size = fr.stat().st_size
+		write = _writeSparse if isSparse and size >= SPARSE_MIN_SIZE and isSparse(remotePath) else _writeDense
+		if bucket is None:
+			fr.prefetch(size)
+			while data := fr.read(SFTP_CHUNK_SIZE):
+				write(fl, data)
+		else:
+			# fr.prefetch requests the whole file no matter how slowly it is consumed and its
+			# max_concurrent_prefetch_requests busy-waits, so instead read windows of about a quarter of a
+			# second of traffic, each one pipelined with readv, and pay for a window before requesting it
+			window = max(1, int(bucket.rate / 4 / SFTP_CHUNK_SIZE)) * SFTP_CHUNK_SIZE
+			for windowStart in range(0, size, window):
+				windowEnd = min(windowStart + window, size)
+				bucket.consume(windowEnd - windowStart)
+				chunks = [(offset, min(SFTP_CHUNK_SIZE, windowEnd - offset)) for offset in range(windowStart, windowEnd, SFTP_CHUNK_SIZE)]
+				for data in fr.readv(chunks):
+					write(fl, data)
+		fl.truncate() # the skipped zeros at the end, if any
+		if fl.tell() != size:
+			raise OSError(f"size mismatch in get!  {fl.tell()} != {size}")
+
+def _reflink(fsrc, fdst) -> bool:
+	""" Makes `fdst` share the data of `fsrc` without copying it (copy-on-write). False when the filesystem can't """
+	if _fcntl is None:
+		return False
+	try:
+		_fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+		return True
+	except OSError: # not btrfs/XFS, different filesystems or not Linux
+		return False
+
+def _copyFileData(fsrc, fdst, size: int, bucket: TokenBucket | None, chunkSize: int):
+	"""
+	Copies `fsrc` to the empty `fdst` inside the kernel with copy_file_range (which can be offloaded to
+	the filesystem or the storage) or sendfile, with a read/write loop as the last resort. Each method
+	continues where the previous one failed or stopped short of `size` (copy_file_range returns 0
+	early on some filesystems). Elsewhere than on Linux only the read/write loop is used
+	"""
+	src, dst = fsrc.fileno(), fdst.fileno()
+	count = chunkSize if bucket else ZERO_COPY_CHUNK_SIZE
+
+	copied = 0
+	for method in ("copy_file_range", "sendfile", "read") if _LINUX else ("read",):
+		if not hasattr(_os, method):
+			continue
+		_os.lseek(src, copied, _os.SEEK_SET)
+		_os.lseek(dst, copied, _os.SEEK_SET)
+		try:
+			while True:
+				if method == "copy_file_range":
+					done = _os.copy_file_range(src, dst, count, copied, copied)
+				elif method == "sendfile":
+					done = _os.sendfile(dst, src, copied, count)
+				else:
+					data = _os.read(src, min(count, chunkSize))
+					done = len(data)
+					view = memoryview(data)
+					while view:
+						view = view[_os.write(dst, view):]
+				if not done:
+					break
+				copied += done
+				if bucket: bucket.consume(done)
+		except OSError:
+			if method == "read":
+				raise
+			continue # i.e. EXDEV, ENOSYS or EINVAL - try the next method
+		if copied >= size:
+			return
+	raise OSError(_errno.EIO, f"Copied only {copied} of {size} bytes (the file shrank while being copied?)", fsrc.name)
+
+def localCopy(sourcePath: str, destPath: str, bucket: TokenBucket | None = None, follow_symlinks = True, chunkSize = 1024 * 1024):
+	"""
+	Like shutil.copyfile but with a reflink when the filesystem supports it (not with `bucket` as
+	nothing would be read), only the data of sparse files and zero-copy system calls for the rest.
+	Elsewhere than on Linux it is shutil.copyfile itself unless there is a `bucket` (i.e. it uses
+	fcopyfile on macOS)
+	"""
+	if not _LINUX and bucket is None:
+		return _shutil.copyfile(sourcePath, destPath, follow_symlinks=follow_symlinks)
+	if not follow_symlinks and _os.path.islink(sourcePath):
+		return _shutil.copyfile(sourcePath, destPath, follow_symlinks=False) # recreates the link
+	try:
+		sameFile = _os.path.samefile(sourcePath, destPath)
+	except OSError:
+		sameFile = False
+	if sameFile:
+		raise _shutil.SameFileError(f"{sourcePath!r} and {destPath!r} are the same file")
+
+	with open(sourcePath, "rb") as fsrc, open(destPath, "wb") as fdst:
+		if bucket is None and _reflink(fsrc, fdst):
+			return destPath
+		size = _os.fstat(fsrc.fileno()).st_size
+		extents = dataExtents(fsrc, size)
+		if extents is not None:
+			_copyExtents(fsrc, fdst, extents, size, bucket, chunkSize)
+		else:
+			_copyFileData(fsrc, fdst, size, bucket, chunkSize)
+	return destPath
+
+class AdaptiveConcurrency:
+	"""
+	AIMD (additive increase, multiplicative decrease) controller of the number of in-flight jobs.
+
+	Every `window` seconds the aggregate throughput of finished jobs is compared with the previous
+	window. Small jobs (less than `smallJob` bytes) are latency bound so their durations are used as
+	round-trip time samples. The limit:
+	- grows by 1 when the throughput improved and the RTT did not inflate
+	- is halved when the smoothed RTT exceeds `rttTolerance` times the lowest RTT seen, when the
+	  throughput dropped noticeably or when a job failed
+	- stays put otherwise (i.e. when --bwlimit is the bottleneck)
+	"""
+	def __init__(
+		self,
+		maxLimit: int,
+		minLimit = 1,
+		adaptive = True,
+		window = 1.0,
+		rttTolerance = 2.0,
+		smallJob = 64 * 1024,
+	):
+		self.maxLimit = maxLimit
+		self.minLimit = minLimit
+		self.limit = minLimit if adaptive else maxLimit
+		self.adaptive = adaptive
+		self.window = window
+		self.rttTolerance = rttTolerance
+		self.smallJob = smallJob
+
+		self.inFlight = 0
+		self.condition = _threading.Condition()
+
+		self.minRtt = float("inf")
+		self.smoothedRtt = 0.0
+		self.windowStart = _perf_counter()
+		self.windowBytes = 0
+		self.lastThroughput = 0.0
+
+	def acquire(self):
+		with self.condition:
+			while self.inFlight >= self.limit:
+				self.condition.wait()
+			self.inFlight += 1
+
+	def release(self, size: int, duration: float, failed = False):
+		with self.condition:
+			self.inFlight -= 1
+			if self.adaptive:
+				self._update(size, duration, failed)
+			self.condition.notify_all()
+
+	def _update(self, size: int, duration: float, failed: bool):
+		if failed:
+			self.limit = max(self.minLimit, self.limit // 2)
+			return
+
+		if size < self.smallJob:
+			self.minRtt = min(self.minRtt, duration)
+			self.smoothedRtt = duration if not self.smoothedRtt else self.smoothedRtt * 0.875 + duration * 0.125
+
+		self.windowBytes += size
+		now = _perf_counter()
+		elapsed = now - self.windowStart
+		if elapsed < self.window:
+			return
+
+		throughput = self.windowBytes / elapsed
+		congested = self.smoothedRtt > self.minRtt * self.rttTolerance + 0.005 # 5 ms of slack so jitter on fast links does not count
+
+		if congested or throughput < self.lastThroughput * 0.7:
+			self.limit = max(self.minLimit, self.limit // 2)
+		elif throughput >= self.lastThroughput * 1.05:
+			self.limit = min(self.maxLimit, self.limit + 1)
+
+		self.lastThroughput = throughput
+		self.windowStart = now
+		self.windowBytes = 0
+
+class TransferPool:
+	"""
+	Runs file transfers on up to `maxJobs` threads with the number of in-flight transfers driven by
+	an `AdaptiveConcurrency` controller. `submit` blocks while the limit is reached, which keeps
+	directory walkers from running far ahead of the transfers.
+
+	With `maxJobs == 1` and no adaptation jobs run inline in the calling thread, exactly like plain
+	function calls (exceptions included), so the default behaviour of the scripts does not change.
+
+	`errorHandler(exception, *args)` is called in the worker thread when a background job raises.
+	Whatever IT raises is re-raised in the main thread by the next `submit` or by `join`.
+
+	`holdDeferred` makes `defer` wait for `join` even when inline - for callers that submit some
+	transfers only later (i.e. SSH_SYNC's --detect-moves and --dedup)
+	"""
+	def __init__(self, maxJobs = 1, adaptive = False, errorHandler: _Callable | None = None, holdDeferred = False):
+		self.inline = maxJobs <= 1 and not adaptive
+		self.holdDeferred = holdDeferred
+		self.errorHandler = errorHandler
+		self.controller = AdaptiveConcurrency(maxJobs, adaptive=adaptive)
+		self.executor = None if self.inline else _ThreadPoolExecutor(max_workers=maxJobs)
+		self.futures = set()
+		self.deferred = []
+		self.error: BaseException | None = None
+
+	def submit(self, fn: _Callable, size: int, *args):
+		if self.inline:
+			return fn(*args)
+
+		self._raiseError()
+		self.controller.acquire()
+		future = self.executor.submit(self._run, fn, size, args)
+		self.futures.add(future)
+		future.add_done_callback(self.futures.discard)
+
+	def _run(self, fn: _Callable, size: int, args: tuple):
+		start = _perf_counter()
+		failed = False
+		try:
+			fn(*args)
+		except Exception as e:
+			failed = True
+			try:
+				if self.errorHandler is None:
+					raise
+				self.errorHandler(e, *args)
+			except BaseException as err:
+				self.error = self.error or err
+		finally:
+			self.controller.release(size, _perf_counter() - start, failed)
+
+	def defer(self, fn: _Callable, *args):
+		""" Run `fn` once every transfer submitted so far has finished (immediately when inline) """
+		if self.inline and not self.holdDeferred:
+			return fn(*args)
+		self.deferred.append((fn, args))
+
+	def wait(self):
+		""" Waits for every transfer submitted so far, without running the deferred functions """
+		if not self.inline:
+			while self.futures:
+				for future in tuple(self.futures):
+					future.result()
+			self._raiseError()
+
+	def join(self):
+		self.wait()
+
+		deferred, self.deferred = self.deferred, []
+		for fn, args in deferred:
+			fn(*args)
+
+	def shutdown(self):
+		if self.executor is not None:
+			self.executor.shutdown(wait=True)
+
+	def _raiseError(self):
+		if self.error is not None:
+			error, self.error = self.error, None
+			raise error
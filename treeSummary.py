@@ -0,0 +1,90 @@
+"""
+Hash summaries of folder trees: the summary of a folder covers the names, types, modes, sizes and
+modification dates of everything below it, so two folders with equal summaries hold the same files
+and there is nothing to copy or sync between them. Also content hashes of single files.
+
+Stdlib only and without relative imports (like filterEngine) - it's also sent to the remote helper
+(see remoteHelper)
+"""
+import hashlib as _hashlib
+import os as _os
+from typing import Callable as _Callable, Iterable as _Iterable
+
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+def filterAcceptor(files, folders, filesNewerThan: int | None, foldersNewerThan: int | None) -> _Callable[[str, str, bool, int], bool]:
+	"""
+	accept(name, folderPrefix, isDir, mtime) built from CompiledFilters like SSH_SYNC's FilterClass.
+	`folders = None` rejects all folders and a date of None doesn't check the dates
+	"""
+	def accept(name: str, folderPrefix: str, isDir: bool, mtime: int) -> bool:
+		if isDir:
+			return folders is not None and folders(name, folderPrefix) and (foldersNewerThan is None or foldersNewerThan < mtime)
+		return files(name, folderPrefix) and (filesNewerThan is None or filesNewerThan < mtime)
+	return accept
+
+def summarizeTree(
+	root: str,
+	accept: _Callable[[str, str, bool, int], bool] | None = None,
+	filterRoot: str | None = None,
+	modes = True,
+) -> dict[str, str | None]:
+	"""
+	Summaries of `root` and of every folder below it by their path relative to `root` ("" is the root
+	itself, "a/b" is a subfolder). Only files and folders passing `accept` count and the folders which
+	don't pass it are not walked. `folderPrefix` given to `accept` is built from `filterRoot` (`root`
+	by default) so path filters can see the same paths on both sides of a copy. Folders that couldn't
+	be read entirely, and all the folders above them, get None which never equals anything. `modes =
+	False` leaves the permissions out
+	"""
+	summaries = {}
+	filterRoot = (filterRoot if filterRoot is not None else root).rstrip("/") + "/"
+	_summarizeFolder(root.rstrip("/") + "/", "", filterRoot, accept, 0xFFFFFFFF if modes else 0, summaries)
+	return summaries
+
+def _summarizeFolder(folder: str, rel: str, filterPrefix: str, accept, modeMask: int, summaries: dict) -> str | None:
+	digest = _hashlib.blake2b(digest_size=16)
+	complete = True
+	try:
+		with _os.scandir(folder) as it:
+			entries = sorted(it, key=lambda e: e.name)
+	except OSError:
+		summaries[rel.rstrip("/")] = None
+		return None
+
+	for e in entries:
+		isDir = e.is_dir(follow_symlinks=False)
+		if not (isDir or e.is_file(follow_symlinks=False)): # SSH_SYNC skips everything else
+			continue
+		try:
+			info = e.stat(follow_symlinks=False)
+		except OSError:
+			complete = False
+			continue
+
+		mtime = int(info.st_mtime)
+		if accept is not None and not accept(e.name, filterPrefix, isDir, mtime):
+			continue
+
+		if isDir: # folder dates are left out as they change with every change inside and the copies of them are only updated after the fact
+			child = _summarizeFolder(folder + e.name + "/", rel + e.name + "/", filterPrefix + e.name + "/", accept, modeMask, summaries)
+			if child is None:
+				complete = False
+			digest.update(("d/%s/%x/%s\n" % (e.name, info.st_mode & modeMask, child)).encode("utf-8", "surrogateescape"))
+		else:
+			digest.update(("f/%s/%x/%x/%x\n" % (e.name, info.st_mode & modeMask, info.st_size, mtime)).encode("utf-8", "surrogateescape"))
+
+	summary = digest.hexdigest() if complete else None
+	summaries[rel.rstrip("/")] = summary
+	return summary
+
+def digestChunks(chunks: _Iterable[bytes]) -> str:
+	""" Content hash of the concatenated `chunks` - the same one for local and remote files (see fileDigest) """
+	digest = _hashlib.blake2b(digest_size=16)
+	for chunk in chunks:
+		digest.update(chunk)
+	return digest.hexdigest()
+
+def fileDigest(path: str) -> str:
+	with open(path, "rb") as f:
+		return digestChunks(iter(lambda: f.read(DIGEST_CHUNK_SIZE), b""))